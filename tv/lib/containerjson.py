@@ -0,0 +1,100 @@
+# Miro - an RSS based video player application
+# Copyright (C) 2012
+# Participatory Culture Foundation
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# In addition, as a special exception, the copyright holders give
+# permission to link the code of portions of this program with the OpenSSL
+# library.
+#
+# You must obey the GNU General Public License in all respects for all of
+# the code used other than OpenSSL. If you modify file(s) with this
+# exception, you may extend this exception to your version of the file(s),
+# but you are not obligated to do so. If you do not wish to do so, delete
+# this exception statement from your version. If you delete this exception
+# statement from all source files in the program, then also delete it here.
+
+"""``miro.containerjson`` -- JSON format for SchemaReprContainer values.
+
+We used to store SchemaReprContainer values with repr() and load them
+with eval().  That was slow and unsafe.  This module stores them as JSON
+instead, tagging the values that JSON can't represent by itself.  Each one
+becomes an object with a single key:
+
+- tuples: ``{"__tuple__": [...]}``
+- byte strings: ``{"__str__": "..."}`` (decoded as latin-1)
+- datetimes: ``{"__datetime__": [year, month, day, hour, min, sec, usec]}``
+- dicts with non-unicode keys: ``{"__dict__": [[key, value], ...]}``
+
+time.struct_time values are stored as tuples, which is how the old repr()
+format restored them.
+"""
+
+import datetime
+# Don't use simplejson here.  It can return byte strings for ASCII values,
+# but we need to keep unicode and str values distinct.
+import json
+import time
+
+_TAGS = frozenset([u'__tuple__', u'__str__', u'__datetime__', u'__dict__'])
+
+def dumps(value):
+    """Convert a container value to a JSON string."""
+    return json.dumps(_encode(value), separators=(',', ':'))
+
+def loads(string):
+    """Convert a JSON string from dumps() back to a container value.
+
+    :raises ValueError: string is not valid JSON
+    """
+    return json.loads(string, object_hook=_object_hook)
+
+def _encode(value):
+    if isinstance(value, (unicode, bool, int, long, float)) or value is None:
+        return value
+    elif isinstance(value, list):
+        return [_encode(v) for v in value]
+    elif isinstance(value, dict):
+        if (all(isinstance(k, unicode) for k in value) and
+                not (len(value) == 1 and value.keys()[0] in _TAGS)):
+            return dict((k, _encode(v)) for k, v in value.iteritems())
+        return {u'__dict__': [[_encode(k), _encode(v)]
+                              for k, v in value.iteritems()]}
+    elif isinstance(value, (tuple, time.struct_time)):
+        return {u'__tuple__': [_encode(v) for v in value]}
+    elif isinstance(value, str):
+        return {u'__str__': value.decode('latin-1')}
+    elif isinstance(value, datetime.datetime):
+        return {u'__datetime__': [value.year, value.month, value.day,
+                                  value.hour, value.minute, value.second,
+                                  value.microsecond]}
+    else:
+        raise TypeError("Can't convert %r to JSON" % (value,))
+
+def _object_hook(obj):
+    if len(obj) != 1:
+        return obj
+    key, value = obj.items()[0]
+    if key == u'__tuple__':
+        return tuple(value)
+    elif key == u'__str__':
+        return value.encode('latin-1')
+    elif key == u'__datetime__':
+        return datetime.datetime(*value)
+    elif key == u'__dict__':
+        return dict((k, v) for k, v in value)
+    else:
+        return obj
@@ -30,26 +30,35 @@
 """miro.data.connectionpool -- SQLite connection pool """
 import contextlib
 import logging
+import threading
+import time
 
 import sqlite3
 
 from miro import messages
 from miro.data import dbcollations
+from miro.data import storagetuning
 
 class ConnectionLimitError(StandardError):
     """We've hit our connection limits."""
 
+class PoolClosedError(StandardError):
+    """The ConnectionPool was destroyed."""
+
 class Connection(object):
     """Wraps the sqlite3.Connection object."""
     def __init__(self, path):
+        # ConnectionPool makes sure that only 1 thread uses the connection at
+        # a time, so it's safe to turn off check_same_thread.
         self._connection = sqlite3.connect(
-            path, isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES)
+            path, isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False)
 
     def execute(self, sql, values=()):
         return self._connection.execute(sql, values)
 
     def execute_many(self, sql, values):
-        self._connection.execute_many(sql, values)
+        self._connection.executemany(sql, values)
 
     def commit(self):
         self._connection.commit()
@@ -63,74 +72,303 @@ class Connection(object):
 class ConnectionPool(object):
     """Pool of SQLite database connections
 
+    ConnectionPool is thread-safe.  If max_connections are checked out,
+    get_connection() waits for another thread to release one.  If the
+    calling thread has all the connections checked out, nobody can release
+    one while we wait, so we raise ConnectionLimitError right away.  This
+    is the normal case for the frontend, which only uses the pool from one
+    thread.
+
+    Connections that go unused for idle_timeout seconds get closed, as long
+    as we have more than min_connections open.  A timer thread closes them
+    if the pool isn't being used.
+
+    Connections are also tuned with the PRAGMAs from the storagetuning
+    profile for the database, chosen when the pool is created.
+
     :attribute wal_mode: Is the database using WAL mode for its journal?
+    :attribute tuning_profile: StorageTuningProfile for the database
     """
-    def __init__(self, db_path, min_connections=2, max_connections=7):
+    def __init__(self, db_path, min_connections=2, max_connections=7,
+                 timeout=2.0, idle_timeout=60.0, pragmas=None):
         """Create a new ConnectionPool
 
         :param db_path: path to the database to connect to
         :param min_connections: Minimum number of connections to maintain
         :param max_connections: Maximum number of connections to the database
+        :param timeout: default number of seconds get_connection() waits for
+        a free connection.
+        :param idle_timeout: close connections that have been unused for
+        this many seconds
+        :param pragmas: list of (name, value) tuples.  We will run "PRAGMA
+        name=value" for each one on every new connection.  These override
+        the values from the tuning profile.
         """
         self.db_path = db_path
         self.min_connections = min_connections
         self.max_connections = max_connections
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        if pragmas is None:
+            pragmas = []
+        self.pragmas = list(pragmas)
         self.all_connections = set()
+        # list of (connection, release_time) tuples
         self.free_connections = []
-        self._check_wal_mode()
-
-    def _check_wal_mode(self):
+        # maps checked out connections to the time they were checked out
+        self.checkout_times = {}
+        # maps checked out connections to the thread that has them
+        self.checkout_threads = {}
+        # threading.Timer that closes idle connections
+        self.reaper = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self._reset_stats()
+        # Use a single checkout for the setup work, so that it only adds 1
+        # to our stats.
+        connection = self.get_connection()
+        try:
+            self._check_wal_mode(connection)
+            size_info = self._get_size_info(connection)
+        finally:
+            self.release_connection(connection)
+        self._apply_tuning_profile(size_info)
+
+    def _check_wal_mode(self, connection):
         """Try to set journal_mode=wall and return if it was successful
         """
-        connection = self.get_connection()
         cursor = connection.execute("PRAGMA journal_mode=wal");
         self.wal_mode = cursor.fetchone()[0] == u'wal'
         connection.commit()
-        self.release_connection(connection)
+
+    def _get_size_info(self, connection):
+        """Get the page_size, page_count and freelist_count PRAGMAs."""
+        size_info = []
+        for name in ('page_size', 'page_count', 'freelist_count'):
+            row = connection.execute("PRAGMA %s" % name).fetchone()
+            if row is None:
+                break
+            size_info.append(row[0])
+        return size_info
+
+    def _apply_tuning_profile(self, size_info):
+        """Pick a storagetuning profile and add its PRAGMAs to ours."""
+        if len(size_info) != 3:
+            logging.warn("error getting database size.  Not tuning "
+                         "connections for: %s", self.db_path)
+            self.tuning_profile = None
+            return
+        db_size = storagetuning.calc_db_size(*size_info)
+        self.tuning_profile = storagetuning.profile_for_size(db_size)
+        tuning_pragmas = storagetuning.connection_pragmas(
+            self.tuning_profile, self.max_connections)
+        self.set_pragmas(tuning_pragmas + self.pragmas)
+
+    def set_pragmas(self, pragmas):
+        """Change the PRAGMAs that we run on our connections.
+
+        The PRAGMAs will be run on all new connections and all connections
+        that are currently in the pool.  Connections that are checked out
+        will keep their old settings.
+
+        :param pragmas: list of (name, value) tuples
+        """
+        with self.condition:
+            self.pragmas = list(pragmas)
+            for connection, release_time in self.free_connections:
+                self._run_pragmas(connection)
+
+    def _run_pragmas(self, connection):
+        for name, value in self.pragmas:
+            connection.execute("PRAGMA %s=%s" % (name, value))
 
     def _make_new_connection(self):
         # TODO: should have error handling here, but what should we do?
         connection = Connection(self.db_path)
         dbcollations.setup_collations(connection)
-        self.free_connections.append(connection)
+        self._run_pragmas(connection)
         self.all_connections.add(connection)
+        return connection
 
     def destroy(self):
-        """Forcably destroy all connections."""
-        for connection in self.all_connections:
-            connection.close()
-        self.all_connections = []
-        self.free_connections = []
+        """Forcably destroy all connections.
 
-    def get_connection(self):
+        Threads waiting in get_connection() get a PoolClosedError.
+        """
+        with self.condition:
+            self.closed = True
+            self._cancel_reaper()
+            for connection in self.all_connections:
+                connection.close()
+            self.all_connections = set()
+            self.free_connections = []
+            self.checkout_times = {}
+            self.checkout_threads = {}
+            self.condition.notify_all()
+
+    def get_connection(self, timeout=None):
         """Get a new connection to the database
 
         When you're finished with the connection, call release_connection() to
         put it back into the pool.
 
-        If there are max_connections checked out and get_connection() is
-        called again, ConnectionLimitError will be raised.
+        If there are max_connections checked out, we wait for another thread
+        to release one.
 
+        :param timeout: number of seconds to wait for a connection.  If
+        None, we use the timeout passed to our constructor.
+        :raises ConnectionLimitError: no connection was released before the
+        timeout, or the current thread has all the connections checked out
+        :raises PoolClosedError: destroy() was called
         :returns sqlite3.Connection object
         """
-        if not self.free_connections:
-            if len(self.all_connections) < self.max_connections:
-                self._make_new_connection()
+        if timeout is None:
+            timeout = self.timeout
+        current_thread = threading.currentThread()
+        with self.condition:
+            start_time = time.time()
+            deadline = start_time + timeout
+            waited = False
+            while True:
+                if self.closed:
+                    raise PoolClosedError()
+                if (self.free_connections or
+                        len(self.all_connections) < self.max_connections):
+                    break
+                remaining = deadline - time.time()
+                if (remaining <= 0 or
+                        self._all_checked_out_by(current_thread)):
+                    self.stats['timeouts'] += 1
+                    raise ConnectionLimitError()
+                waited = True
+                self.condition.wait(remaining)
+            now = time.time()
+            if waited:
+                wait_time = now - start_time
+                self.stats['waits'] += 1
+                self.stats['total_wait_time'] += wait_time
+                self.stats['max_wait_time'] = max(
+                    self.stats['max_wait_time'], wait_time)
+            if self.free_connections:
+                # use the most recently released connection, so that the
+                # others can go idle and get closed
+                connection, release_time = self.free_connections.pop()
             else:
-                raise ConnectionLimitError()
-        return self.free_connections.pop()
+                connection = self._make_new_connection()
+            self.checkout_times[connection] = now
+            self.checkout_threads[connection] = current_thread
+            self.stats['checkouts'] += 1
+            self.stats['peak_checked_out'] = max(
+                self.stats['peak_checked_out'], len(self.checkout_times))
+            self._close_idle_connections(now)
+            return connection
 
     def release_connection(self, connection):
         """Put a connection back into the pool."""
 
-        if connection not in self.all_connections:
-            raise ValueError("%s not from this pool" % connection)
-        connection.rollback()
-        if len(self.all_connections) > self.min_connections:
-            connection.close()
+        with self.condition:
+            if connection not in self.all_connections:
+                raise ValueError("%s not from this pool" % connection)
+            connection.rollback()
+            now = time.time()
+            checkout_time = now - self.checkout_times.pop(connection, now)
+            self.checkout_threads.pop(connection, None)
+            self.stats['total_checkout_time'] += checkout_time
+            self.stats['max_checkout_time'] = max(
+                self.stats['max_checkout_time'], checkout_time)
+            self.free_connections.append((connection, now))
+            self._close_idle_connections(now)
+            self._schedule_reaper(now)
+            self.condition.notify()
+
+    def _all_checked_out_by(self, thread):
+        for checkout_thread in self.checkout_threads.itervalues():
+            if checkout_thread is not thread:
+                return False
+        return True
+
+    def _schedule_reaper(self, now):
+        """Make sure we close idle connections, even if the pool isn't used.
+        """
+        if (self.reaper is not None or self.closed or
+                len(self.all_connections) <= self.min_connections or
+                not self.free_connections):
+            return
+        connection, release_time = self.free_connections[0]
+        delay = max(release_time + self.idle_timeout - now, 0)
+        self.reaper = threading.Timer(delay, self._run_reaper)
+        self.reaper.setDaemon(True)
+        self.reaper.start()
+
+    def _cancel_reaper(self):
+        if self.reaper is not None:
+            self.reaper.cancel()
+            self.reaper = None
+
+    def _run_reaper(self):
+        with self.condition:
+            self.reaper = None
+            if self.closed:
+                return
+            now = time.time()
+            self._close_idle_connections(now)
+            self._schedule_reaper(now)
+
+    def _close_idle_connections(self, now):
+        """Close connections that have been unused for too long.
+
+        We keep at least min_connections open.  free_connections is ordered
+        by release time, so the idle connections are at the start.
+        """
+        while (self.free_connections and
+               len(self.all_connections) > self.min_connections):
+            connection, release_time = self.free_connections[0]
+            if now - release_time < self.idle_timeout:
+                break
+            del self.free_connections[0]
             self.all_connections.remove(connection)
-        else:
-            self.free_connections.append(connection)
+            connection.close()
+            self.stats['idle_closed'] += 1
+
+    def get_stats(self):
+        """Get statistics for this pool.
+
+        :returns: dict with these keys:
+            - checkouts: number of times get_connection() succeeded
+            - waits: number of times get_connection() had to wait
+            - timeouts: number of times get_connection() timed out
+            - total_wait_time/max_wait_time: time spent waiting in
+              get_connection()
+            - total_checkout_time/max_checkout_time: time between
+              get_connection() and release_connection()
+            - peak_checked_out: max number of connections checked out at
+              once
+            - idle_closed: number of idle connections we closed
+            - open: number of open connections
+            - checked_out: number of connections checked out
+        """
+        with self.condition:
+            stats = self.stats.copy()
+            stats['open'] = len(self.all_connections)
+            stats['checked_out'] = len(self.checkout_times)
+            return stats
+
+    def reset_stats(self):
+        with self.condition:
+            self._reset_stats()
+
+    def _reset_stats(self):
+        self.stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'total_wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'total_checkout_time': 0.0,
+            'max_checkout_time': 0.0,
+            'peak_checked_out': 0,
+            'idle_closed': 0,
+        }
 
     @contextlib.contextmanager
     def context(self):
@@ -153,9 +391,11 @@ class DeviceConnectionPool(ConnectionPool):
         # min_connections is 0 since we should normally not have any
         # connections to the device database.  The max connections is 2 in
         # case the user is on the video tab and is playing items from the
-        # audio tab (or vice-versa)
+        # audio tab (or vice-versa).  idle_timeout is 0 so that we close
+        # connections as soon as they're released.
         ConnectionPool.__init__(self, device_info.sqlite_path,
-                                min_connections=0, max_connections=2)
+                                min_connections=0, max_connections=2,
+                                idle_timeout=0)
 
 class ShareConnectionPool(ConnectionPool):
     """ConnectionPool for a DAAP share."""
@@ -167,7 +407,8 @@ class ShareConnectionPool(ConnectionPool):
         #   - switching away from tab #2
         #   - switching to tab #3
         ConnectionPool.__init__(self, share_info.sqlite_path,
-                                min_connections=0, max_connections=3)
+                                min_connections=0, max_connections=3,
+                                idle_timeout=0)
 
 class ConnectionPoolTracker(object):
     """Manage ConnectionPool for the frontend
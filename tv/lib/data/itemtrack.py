@@ -29,6 +29,7 @@
 
 """miro.data.itemtrack -- Track Items in the database
 """
+import bisect
 import collections
 import logging
 import string
@@ -61,14 +62,48 @@ ItemTrackerCondition = util.namedtuple(
 
 ItemTrackerOrderBy = util.namedtuple(
     "ItemTrackerOrderBy",
-    "columns sql",
+    "columns sql terms",
 
     """ItemTrackerOrderBy defines one term for the ORDER BY clause of a query.
 
     :attribute columns: list of (table, column) tuples used in the query
     :attribute sql: sql expression
+    :attribute terms: list of (table, column, descending, collation) tuples
+    for each term in sql, or None if sql is a complex expression
     """)
 
+def _sqlite_type_rank(value):
+    """Get the rank of a value's type in SQLite's sort order.
+
+    SQLite sorts NULLs first, then numbers, then text, then blobs.
+    """
+    if value is None:
+        return 0
+    elif isinstance(value, (int, long, float)):
+        return 1
+    elif isinstance(value, buffer):
+        return 3
+    else:
+        return 2
+
+class _SQLiteValue(object):
+    """Wraps a value from the database so it compares like SQLite does."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __cmp__(self, other):
+        return cmp((_sqlite_type_rank(self.value), self.value),
+                   (_sqlite_type_rank(other.value), other.value))
+
+class _DescendingValue(_SQLiteValue):
+    """Wraps a value from the database for a DESC ORDER BY term."""
+    __slots__ = ()
+
+    def __cmp__(self, other):
+        return -_SQLiteValue.__cmp__(self, other)
+
 class ItemTrackerQueryBase(object):
     """Query used to select item ids for ItemTracker.  """
 
@@ -95,6 +130,20 @@ class ItemTrackerQueryBase(object):
             return True
         return False
 
+    def can_update_incrementally(self, message):
+        """Given a ItemChanges message, can ItemTracker update its id list
+        without re-running the entire query?
+
+        This is only possible if we know exactly which items could have
+        changed position, which means that message.added, message.changed,
+        and message.removed must contain all the items that could be
+        affected.  We also need an ORDER BY clause that make_sort_key() can
+        handle, so that we can calculate where items go in the list, and no
+        LIMIT clause, since adding/removing an item could push other items
+        in/out of the list.
+        """
+        return self.can_make_sort_keys() and self.limit is None
+
     def _parse_column(self, column):
         """Parse a column specification.
 
@@ -181,6 +230,7 @@ class ItemTrackerQueryBase(object):
 
         sql_parts = []
         order_by_columns = []
+        terms = []
         for column, collation in zip(columns, collations):
             if column[0] == '-':
                 descending = True
@@ -189,10 +239,11 @@ class ItemTrackerQueryBase(object):
                 descending = False
             table, column = self._parse_column(column)
             order_by_columns.append((table, column))
+            terms.append((table, column, descending, collation))
             sql_parts.append(self._order_by_expression(table, column,
                                                        descending, collation))
         self.order_by = ItemTrackerOrderBy(order_by_columns,
-                                           ', '.join(sql_parts))
+                                           ', '.join(sql_parts), terms)
 
     def set_complex_order_by(self, columns, sql):
         """Change the ORDER BY clause to a complex SQL expression
@@ -201,7 +252,7 @@ class ItemTrackerQueryBase(object):
         :param sql: SQL to execute
         """
         order_by_columns = [self._parse_column(c) for c in columns]
-        self.order_by = ItemTrackerOrderBy(order_by_columns, sql)
+        self.order_by = ItemTrackerOrderBy(order_by_columns, sql, None)
 
     def _order_by_expression(self, table, column, descending, collation):
         parts = []
@@ -243,24 +294,111 @@ class ItemTrackerQueryBase(object):
         other_tables.discard('item')
         return other_tables
 
-    def select_ids(self, connection):
+    def select_ids(self, connection, id_list=None):
         """Run the select statement for this query
 
+        :param id_list: if given, only select items with ids in this list.
         :returns: list of item ids
         """
+        sql, arg_list = self.select_ids_sql(id_list)
+        logging.debug("ItemTracker: running query %s (%s)", sql, arg_list)
+        item_ids = [row[0] for row in connection.execute(sql, arg_list)]
+        logging.debug("ItemTracker: done running query")
+        return item_ids
+
+    def select_ids_sql(self, id_list=None):
+        """Get the SQL statement that select_ids() runs.
+
+        :returns: (sql, arg_list) tuple
+        """
         sql_parts = []
         arg_list = []
         sql_parts.append("SELECT %s.id FROM %s" %
                          (self.table_name(), self.table_name()))
         self._add_joins(sql_parts, arg_list)
-        self._add_conditions(sql_parts, arg_list)
+        self._add_conditions(sql_parts, arg_list, id_list)
         self._add_order_by(sql_parts, arg_list)
         self._add_limit(sql_parts, arg_list)
+        return ' '.join(sql_parts), arg_list
+
+    def can_make_sort_keys(self):
+        """Can make_sort_key() calculate sort keys for this query?
+
+        This works for queries with simple ORDER BY columns, but not complex
+        expressions or collations other than the default one, since python
+        can't compare values the way those do.
+        """
+        if self.order_by is None or self.order_by.terms is None:
+            return False
+        for table, column, descending, collation in self.order_by.terms:
+            if collation is not None:
+                return False
+        return True
+
+    def make_sort_key(self, row):
+        """Make a sort key from a row returned by select_sort_keys()
+
+        Sort keys compare the same way that our ORDER BY clause orders rows,
+        including the id column that we use to break ties.
+        """
+        key = []
+        for (table, column, descending, collation), value in \
+                zip(self.order_by.terms, row[1:]):
+            if descending:
+                key.append(_DescendingValue(value))
+            else:
+                key.append(_SQLiteValue(value))
+        key.append(row[0])
+        return tuple(key)
+
+    def _sort_key_columns(self):
+        return ', '.join(['%s.id' % self.table_name()] +
+                         ['%s.%s' % (table, column)
+                          for (table, column, descending, collation)
+                          in self.order_by.terms])
+
+    def _sort_key_joins(self, sql_parts):
+        join_tables = set(table for (table, column) in self.order_by.columns)
+        join_tables.discard(self.table_name())
+        for table in join_tables:
+            sql_parts.append(self.join_sql(table))
+
+    def select_sort_keys(self, connection, id_list):
+        """Select the items in id_list that match our conditions and
+        calculate their sort keys.
+
+        Be careful to only use this for short lists (see
+        util.split_values_for_sqlite())
+
+        :returns: list of (id, sort_key) tuples
+        """
+        sql_parts = []
+        arg_list = []
+        sql_parts.append("SELECT %s FROM %s" % (self._sort_key_columns(),
+                                                self.table_name()))
+        self._add_joins(sql_parts, arg_list)
+        self._add_conditions(sql_parts, arg_list, id_list)
         sql = ' '.join(sql_parts)
-        logging.debug("ItemTracker: running query %s (%s)", sql, arg_list)
-        item_ids = [row[0] for row in connection.execute(sql, arg_list)]
-        logging.debug("ItemTracker: done running query")
-        return item_ids
+        return [(row[0], self.make_sort_key(row))
+                for row in connection.execute(sql, arg_list)]
+
+    def select_sort_keys_for_table(self, connection, id_table):
+        """Calculate sort keys for all the items in an ItemIdTable.
+
+        Our conditions aren't checked.  Items that aren't in the database
+        anymore are skipped.
+
+        :returns: list of (id, sort_key) tuples
+        """
+        sql_parts = []
+        sql_parts.append("SELECT %s FROM %s JOIN %s ON %s.id=%s.id" %
+                         (self._sort_key_columns(), id_table.name,
+                          self.table_name(), self.table_name(),
+                          id_table.name))
+        self._sort_key_joins(sql_parts)
+        sql = ' '.join(sql_parts)
+        return [(row[0], self.make_sort_key(row))
+                for row in connection.execute(sql)]
 
     def select_item_data(self, connection):
         """Run the select statement for this query
@@ -321,9 +459,7 @@ class ItemTrackerQueryBase(object):
         if self.match_string:
             sql_parts.append(self.join_sql('item_fts'))
 
-    def _add_conditions(self, sql_parts, arg_list):
-        if not (self.conditions or self.match_string):
-            return
+    def _add_conditions(self, sql_parts, arg_list, id_list=None):
         where_parts = []
         for c in self.conditions:
             where_parts.append(c.sql)
@@ -331,17 +467,42 @@ class ItemTrackerQueryBase(object):
         if self.match_string:
             where_parts.append("item_fts MATCH ?")
             arg_list.append(self.match_string)
+        if id_list is not None:
+            where_parts.append("%s.id IN (%s)" % (self.table_name(),
+                                                  _id_placeholders(id_list)))
+            arg_list.extend(id_list)
+        if not where_parts:
+            return
         sql_parts.append("WHERE %s" % ' AND '.join(
             '(%s)' % part for part in where_parts))
 
     def _add_order_by(self, sql_parts, arg_list):
         if self.order_by:
-            sql_parts.append("ORDER BY %s" % self.order_by.sql)
+            # Use id to break ties, so that the order is always the same.
+            sql_parts.append("ORDER BY %s, %s.id" % (self.order_by.sql,
+                                                     self.table_name()))
 
     def _add_limit(self, sql_parts, arg_list):
         if self.limit is not None:
             sql_parts.append("LIMIT %s" % self.limit)
 
+    def cache_key(self):
+        """Get a key that identifies this query.
+
+        Queries that select the same items in the same order have equal
+        keys, even if their conditions were added in a different order.
+        ItemTrackerResultCache uses this to share results between
+        ItemTrackers.
+        """
+        conditions = sorted((c.sql, tuple(c.values))
+                            for c in self.conditions)
+        if self.order_by:
+            order_by_sql = self.order_by.sql
+        else:
+            order_by_sql = None
+        return (self.__class__, tuple(conditions), self.match_string,
+                order_by_sql, self.limit)
+
     def copy(self):
         retval = self.__class__()
         retval.conditions = self.conditions[:]
@@ -352,16 +513,31 @@ class ItemTrackerQueryBase(object):
 class ItemTrackerQuery(ItemTrackerQueryBase):
     """ItemTrackerQuery for items in the main db."""
 
-    def could_list_change(self, message):
-        """Given a ItemChanges message, could the id list change?
+    def _other_tables_changed(self, message):
+        """Did an ItemChanges message change rows in other tables that we
+        track?
+
+        In this case, we don't know which items were affected by the change.
         """
         other_tables = self.get_other_tables_to_track()
         if message.dlstats_changed and 'remote_downloader' in other_tables:
             return True
         if message.playlists_changed and 'playlist_item_map' in other_tables:
             return True
+        return False
+
+    def could_list_change(self, message):
+        """Given a ItemChanges message, could the id list change?
+        """
+        if self._other_tables_changed(message):
+            return True
         return ItemTrackerQueryBase.could_list_change(self, message)
 
+    def can_update_incrementally(self, message):
+        if self._other_tables_changed(message):
+            return False
+        return ItemTrackerQueryBase.can_update_incrementally(self, message)
+
 class DeviceItemTrackerQuery(ItemTrackerQueryBase):
     """ItemTrackerQuery for DeviceItems."""
 
@@ -385,6 +561,218 @@ class SharingItemTrackerQuery(ItemTrackerQueryBase):
         else:
             return ItemTrackerQueryBase.could_list_change(self, message)
 
+    def can_update_incrementally(self, message):
+        if message.changed_playlists and self.tracking_playlist_map():
+            return False
+        else:
+            return ItemTrackerQueryBase.can_update_incrementally(self,
+                                                                message)
+
+ItemChangesOutcome = util.namedtuple(
+    "ItemChangesOutcome",
+    "result signal args",
+
+    """ItemChangesOutcome stores how an ItemChanges message was handled.
+
+    :attribute result: ItemTrackerResult to use after the message.  This is
+    None if there was a database error.
+    :attribute signal: signal to emit, either "items-changed" or
+    "list-changed".  "list-spliced" means that the result's id list was
+    updated in place.  In that case, args is (removed_ids, first_changed)
+    and we emit "list-changed".
+    :attribute args: arguments for the signal
+    """)
+
+class ItemTrackerResult(object):
+    """Result of running an ItemTrackerQuery.
+
+    ItemTrackerResults are shared between ItemTrackers that have identical
+    queries.  This way we only run each query once per ItemChanges message
+    and only use 1 database connection for all of the ItemTrackers.
+
+    The first ItemTracker to handle an ItemChanges message updates the
+    result and stores an ItemChangesOutcome for it.  The other ItemTrackers
+    use that outcome rather than handling the message again.  This means
+    that all ItemTrackers that share a result need to be sent the same
+    ItemChanges messages.
+
+    :attribute key: key for this result in ItemTrackerResultCache
+    :attribute id_list: list of ids selected by the query
+    :attribute id_to_index: dict that maps ids to their index in id_list
+    :attribute sort_keys: sort keys for the items in id_list, or None if
+    they haven't been fetched yet (see ItemTrackerQueryBase.make_sort_key())
+    :attribute item_fetcher: ItemFetcher for id_list
+    :attribute trackers: ItemTrackers that are using this result
+    """
+    def __init__(self, key, id_list, item_fetcher):
+        self.key = key
+        self.trackers = set()
+        self.finished_trackers = set()
+        self.message = None
+        self.outcome = None
+        self.set_id_list(id_list)
+        self.item_fetcher = item_fetcher
+
+    def set_id_list(self, id_list):
+        self.id_list = id_list
+        self.id_to_index = dict((id_, i) for i, id_ in enumerate(id_list))
+        self.sort_keys = None
+
+    def splice(self, remove_ids, inserts):
+        """Update id_list in place.
+
+        We remove items, then insert new ones where their sort keys belong.
+        id_list, sort_keys and id_to_index are shared with our ItemTrackers
+        and ItemFetcher, so we change them rather than making new ones.
+        id_to_index only gets updated for the rows after the first change.
+
+        sort_keys must be set before calling this.
+
+        :param remove_ids: ids to remove from the list
+        :param inserts: list of (id, sort_key) tuples to add
+        :returns: index of the first row that changed, or None if the list
+        is the same as before
+        """
+        old_positions = dict((id_, self.id_to_index[id_])
+                             for id_ in remove_ids
+                             if id_ in self.id_to_index)
+        for pos in sorted(old_positions.values(), reverse=True):
+            del self.id_list[pos]
+            del self.sort_keys[pos]
+        changed_positions = old_positions.values()
+        for id_, sort_key in sorted(inserts, key=lambda i: i[1]):
+            pos = bisect.bisect_left(self.sort_keys, sort_key)
+            self.id_list.insert(pos, id_)
+            self.sort_keys.insert(pos, sort_key)
+            changed_positions.append(pos)
+        if not changed_positions:
+            return None
+        for id_ in old_positions:
+            del self.id_to_index[id_]
+        first_changed = min(changed_positions)
+        for i in xrange(first_changed, len(self.id_list)):
+            self.id_to_index[self.id_list[i]] = i
+        inserted_ids = set(id_ for id_, sort_key in inserts)
+        if inserted_ids == set(old_positions) and all(
+            self.id_to_index[id_] == pos
+            for id_, pos in old_positions.iteritems()):
+            return None
+        return first_changed
+
+    def add_tracker(self, tracker):
+        self.trackers.add(tracker)
+
+    def remove_tracker(self, tracker):
+        """Remove an ItemTracker from this result
+
+        :returns: True if no ItemTrackers are using the result anymore
+        """
+        self.trackers.discard(tracker)
+        self.finished_trackers.discard(tracker)
+        if self.trackers:
+            return False
+        if self.item_fetcher is not None:
+            self.item_fetcher.destroy()
+            self.item_fetcher = None
+        return True
+
+    def is_finished(self):
+        """Have all of our ItemTrackers loaded all their rows?"""
+        return bool(self.trackers) and self.finished_trackers == self.trackers
+
+    def done_fetching(self, tracker):
+        """Called when an ItemTracker has fetched all of its rows.
+
+        Once this is called for all our ItemTrackers, we call
+        ItemFetcher.done_fetching().
+        """
+        self.finished_trackers.add(tracker)
+        if self.is_finished():
+            self.item_fetcher.done_fetching()
+
+    def get_outcome(self, message):
+        """Get the ItemChangesOutcome for an ItemChanges message.
+
+        :returns: ItemChangesOutcome, or None if the message hasn't been
+        handled yet.
+        """
+        if message is self.message:
+            return self.outcome
+        else:
+            return None
+
+    def set_outcome(self, message, outcome):
+        self.message = message
+        self.outcome = outcome
+
+class ItemTrackerResultCache(object):
+    """Share ItemTrackerResults between ItemTrackers with identical queries.
+
+    Results get stored by their ItemSource's connection pool and the
+    cache_key() of their query.  Results are reference counted by the
+    ItemTrackers that use them.  When the last ItemTracker releases a
+    result, we destroy its ItemFetcher and drop it from the cache.
+    """
+    def __init__(self):
+        self.results = {}
+
+    def _make_key(self, item_source, query):
+        return (item_source.connection_pool, item_source.__class__,
+                query.cache_key())
+
+    def get(self, item_source, query, force=False):
+        """Get an ItemTrackerResult for a query.
+
+        :param item_source: ItemSource to fetch items from
+        :param query: ItemTrackerQuery to run
+        :param force: Always run the query, even if there's a cached result
+        :raises sqlite3.DatabaseError: error running the query
+        """
+        key = self._make_key(item_source, query)
+        result = self.results.get(key)
+        if (result is not None and not force and
+            not self._result_outdated(result)):
+            return result
+        result = self._fetch_result(key, item_source, query)
+        self.results[key] = result
+        return result
+
+    def _result_outdated(self, result):
+        """Check if a cached result is too old for a new ItemTracker.
+
+        Once all the ItemTrackers have fetched their rows, ItemFetcherWAL
+        ends its read transaction, so the new ItemTracker would read newer
+        data than the id list.  In that case, we start a new transaction and
+        only use the result if no items have been added/removed.
+        """
+        if not result.is_finished():
+            return False
+        return result.item_fetcher.refresh_items(())
+
+    def _fetch_result(self, key, item_source, query):
+        connection = item_source.get_connection()
+        try:
+            connection.execute("BEGIN TRANSACTION")
+            id_list = query.select_ids(connection)
+            if item_source.wal_mode():
+                klass = ItemFetcherWAL
+            else:
+                klass = ItemFetcherNoWAL
+            item_fetcher = klass(connection, item_source, query, id_list)
+        except:
+            item_source.release_connection(connection)
+            raise
+        return ItemTrackerResult(key, id_list, item_fetcher)
+
+    def release(self, result, tracker):
+        """Release a result that was returned from get()"""
+        if result.remove_tracker(tracker):
+            if self.results.get(result.key) is result:
+                del self.results[result.key]
+
+# Results shared by all ItemTrackers
+result_cache = ItemTrackerResultCache()
+
 class ItemTracker(signals.SignalEmitter):
     """Track items in the database
 
@@ -408,6 +796,10 @@ class ItemTracker(signals.SignalEmitter):
 
     # how many rows we fetch at one time in _ensure_row_loaded()
     FETCH_ROW_CHUNK_SIZE = 25
+    # max number of items we will splice into the list in
+    # _update_id_list_incrementally().  Each one shifts the rows after it, so
+    # for bigger changes we just refetch the list.
+    INCREMENTAL_UPDATE_LIMIT = 50
 
     def __init__(self, idle_scheduler, query, item_source):
         """Create an ItemTracker
@@ -424,6 +816,7 @@ class ItemTracker(signals.SignalEmitter):
         self.create_signal("list-changed")
         self.idle_scheduler = idle_scheduler
         self.idle_work_scheduled = False
+        self.result = None
         self.item_fetcher = None
         self.item_source = item_source
         self._db_retry_callback_pending = False
@@ -445,27 +838,12 @@ class ItemTracker(signals.SignalEmitter):
         We will release any open connections to the database and reset our
         self to an empty list.
         """
-        self._destroy_item_fetcher()
+        if self.result is not None:
+            result_cache.release(self.result, self)
+            self.result = None
+        self.item_fetcher = None
         self.id_list = self.id_to_index = self.row_data = None
 
-    def make_item_fetcher(self, connection, id_list):
-        """Make an ItemFetcher to use.
-
-        :param connection: sqlite Connection to use.  We will return data from
-        this connection without commiting any pending read transaction.
-        :param id_list: list of ids that we will have to fetch.
-        """
-        if self.item_source.wal_mode():
-            klass = ItemFetcherWAL
-        else:
-            klass = ItemFetcherNoWAL
-        return klass(connection, self.item_source, id_list)
-
-    def _destroy_item_fetcher(self):
-        if self.item_fetcher:
-            self.item_fetcher.destroy()
-            self.item_fetcher = None
-
     def _run_db_error_dialog(self):
         if self._db_retry_callback_pending:
             return
@@ -486,24 +864,50 @@ class ItemTracker(signals.SignalEmitter):
         """Change our ItemTrackerQuery object."""
         self.query = query
 
-    def _fetch_id_list(self):
-        """Fetch the ids for this list.  """
-        self._destroy_item_fetcher()
+    def _fetch_id_list(self, force=False):
+        """Fetch the ids for this list.
+
+        :param force: run our query, even if another ItemTracker has a
+        result for it that we could share.
+        """
         try:
-            connection = self.item_source.get_connection()
-            connection.execute("BEGIN TRANSACTION")
-            self.id_list = self.query.select_ids(connection)
-            self.item_fetcher = self.make_item_fetcher(connection, self.id_list)
+            result = result_cache.get(self.item_source, self.query, force)
         except sqlite3.DatabaseError, e:
             logging.warn("%s while fetching items", e, exc_info=True)
             self._make_empty_list_after_db_error()
-        self.id_to_index = dict((id_, i) for i, id_ in enumerate(self.id_list))
+        else:
+            self._set_result(result)
+
+    def _set_result(self, result):
+        """Start using a new ItemTrackerResult.
+
+        :param result: ItemTrackerResult to use, or None to use an empty list
+        """
+        old_result = self.result
+        self.result = result
+        if result is not None:
+            result.add_tracker(self)
+        if old_result is not None and old_result is not result:
+            result_cache.release(old_result, self)
         self.row_data = {}
+        # rows before this index are known to be loaded
+        self.idle_load_pos = 0
+        self._sync_with_result()
+
+    def _sync_with_result(self):
+        """Update our id list to match our ItemTrackerResult."""
+        if self.result is not None:
+            self.id_list = self.result.id_list
+            self.id_to_index = self.result.id_to_index
+            self.item_fetcher = self.result.item_fetcher
+        else:
+            self.id_list = []
+            self.id_to_index = {}
+            self.item_fetcher = None
 
     def _make_empty_list_after_db_error(self):
-        self.id_list = []
+        self._set_result(None)
         self._run_db_error_dialog()
-        self.item_fetcher = None
 
     def _schedule_idle_work(self):
         """Schedule do_idle_work to be called some time in the
@@ -519,7 +923,8 @@ class ItemTracker(signals.SignalEmitter):
             # destroy() was called while the idle callback was still
             # scheduled.  Just return.
             return
-        for i in xrange(len(self.id_list)):
+        for i in xrange(self.idle_load_pos, len(self.id_list)):
+            self.idle_load_pos = i
             if not self._row_loaded(i):
                 # row data unloaded, call _ensure_row_loaded to load this row
                 # and adjecent rows then schedule another run later
@@ -527,19 +932,22 @@ class ItemTracker(signals.SignalEmitter):
                 self._schedule_idle_work()
                 return
         # no rows need loading
-        self.item_fetcher.done_fetching()
+        self.idle_load_pos = len(self.id_list)
+        self.result.done_fetching(self)
 
     def _uncache_row_data(self, id_list):
         for id_ in id_list:
             if id_ in self.row_data:
                 del self.row_data[id_]
+                self.idle_load_pos = min(self.idle_load_pos,
+                                         self.id_to_index[id_])
 
     def _refetch_id_list(self, send_signals=True):
         """Refetch a new id list after we already have one."""
 
         if send_signals:
             self.emit('will-change')
-        self._fetch_id_list()
+        self._fetch_id_list(force=True)
         if send_signals:
             self.emit("list-changed")
 
@@ -580,11 +988,15 @@ class ItemTracker(signals.SignalEmitter):
         return id_ in self.row_data
 
     def _ensure_row_loaded(self, index):
-        """Ensure that we have an entry in self._item_rows for index."""
+        """Ensure that we have an entry in self._item_rows for index.
+
+        :returns: list of ItemInfos that we loaded (empty if the row was
+        already loaded)
+        """
 
         if self._row_loaded(index):
             # we've already loaded the row for index
-            return
+            return []
         rows_to_load = [index]
         # as long as we're reading from disk, load a chunk of rows instead of
         # just one.
@@ -597,13 +1009,14 @@ class ItemTracker(signals.SignalEmitter):
                 rows_to_load.append(i)
                 if len(rows_to_load) >= self.FETCH_ROW_CHUNK_SIZE:
                     break
-        self._load_rows(rows_to_load)
+        return self._load_rows(rows_to_load)
 
     def _load_rows(self, rows_to_load):
         """Query the database to fetch a set of items and put the data in
         self.row_data
 
         :param rows_to_load: indexes of the rows to load.
+        :returns: list of ItemInfos that we loaded
         """
         ids_to_load = set(self.id_list[i] for i in rows_to_load)
         try:
@@ -623,6 +1036,16 @@ class ItemTracker(signals.SignalEmitter):
             msg = ("ItemFetcher didn't return the correct rows "
                    "(extra: %s, missing: %s)" % (extra, missing))
             raise AssertionError(msg)
+        return items
+
+    def _rows_loaded_on_demand(self, item_infos):
+        """Called when get_row() had to load rows from the database.
+
+        Unlike rows loaded in do_idle_work(), these are rows that someone
+        is asking for right now.  Subclasses can override this to react to
+        that.  By default it does nothing.
+        """
+        pass
 
     def item_in_list(self, item_id):
         """Test if an item is in the list.
@@ -642,7 +1065,9 @@ class ItemTracker(signals.SignalEmitter):
 
         :raises IndexError: index out of range
         """
-        self._ensure_row_loaded(index)
+        loaded = self._ensure_row_loaded(index)
+        if loaded:
+            self._rows_loaded_on_demand(loaded)
         try:
             id_ = self.id_list[index]
         except IndexError:
@@ -668,7 +1093,9 @@ class ItemTracker(signals.SignalEmitter):
         :param new_query: ItemTrackerQuery object
         """
         self._set_query(new_query)
-        self._refetch_id_list()
+        self.emit('will-change')
+        self._fetch_id_list()
+        self.emit('list-changed')
 
     def on_item_changes(self, message):
         """Call this when items get changed and the list needs to be
@@ -683,33 +1110,172 @@ class ItemTracker(signals.SignalEmitter):
         changed_ids = [item_id for item_id in message.changed
                        if self.item_in_list(item_id)]
         self._uncache_row_data(changed_ids)
-        if self._could_list_change(message):
-            self._refetch_id_list(send_signals=False)
-            self.emit("list-changed")
-        else:
-            if len(self.id_list) == 0:
+        outcome = None
+        if self.result is not None:
+            # check if another ItemTracker sharing our result already handled
+            # the message
+            outcome = self.result.get_outcome(message)
+        if outcome is None:
+            outcome = self._handle_item_changes(message, changed_ids)
+            if self.result is not None:
+                self.result.set_outcome(message, outcome)
+        self._apply_outcome(outcome)
+
+    def _handle_item_changes(self, message, changed_ids):
+        """Calculate how an ItemChanges message changes our list.
+
+        This updates our ItemTrackerResult, but doesn't change our id list.
+        _apply_outcome() handles that for us and all the other ItemTrackers
+        sharing the result.
+
+        :returns: ItemChangesOutcome
+        """
+        try:
+            if self._could_list_change(message):
+                outcome = self._update_id_list_incrementally(message)
+                if outcome is None:
+                    outcome = self._refetch_for_changes()
+            elif len(self.id_list) == 0:
                 # special case when the list is empty.  This avoids accessing
                 # item_fetcher after _make_empty_list_after_db_error() is
                 # called.
-                self.emit("list-changed")
-                return
-            try:
-                need_refetch = self.item_fetcher.refresh_items(changed_ids)
-            except sqlite3.DatabaseError, e:
-                logging.warn("%s while refreshing items", e, exc_info=True)
+                outcome = ItemChangesOutcome(self.result, 'list-changed', ())
+            elif self.item_fetcher.refresh_items(changed_ids):
+                outcome = self._refetch_for_changes()
+            else:
+                outcome = ItemChangesOutcome(self.result, 'items-changed',
+                                             (changed_ids,))
+        except sqlite3.DatabaseError, e:
+            logging.warn("%s while handling item changes", e, exc_info=True)
+            outcome = ItemChangesOutcome(None, 'list-changed', ())
+        return outcome
+
+    def _refetch_for_changes(self):
+        """Re-run our query after an ItemChanges message."""
+        result = result_cache.get(self.item_source, self.query, force=True)
+        return ItemChangesOutcome(result, 'list-changed', ())
+
+    def _apply_outcome(self, outcome):
+        """Update our list for an ItemChangesOutcome and emit signals."""
+        if outcome.result is not self.result:
+            if outcome.result is None:
                 self._make_empty_list_after_db_error()
-                self.emit("list-changed")
-                return
-            if not need_refetch:
-                self.emit('items-changed', changed_ids)
             else:
-                self._refetch_id_list(send_signals=False)
-                self.emit("list-changed")
+                self._set_result(outcome.result)
+            self.emit('list-changed')
+        elif outcome.signal == 'list-spliced':
+            removed, first_changed = outcome.args
+            for id_ in removed:
+                self.row_data.pop(id_, None)
+            self._sync_with_result()
+            # rows before the first change didn't move, so we don't need to
+            # check them again.
+            self.idle_load_pos = min(self.idle_load_pos, first_changed)
+            self.emit('list-changed')
+        else:
+            self.emit(outcome.signal, *outcome.args)
 
     def _could_list_change(self, message):
         """Calculate if an ItemChanges means the list may have changed."""
         return self.query.could_list_change(message)
 
+    def _update_id_list_incrementally(self, message):
+        """Try to update our id list without re-running our query.
+
+        We check our conditions for the added/changed items, then splice the
+        ones that match into id_list, using a binary search on the sort keys
+        to find their positions.  We fetch the sort keys for the entire list
+        the first time we do this, after that we only fetch them for the
+        items that change.  For big lists where only a few items change,
+        this is much faster than selecting and sorting the entire list
+        again.
+
+        :returns: ItemChangesOutcome, or None if the caller should refetch
+        the entire list instead.
+        """
+        if (self.item_fetcher is None or
+            not self.query.can_update_incrementally(message)):
+            return None
+        removed_ids = set(message.removed)
+        check_ids = (set(message.added) | set(message.changed)) - removed_ids
+        need_refetch = self.item_fetcher.refresh_items(
+            check_ids, message.added, message.removed)
+        if need_refetch:
+            return None
+        connection = self.item_fetcher.connection
+        inserts = []
+        for id_list_chunk in util.split_values_for_sqlite(tuple(check_ids)):
+            inserts.extend(self.query.select_sort_keys(connection,
+                                                       id_list_chunk))
+        removed = [id_ for id_ in (check_ids | removed_ids)
+                   if self.item_in_list(id_)]
+        if len(inserts) + len(removed) > self.INCREMENTAL_UPDATE_LIMIT:
+            return None
+        if self.result.sort_keys is None:
+            self.item_fetcher.ensure_id_table_filled()
+            sort_keys = dict(self.query.select_sort_keys_for_table(
+                connection, self.item_fetcher.id_table))
+            for id_ in self.id_list:
+                if id_ not in sort_keys and id_ not in removed_ids:
+                    # an item was deleted from the DB, but we haven't gotten
+                    # the ItemChanges message yet
+                    return None
+            # removed items don't have a sort key, but splice() takes them
+            # out of the list before it needs one.
+            self.result.sort_keys = [sort_keys.get(id_)
+                                     for id_ in self.id_list]
+        first_changed = self.result.splice(check_ids | removed_ids, inserts)
+        if first_changed is None:
+            changed_ids = [id_ for id_ in message.changed
+                           if self.item_in_list(id_)]
+            return ItemChangesOutcome(self.result, 'items-changed',
+                                      (changed_ids,))
+        self.item_fetcher.id_list_changed()
+        inserted_ids = set(id_ for id_, sort_key in inserts)
+        removed = [id_ for id_ in removed if id_ not in inserted_ids]
+        return ItemChangesOutcome(self.result, 'list-spliced',
+                                  (removed, first_changed))
+
+class ItemIdTable(object):
+    """Temporary table that stores the ids for an ItemFetcher
+
+    This lets ItemFetcher join against its id list, rather than building
+    huge "id IN (...)" expressions with every id in the list.
+
+    The table lives in the temp database for the connection.  Each
+    connection is only used by 1 ItemFetcher at a time, so the table gets
+    reused by every ItemFetcher that uses the connection.
+
+    :attribute name: name of the table in SQL statements
+    """
+    name = 'itemtrack_ids'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def fill(self, id_list):
+        """Replace the contents of the table with a list of ids.
+
+        Rows are stored with a pos column that tracks the position in
+        id_list.
+        """
+        self.connection.execute("CREATE TABLE IF NOT EXISTS temp.%s "
+                                "(pos INTEGER PRIMARY KEY, id INTEGER)" %
+                                self.name)
+        self.connection.execute("DELETE FROM temp.%s" % self.name)
+        self.connection.execute_many("INSERT INTO temp.%s (pos, id) "
+                                     "VALUES (?, ?)" % self.name,
+                                     enumerate(id_list))
+
+def _id_placeholders(id_list):
+    """Get placeholders to use for a list of ids in an "IN (...)" clause.
+
+    We use placeholders for the ids so that sqlite can reuse the statement
+    for lists with the same length.  Be careful to only use this for short
+    lists (see util.split_values_for_sqlite())
+    """
+    return ', '.join('?' for i in xrange(len(id_list)))
+
 class ItemFetcher(object):
     """Create ItemInfo objects for ItemTracker
 
@@ -729,7 +1295,15 @@ class ItemFetcher(object):
 
     If we aren't using WAL journal mode, then we select the data we need into
     a temporary table to freeze it in place.  This is slower than the WAL
-    version, but not much.
+    version, but not much.  We copy the data with the query that selected the
+    ids, so we don't need to send the id list back to SQLite.
+
+    We don't page through rows by their sort key.  ItemTracker needs the
+    entire id list up front for len() and get_index(), so we select all the
+    ids once, then fetch rows by id as they're needed.  The time it takes to
+    fetch a row doesn't depend on the size of the list, but the WAL version
+    still needs O(n) time to select the ids and the NoWAL version needs O(n)
+    time to copy the data.
 
     The two strategies are implemented by the 2 subclasses of ItemFetcher:
     ItemFetcherWAL and ItemFetcherNoWAL.
@@ -737,13 +1311,17 @@ class ItemFetcher(object):
     Finally ItemFetcher has 2 methods, select_playable_ids and
     select_has_playables() which figure out which items in the list are
     playable using an SQL select.  This is needed because we want to calculate
-    this without having to load all the ItemInfos in the list.
+    this without having to load all the ItemInfos in the list.  These use an
+    ItemIdTable to join against the ids in the list.
     """
 
-    def __init__(self, connection, item_source, id_list):
+    def __init__(self, connection, item_source, query, id_list):
         self.connection = connection
         self.item_source = item_source
+        self.query = query
         self.id_list = id_list
+        self.id_table = ItemIdTable(connection)
+        self.id_table_filled = False
 
     def select_columns(self):
         return self.item_source.select_info.select_columns
@@ -762,6 +1340,19 @@ class ItemFetcher(object):
             self.item_source.release_connection(self.connection)
             self.connection = None
 
+    def id_list_changed(self):
+        """Call this when id_list was changed in place.
+
+        We fill our ItemIdTable again the next time we need it.
+        """
+        self.id_table_filled = False
+
+    def ensure_id_table_filled(self):
+        """Make sure our ItemIdTable contains the ids from id_list."""
+        if not self.id_table_filled:
+            self.id_table.fill(self.id_list)
+            self.id_table_filled = True
+
     def destroy(self):
         """Called when the ItemFetcher is no longer needed.  Release any
         resources.
@@ -786,35 +1377,52 @@ class ItemFetcher(object):
         """
         raise NotImplementedError()
 
-    def refresh_items(self, changed_ids):
+    def refresh_items(self, changed_ids, added_ids=(), removed_ids=()):
         """Refresh item data.
 
         Normally ItemFetcher uses data from the read transaction that the
         connection it was created with was in.  Use this method to force
         ItemFetcher to use new data for a list of items.
 
+        :param changed_ids: ids of items to refresh
+        :param added_ids: ids of items that we know were added to the DB
+        :param removed_ids: ids of items that we know were removed from the DB
         :returns True: if we can't refresh the items and we should refetch the
         entire list instead.  This is a hack to work around #19823
         """
         raise NotImplementedError()
 
+    def _playable_sql(self, select):
+        return ("SELECT %s FROM %s "
+                "JOIN %s ON %s.id=%s.id "
+                "WHERE %s.%s IS NOT NULL AND "
+                "%s.file_type != 'other'" %
+                (select, self.id_table.name, self.table_name(),
+                 self.table_name(), self.id_table.name,
+                 self.table_name(), self.path_column(), self.table_name()))
+
     def select_playable_ids(self):
         """Calculate which items are playable using a select statement
 
         :returns: list of item ids
         """
-        raise NotImplementedError()
+        self.ensure_id_table_filled()
+        sql = self._playable_sql('%s.id' % self.id_table.name)
+        sql += " ORDER BY %s.pos" % self.id_table.name
+        return [row[0] for row in self.connection.execute(sql)]
 
     def select_has_playables(self):
         """Calculate if any items are playable using a select statement.
 
         :returns: True/False
         """
-        raise NotImplementedError()
+        self.ensure_id_table_filled()
+        sql = "SELECT EXISTS (%s)" % self._playable_sql('1')
+        return self.connection.execute(sql).fetchone()[0] == 1
 
 class ItemFetcherWAL(ItemFetcher):
-    def __init__(self, connection, item_source, id_list):
-        ItemFetcher.__init__(self, connection, item_source, id_list)
+    def __init__(self, connection, item_source, query, id_list):
+        ItemFetcher.__init__(self, connection, item_source, query, id_list)
         self._prepare_sql()
         self.item_count = self.calc_item_count()
         self.max_item_id = self.calc_max_item_id()
@@ -847,61 +1455,48 @@ class ItemFetcherWAL(ItemFetcher):
 
     def fetch_items(self, id_list):
         """Create Item objects."""
-        where = ("WHERE %s.id in (%s)" %
-                 (self.table_name(), ', '.join(str(i) for i in id_list)))
-        sql = ' '.join((self._sql, where))
-        cursor = self.connection.execute(sql)
-        return [self.item_source.make_item_info(row) for row in cursor]
-
-    def refresh_items(self, changed_ids):
+        id_list = tuple(id_list)
+        rv = []
+        for id_list_chunk in util.split_values_for_sqlite(id_list):
+            where = "WHERE %s.id IN (%s)" % (self.table_name(),
+                                             _id_placeholders(id_list_chunk))
+            sql = ' '.join((self._sql, where))
+            cursor = self.connection.execute(sql, id_list_chunk)
+            rv.extend(self.item_source.make_item_info(row) for row in cursor)
+        return rv
+
+    def refresh_items(self, changed_ids, added_ids=(), removed_ids=()):
         # We ignore changed_ids and just start a new transaction which will
         # refresh all the data.
         self.connection.commit()
         self.connection.execute("BEGIN TRANSACTION")
         # check if an item has been added/removed from the DB now that we have
-        # a new transaction.  This can happen if the backend changes some
-        # items sends an ItemsChanged message, then deletes them before we
-        # process the message (see #19823)
-
-        new_max_id = self.calc_max_item_id()
-        new_item_count = self.calc_item_count()
+        # a new transaction, other than the ones we were told about.  This can
+        # happen if the backend changes some items sends an ItemsChanged
+        # message, then deletes them before we process the message (see
+        # #19823)
+        expected_max_id = max([self.max_item_id] + list(added_ids))
+        expected_item_count = (self.item_count + len(added_ids) -
+                               len(removed_ids))
+        self.max_item_id = self.calc_max_item_id()
+        self.item_count = self.calc_item_count()
         # checks for items have been added
-        if new_max_id != self.max_item_id:
-            self.max_item_id = new_max_id
-            # update item_count since that could have changed too
-            self.item_count = new_item_count
+        if self.max_item_id != expected_max_id:
             return True
         # given that items haven't been added, we can use the total number of
         # items to check if any have been deleted
-        if new_item_count != self.item_count:
-            self.item_count = new_item_count
+        if self.item_count != expected_item_count:
             return True
-        # nothing has changed, we can return false
+        # nothing unexpected has changed, we can return false
         return False
 
-    def select_playable_ids(self):
-        sql = ("SELECT id FROM %s "
-               "WHERE %s IS NOT NULL AND "
-               "file_type != 'other' AND "
-               "id in (%s)" % 
-               (self.table_name(), self.path_column(),
-                ','.join(str(id_) for id_ in self.id_list)))
-        return [row[0] for row in self.connection.execute(sql)]
-
-    def select_has_playables(self):
-        sql = ("SELECT EXISTS (SELECT 1 FROM %s "
-               "WHERE %s IS NOT NULL AND "
-               "file_type != 'other' AND "
-               "id in (%s))" %
-               (self.table_name(), self.path_column(),
-                ','.join(str(id_) for id_ in self.id_list)))
-        return self.connection.execute(sql).fetchone()[0] == 1
-
 class ItemFetcherNoWAL(ItemFetcher):
-    def __init__(self, connection, item_source, id_list):
-        ItemFetcher.__init__(self, connection, item_source, id_list)
+    def __init__(self, connection, item_source, query, id_list):
+        ItemFetcher.__init__(self, connection, item_source, query, id_list)
         self._make_temp_table()
-        self._select_into_temp_table(id_list)
+        # We're still in the read transaction that selected id_list, so
+        # running the query again selects the same ids.
+        self._select_into_temp_table(*query.select_ids_sql())
         self.connection.commit()
 
     def _make_temp_table(self):
@@ -916,25 +1511,30 @@ class ItemFetcherNoWAL(ItemFetcher):
         self.connection.execute(create_sql)
         self.connection.execute(index_sql)
 
-    def _select_into_temp_table(self, id_list):
+    def _select_into_temp_table(self, id_select, values=()):
+        """Copy item data into our temp table.
+
+        :param id_select: SQL expression that selects the ids to copy
+        :param values: values for id_select
+        """
         template = string.Template("""\
 INSERT OR REPLACE INTO $temp_table_name($dest_columns)
 SELECT $source_columns
 FROM $table_name
 $join_sql
-WHERE $table_name.id in ($id_list)""")
+WHERE $table_name.id IN ($id_select)""")
         d = {
             'temp_table_name': self.temp_table_name,
             'table_name': self.table_name(),
             'join_sql': self.join_sql(),
-            'id_list': ', '.join(str(id_) for id_ in id_list),
+            'id_select': id_select,
             'dest_columns': ','.join(ci.attr_name
                                      for ci in self.select_columns()),
             'source_columns': ','.join('%s.%s' % (ci.table, ci.column)
                                        for ci in self.select_columns()),
         }
         sql = template.substitute(d)
-        self.connection.execute(sql)
+        self.connection.execute(sql, values)
 
     def destroy(self):
         if self.connection is not None:
@@ -947,34 +1547,22 @@ WHERE $table_name.id in ($id_list)""")
         """Create Item objects."""
         # We can use SELECT * here because we know that we defined the columns
         # in the same order as select_columns() returned them.
-        id_list_str = ', '.join(str(i) for i in id_list)
-        sql = "SELECT * FROM %s WHERE id IN (%s)" % (self.temp_table_name,
-                                                     id_list_str)
-        return [self.item_source.make_item_info(row)
-                for row in self.connection.execute(sql)]
-
-    def refresh_items(self, changed_ids):
-        self._select_into_temp_table(changed_ids)
+        id_list = tuple(id_list)
+        rv = []
+        for id_list_chunk in util.split_values_for_sqlite(id_list):
+            sql = "SELECT * FROM %s WHERE id IN (%s)" % (
+                self.temp_table_name, _id_placeholders(id_list_chunk))
+            rv.extend(self.item_source.make_item_info(row)
+                      for row in self.connection.execute(sql, id_list_chunk))
+        return rv
+
+    def refresh_items(self, changed_ids, added_ids=(), removed_ids=()):
+        changed_ids = tuple(changed_ids)
+        for id_list_chunk in util.split_values_for_sqlite(changed_ids):
+            self._select_into_temp_table(_id_placeholders(id_list_chunk),
+                                         id_list_chunk)
         return False
 
-    def select_playable_ids(self):
-        sql = ("SELECT id FROM %s "
-               "WHERE %s IS NOT NULL AND "
-               "file_type != 'other' AND "
-               "id in (%s)" %
-               (self.table_name(), self.path_column(),
-                ','.join(str(id_) for id_ in self.id_list)))
-        return [row[0] for row in self.connection.execute(sql)]
-
-    def select_has_playables(self):
-        sql = ("SELECT EXISTS (SELECT 1 FROM %s "
-               "WHERE %s IS NOT NULL AND "
-               "file_type != 'other' AND "
-               "id in (%s))" %
-               (self.table_name(), self.path_column(),
-                ','.join(str(id_) for id_ in self.id_list)))
-        return self.connection.execute(sql).fetchone()[0] == 1
-
 class BackendItemTracker(signals.SignalEmitter):
     """Item tracker used by the backend
 
@@ -0,0 +1,140 @@
+# Miro - an RSS based video player application
+# Copyright (C) 2012
+# Participatory Culture Foundation
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# In addition, as a special exception, the copyright holders give
+# permission to link the code of portions of this program with the OpenSSL
+# library.
+#
+# You must obey the GNU General Public License in all respects for all of
+# the code used other than OpenSSL. If you modify file(s) with this
+# exception, you may extend this exception to your version of the file(s),
+# but you are not obligated to do so. If you do not wish to do so, delete
+# this exception statement from your version. If you delete this exception
+# statement from all source files in the program, then also delete it here.
+
+"""miro.data.storagetuning -- SQLite tuning profiles
+
+A StorageTuningProfile stores the PRAGMA settings that we use for a
+database.  Big databases benefit from a bigger page cache, memory-mapped
+I/O, and bigger pages.  Small ones don't, and we don't want to waste
+memory on them.
+
+profile_for_size() picks the profile for a database.  Both the backend
+(storedatabase.LiveStorage) and the frontend (connectionpool.ConnectionPool)
+use it, so that all connections to a database are tuned the same way.
+"""
+
+import sys
+
+from miro import util
+
+StorageTuningProfile = util.namedtuple(
+    "StorageTuningProfile",
+    "name max_db_size page_size cache_size mmap_size wal_autocheckpoint",
+
+    """StorageTuningProfile stores the PRAGMA settings for a database
+
+    :attribute name: name of the profile
+    :attribute max_db_size: use this profile for databases smaller than this
+    many bytes (None for no limit)
+    :attribute page_size: page size in bytes.  Changing this for an existing
+    database requires a VACUUM, so we only ever make pages bigger (see
+    should_change_page_size()).
+    :attribute cache_size: size of the page cache in KiB
+    :attribute mmap_size: max number of bytes to use for memory-mapped I/O.
+    This is a budget for each process that opens the database, not for each
+    connection (see connection_pragmas()).
+    :attribute wal_autocheckpoint: run a checkpoint when the WAL file has
+    this many pages
+    """)
+
+MB = 1024 * 1024
+
+# 32-bit processes don't have enough address space to memory-map big
+# databases from several connections, so we don't use mmap there at all.
+MMAP_SUPPORTED = sys.maxint > 2 ** 32
+
+PROFILES = [
+    StorageTuningProfile('small', 64 * MB, page_size=4096, cache_size=8000,
+                         mmap_size=64 * MB, wal_autocheckpoint=1000),
+    StorageTuningProfile('medium', 512 * MB, page_size=4096,
+                         cache_size=32000, mmap_size=256 * MB,
+                         wal_autocheckpoint=2000),
+    StorageTuningProfile('large', None, page_size=8192, cache_size=64000,
+                         mmap_size=512 * MB, wal_autocheckpoint=4000),
+]
+
+def profile_for_size(db_size):
+    """Pick the StorageTuningProfile to use for a database.
+
+    :param db_size: size of the database in bytes
+    """
+    for profile in PROFILES:
+        if profile.max_db_size is None or db_size < profile.max_db_size:
+            return profile
+    return PROFILES[-1]
+
+def should_change_page_size(profile, current_page_size):
+    """Check if we should change the page size of a database.
+
+    We only ever switch to bigger pages.  If a big database shrinks back
+    below the threshold we keep the big pages, rather than VACUUM the
+    database again.  This means a database that hovers around the threshold
+    doesn't get rewritten over and over.
+    """
+    return profile.page_size > current_page_size
+
+def calc_db_size(page_size, page_count, freelist_count):
+    """Calculate the amount of data in a database from its size info.
+
+    page_count includes the pages on the freelist.  We don't count those,
+    since a database with lots of free pages doesn't need a big cache.
+    """
+    return page_size * (page_count - freelist_count)
+
+def calc_mmap_size(profile, connection_count=1):
+    """Calculate the mmap_size to use for a connection.
+
+    Each connection maps the database separately, so we split the profile's
+    mmap_size between all the connections that a process can open.  On
+    32-bit systems we don't use memory-mapped I/O at all (see
+    MMAP_SUPPORTED).
+
+    :param connection_count: max number of connections that the process will
+    have open to the database
+    """
+    if not MMAP_SUPPORTED:
+        return 0
+    return profile.mmap_size // max(connection_count, 1)
+
+def connection_pragmas(profile, connection_count=1):
+    """Get the PRAGMAs to run on each connection to a database.
+
+    These are the settings that each connection needs to set for itself.
+    page_size and wal_autocheckpoint are only set by the backend, since
+    it's the one that writes to the database.
+
+    :param connection_count: max number of connections that the process will
+    have open to the database
+    :returns: list of (name, value) tuples
+    """
+    # Negative values for cache_size are in KiB rather than pages
+    return [
+        ('cache_size', -profile.cache_size),
+        ('mmap_size', calc_mmap_size(profile, connection_count)),
+    ]
@@ -119,7 +119,14 @@ class DDBObjectFetcher(ViewObjectFetcher):
         self.db_info = db_info
 
     def fetch_obj(self, id_):
-        return self.db_info.db.get_obj_by_id(id_, self.klass)
+        db = self.db_info.db
+        try:
+            return db.get_obj_by_id(id_, self.klass)
+        except KeyError:
+            # In lazy mode, the object may have been dropped from memory
+            # since prepare_objects() was called.
+            db.ensure_objects_loaded(self.klass, [id_], self.db_info)
+            return db.get_obj_by_id(id_, self.klass)
 
     def fetch_obj_for_ddb_object(self, ddb_object):
         return ddb_object
@@ -356,19 +363,31 @@ class BulkSQLManager(object):
         self.db = db
         self.view_tracker_manager = view_tracker_manager
         self.active = False
+        self.batch_updates = False
         self.to_insert = {}
         self.to_remove = {}
+        self.to_update = {}
         self.pending_inserts = set()
         self.pending_removes = set()
+        self.pending_updates = set()
 
         self.last_call = None
 
-    def start(self):
+    def start(self, batch_updates=False):
+        """Start bulk mode.
+
+        :param batch_updates: if True, also delay the UPDATE statements from
+            signal_change() until finish() is called.  Updates for objects
+            that change the same columns will be sent to sqlite together.
+            This is good for things like download status updates, where we
+            change the same columns on many objects at once.
+        """
         if self.active:
             raise ValueError(
                 "BulkSQLManager.start() called twice (previous: %s)",
                 self.last_call)
         self.active = True
+        self.batch_updates = batch_updates
         self.last_call = "".join(traceback.format_stack())
 
     def finish(self):
@@ -380,6 +399,7 @@ class BulkSQLManager(object):
             # Ensure that this flag always get set back to False even in the
             # face of any exception thrown from commit() method.
             self.active = False
+            self.batch_updates = False
 
         # Force a commit of our current transaction.
         #
@@ -392,11 +412,15 @@ class BulkSQLManager(object):
         for x in range(100):
             to_insert = self.to_insert
             to_remove = self.to_remove
+            to_update = self.to_update
             self.to_insert = {}
             self.to_remove = {}
-            self._commit_sql(to_insert, to_remove)
-            self._update_view_trackers(to_insert, to_remove)
-            if len(self.to_insert) == len(self.to_remove) == 0:
+            self.to_update = {}
+            self.pending_updates = set()
+            self._commit_sql(to_insert, to_remove, to_update)
+            self._update_view_trackers(to_insert, to_remove, to_update)
+            if (len(self.to_insert) == len(self.to_remove) ==
+                    len(self.to_update) == 0):
                 break
             # inside _commit_sql() or _update_view_trackers(), we were
             # asked to insert or remove more items, repeat the
@@ -406,10 +430,19 @@ class BulkSQLManager(object):
                     "have items to commit.  Are we in a circular loop?")
         self.to_insert = {}
         self.to_remove = {}
+        self.to_update = {}
         self.pending_inserts = set()
         self.pending_removes = set()
+        self.pending_updates = set()
+
+    def _commit_sql(self, to_insert, to_remove, to_update):
+        for table_name, objects in to_update.items():
+            # don't bother updating objects that we're about to remove
+            objects = [obj for obj in objects
+                       if obj.id not in self.pending_removes]
+            logging.debug('bulk update: %s %s', table_name, len(objects))
+            self.db.bulk_update(objects)
 
-    def _commit_sql(self, to_insert, to_remove):
         for table_name, objects in to_insert.items():
             logging.debug('bulk insert: %s %s', table_name, len(objects))
             self.db.bulk_insert(objects)
@@ -422,19 +455,22 @@ class BulkSQLManager(object):
             for obj in objects:
                 obj.removed_from_db()
 
-    def _update_view_trackers(self, to_insert, to_remove):
+    def _update_view_trackers(self, to_insert, to_remove, to_update):
         # figure out the total number of objects that have changed
         changed_objs = set()
         for table_name, objects in to_insert.items():
             changed_objs.update(objects)
         for table_name, objects in to_remove.items():
             changed_objs.update(objects)
+        for table_name, objects in to_update.items():
+            changed_objs.update(objects)
         # Figure out which strategy is fastest based on the number of objects
         # that have changed
         if len(changed_objs) < 100:
             self._update_view_trackers_by_object(changed_objs)
         else:
-            self._update_view_trackers_by_table(to_insert, to_remove)
+            self._update_view_trackers_by_table(to_insert, to_remove,
+                                                to_update)
 
     def _update_view_trackers_by_object(self, changed_objs):
         """Update view trackers by checking each changed object.
@@ -444,16 +480,17 @@ class BulkSQLManager(object):
         for obj in changed_objs:
             self.view_tracker_manager.update_view_trackers(obj)
 
-    def _update_view_trackers_by_table(self, to_insert, to_remove):
+    def _update_view_trackers_by_table(self, to_insert, to_remove, to_update):
         """Update view trackers by checking each table
 
         This method is fastest when there are many changed objects
         """
-        for table_name in to_insert:
+        updated_tables = set(to_insert.keys() + to_update.keys())
+        for table_name in updated_tables:
             self.view_tracker_manager.bulk_update_view_trackers(table_name)
 
         for table_name, objects in to_remove.items():
-            if table_name in to_insert:
+            if table_name in updated_tables:
                 # already updated the view above
                 continue
             self.view_tracker_manager.bulk_remove_from_view_trackers(
@@ -475,6 +512,30 @@ class BulkSQLManager(object):
     def will_remove(self, id_):
         return id_ in self.pending_removes
 
+    def will_update(self, id_):
+        return id_ in self.pending_updates
+
+    def add_update(self, obj):
+        """Schedule an object to be updated when finish() is called.
+
+        Only valid if start() was called with batch_updates=True.  If obj is
+        already scheduled, this is a no-op, since the object keeps track of
+        all its changed attributes until it's saved.
+        """
+        if not self.batch_updates:
+            raise ValueError("BulkSQLManager.add_update() called without "
+                             "batch_updates")
+        if obj.id in self.pending_updates:
+            return
+        table_name = self.db.table_name(obj.__class__)
+        try:
+            updates_for_table = self.to_update[table_name]
+        except KeyError:
+            updates_for_table = []
+            self.to_update[table_name] = updates_for_table
+        updates_for_table.append(obj)
+        self.pending_updates.add(obj.id)
+
     def add_remove(self, obj):
         table_name = self.db.table_name(obj.__class__)
         if self.will_insert(obj.id):
@@ -503,7 +564,17 @@ class AttributeUpdateTracker(object):
         try:
             return instance.__dict__[self.name]
         except KeyError:
-            raise AttributeError(self.name)
+            # In lazy mode, LiveStorage may not have decoded the value yet
+            try:
+                restored_row = instance.__dict__['_restored_row']
+            except KeyError:
+                raise AttributeError(self.name)
+            value = restored_row.decode(self.name)
+            instance.__dict__[self.name] = value
+            if restored_row.is_empty():
+                # everything's decoded, we don't need the row anymore
+                del instance.__dict__['_restored_row']
+            return value
         except AttributeError:
             if instance is None:
                 raise AttributeError(
@@ -515,6 +586,12 @@ class AttributeUpdateTracker(object):
         if instance.__dict__.get(self.name, "BOGUS VALUE FOO") != value:
             instance.changed_attributes.add(self.name)
         instance.__dict__[self.name] = value
+        restored_row = instance.__dict__.get('_restored_row')
+        if restored_row is not None:
+            # the value from the database is now out of date
+            restored_row.forget(self.name)
+            if restored_row.is_empty():
+                del instance.__dict__['_restored_row']
 
 class DDBObject(signals.SignalEmitter):
     """Dynamic Database object
@@ -683,6 +760,20 @@ class DDBObject(signals.SignalEmitter):
         self.__dict__.update(dct)
         self.changed_attributes.update(dct.keys())
 
+    def can_evict(self):
+        """Can LiveStorage drop this object from memory?
+
+        This is only used in lazy mode.  An evicted object gets reloaded from
+        disk the next time it's needed, so we can't evict objects with state
+        that would be lost: unsaved changes or connected signal callbacks.
+        """
+        if self.in_db_init or self.changed_attributes:
+            return False
+        for callbacks in self.signal_callbacks.values():
+            if callbacks.all_callbacks():
+                return False
+        return True
+
     def get_id(self):
         """Returns unique integer associated with this object
         """
@@ -744,6 +835,13 @@ class DDBObject(signals.SignalEmitter):
             # view trackers in this case.  Both will be done when the
             # BulkSQLManager.finish() is called.
             return
+        if self.db_info.bulk_sql_manager.batch_updates:
+            # Save the UPDATE and view tracker checks until
+            # BulkSQLManager.finish() is called.  Note that we always schedule
+            # an update, even if needs_save is False.  If there are no changed
+            # attributes we won't run any SQL for the object.
+            self.db_info.bulk_sql_manager.add_update(self)
+            return
         if needs_save:
             self.db_info.db.update_obj(self)
         self.db_info.view_tracker_manager.update_view_trackers(
@@ -53,6 +53,7 @@ from miro import schema
 from miro import util
 import types
 from miro import app
+from miro import containerjson
 from miro import dbupgradeprogress
 from miro import prefs
 
@@ -4417,3 +4418,50 @@ def upgrade201(cursor):
             where_values.append((feed_id,))
     cursor.executemany("UPDATE feed SET expire_timedelta=NULL "
                        "WHERE id=?", where_values)
+
+def upgrade202(cursor):
+    """Store pythonrepr columns as JSON rather than using repr()."""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    for table in [r[0] for r in cursor.fetchall()]:
+        cursor.execute("PRAGMA table_info(%s)" % table)
+        columns = [r[1] for r in cursor.fetchall()
+                   if r[2].lower() == 'pythonrepr']
+        if not columns:
+            continue
+        cursor.execute("SELECT id, %s FROM %s" % (', '.join(columns), table))
+        update_values = []
+        for row in cursor.fetchall():
+            new_values = []
+            for column, value in zip(columns, row[1:]):
+                if value is not None:
+                    try:
+                        value = containerjson.dumps(eval_container(value))
+                    except StandardError:
+                        # leave the value alone, the malformed data handler
+                        # for the column will deal with it.
+                        logging.warn("upgrade202: error converting %s.%s "
+                                     "(%r)", table, column, value)
+                new_values.append(value)
+            update_values.append(new_values + [row[0]])
+        cursor.executemany("UPDATE %s SET %s WHERE id=?" % (table,
+                           ', '.join('%s=?' % c for c in columns)),
+                           update_values)
+
+def upgrade203(cursor):
+    """Add body_hash to rss_feed_impl, so we can skip parsing feeds that
+    haven't changed.
+    """
+    cursor.execute("ALTER TABLE rss_feed_impl ADD COLUMN body_hash TEXT")
+
+def upgrade204(cursor):
+    """Add feedparser_hash to item, so feed updates can skip entries that
+    haven't changed.
+    """
+    cursor.execute("ALTER TABLE item ADD COLUMN feedparser_hash TEXT")
+
+def upgrade205(cursor):
+    """Add change_rate to feed, so we remember how often feeds change
+    between runs.
+    """
+    cursor.execute("ALTER TABLE feed ADD COLUMN change_rate real")
+    cursor.execute("UPDATE feed SET change_rate=1.0")
@@ -116,8 +116,22 @@ class BatchUpdateDownloadStatus(Command):
         from miro.messages import DownloaderSyncCommandComplete
 
         cmd_done = self.args[1]
-        fresh = all(RemoteDownloader.update_status(status, cmd_done=cmd_done)
-                    for status in self.args[0])
+        # Status updates tend to change the same columns for every
+        # downloader, so batch the UPDATE statements together.  Updating the
+        # items can do all sorts of things (finishing downloads, moving files,
+        # etc), so wait until the batch is saved to do that.
+        item_list_updates = []
+        app.bulk_sql_manager.start(batch_updates=True)
+        try:
+            fresh = all(RemoteDownloader.update_status(status,
+                            cmd_done=cmd_done,
+                            item_list_updates=item_list_updates)
+                        for status in self.args[0])
+        finally:
+            app.bulk_sql_manager.finish()
+        for downloader, args in item_list_updates:
+            if downloader.id_exists():
+                downloader.update_item_list(*args)
         if cmd_done and fresh:
             DownloaderSyncCommandComplete().send_to_frontend()
 
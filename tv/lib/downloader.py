@@ -442,7 +442,17 @@ class RemoteDownloader(DDBObject):
             app.download_state_manager.total_up_rate += rates[1]
 
     @classmethod
-    def update_status(cls, data, cmd_done=False):
+    def update_status(cls, data, cmd_done=False, item_list_updates=None):
+        """Update a downloader based on a status dict from the daemon.
+
+        :param data: status dict
+        :param cmd_done: is this the reply to a command we sent?
+        :param item_list_updates: if given, rather than calling
+            update_item_list() right away, append a (downloader, args) tuple
+            to this list.  This allows the caller to delay updating items
+            until the downloader changes are saved.
+        :returns: False if the status update was stale
+        """
         for field in data:
             if field not in ['filename', 'short_filename', 'metainfo']:
                 data[field] = unicodify(data[field])
@@ -530,7 +540,11 @@ class RemoteDownloader(DDBObject):
 
             self.signal_change()
 
-            self.update_item_list(finished, file_migrated, old_filename)
+            args = (finished, file_migrated, old_filename)
+            if item_list_updates is not None:
+                item_list_updates.append((self, args))
+            else:
+                self.update_item_list(*args)
         return True
 
     def update_item_list(self, finished, file_migrated, old_filename):
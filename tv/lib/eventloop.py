@@ -32,9 +32,15 @@
 This module handles the miro event loop which is responsible for
 network requests and scheduling.
 
+The event loop keeps always-on timing stats for the callbacks it runs (see
+``EventLoopStats``).  Use ``get_callback_stats()`` and ``get_queue_stats()``
+to find out which idles and timeouts are making the backend stall.
+
 TODO: handle user setting clock back
 """
 
+import bisect
+import collections
 import errno
 import heapq
 import logging
@@ -54,13 +60,167 @@ from miro.plat.utils import thread_body
 
 cumulative = {}
 
+CallbackStats = util.namedtuple('CallbackStats',
+        'name count total_time max_time max_wait',
+        """Timing info for all the calls made with a callback name.
+
+        Times are in seconds.  max_wait is the longest that a call sat in its
+        queue after it was ready to run.
+        """)
+
+class LatencyHistogram(object):
+    """Tracks a distribution of times using fixed buckets.
+
+    BUCKETS holds the upper bound (in seconds) of each bucket.  Values larger
+    than the last bound get counted in an extra overflow bucket.
+    """
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.bucket_counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.bucket_counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def get_stats(self):
+        """Get a dict describing the histogram.
+
+        buckets is a list of (upper_bound, count) tuples.  The upper bound is
+        None for the overflow bucket.
+        """
+        if self.count:
+            mean = self.total / self.count
+        else:
+            mean = 0.0
+        bounds = list(self.BUCKETS) + [None]
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': mean,
+            'max': self.max,
+            'buckets': zip(bounds, self.bucket_counts),
+        }
+
+class EventLoopStats(object):
+    """Tracks how long event loop callbacks take to run.
+
+    For each callback name we track the number of calls, the total and max
+    time spent running them and the max time they waited in their queue.  For
+    each queue we also keep a histogram of how long calls waited to be run.
+
+    This is always on, so recording a call needs to stay cheap.  We only
+    track MAX_NAMES distinct names, calls after that are lumped together under
+    OVERFLOW_NAME.  This keeps us from growing forever when names contain
+    things like feed titles.
+
+    All methods should be called from the event loop thread.
+    """
+    MAX_NAMES = 1000
+    OVERFLOW_NAME = 'other callbacks'
+    QUEUE_NAMES = ('urgent', 'idle', 'timeout')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # maps names to [count, total_time, max_time, max_wait] lists
+        self.callbacks = {}
+        self.queue_waits = dict((name, LatencyHistogram())
+                                for name in self.QUEUE_NAMES)
+
+    def record_call(self, name, queue_name, wait, duration):
+        """Record a callback run by the event loop.
+
+        :param name: name of the callback
+        :param queue_name: name of the queue it came from
+        :param wait: time between when the call was ready to run and when it
+        started running
+        :param duration: time spent running the callback
+        """
+        try:
+            info = self.callbacks[name]
+        except KeyError:
+            if len(self.callbacks) >= self.MAX_NAMES:
+                name = self.OVERFLOW_NAME
+            info = self.callbacks.setdefault(name, [0, 0.0, 0.0, 0.0])
+        info[0] += 1
+        info[1] += duration
+        if duration > info[2]:
+            info[2] = duration
+        if wait > info[3]:
+            info[3] = wait
+        self.queue_waits[queue_name].add(wait)
+
+    def get_callback_stats(self, sort_by='total_time', limit=None):
+        """Get timing info for our callbacks.
+
+        :param sort_by: CallbackStats field to sort by, largest first
+        :param limit: max number of results to return
+        :returns: list of CallbackStats tuples
+        """
+        results = [CallbackStats(name, *info)
+                   for name, info in self.callbacks.iteritems()]
+        results.sort(key=lambda cs: getattr(cs, sort_by), reverse=True)
+        if limit is not None:
+            results = results[:limit]
+        return results
+
+    def get_queue_stats(self):
+        """Get the wait time histograms for our queues.
+
+        :returns: dict mapping queue names to LatencyHistogram.get_stats()
+        results
+        """
+        return dict((name, histogram.get_stats())
+                    for name, histogram in self.queue_waits.iteritems())
+
+stats = EventLoopStats()
+
+def format_stats(callback_stats, queue_stats):
+    """Format the results of get_callback_stats() and get_queue_stats().
+
+    :returns: list of lines suitable for logging or printing
+    """
+    lines = ['%-50s %8s %10s %10s %10s' % ('callback', 'count', 'total',
+                                           'max', 'max wait')]
+    for cs in callback_stats:
+        lines.append('%-50s %8d %10.3f %10.3f %10.3f' % (cs.name[:50],
+            cs.count, cs.total_time, cs.max_time, cs.max_wait))
+    for name in EventLoopStats.QUEUE_NAMES:
+        qs = queue_stats[name]
+        buckets = []
+        for bound, count in qs['buckets']:
+            if bound is None:
+                buckets.append('more: %d' % count)
+            else:
+                buckets.append('<%gms: %d' % (bound * 1000, count))
+        lines.append('%s queue wait: count: %d mean: %.3f max: %.3f (%s)' %
+                     (name, qs['count'], qs['mean'], qs['max'],
+                      ', '.join(buckets)))
+    return lines
+
 class DelayedCall(object):
-    def __init__(self, function, name, args, kwargs):
+    def __init__(self, function, name, args, kwargs, queue_name=None):
         self.function = function
         self.name = name
         self.args = args
         self.kwargs = kwargs
         self.canceled = False
+        self.coalesce_key = None
+        # queue_name and ready_time are used to track how long we wait to
+        # get dispatched.
+        self.queue_name = queue_name
+        self.ready_time = None
 
     def _unlink(self):
         """Removes the references that this object has to the outside
@@ -81,6 +241,9 @@ class DelayedCall(object):
             success = trapcall.trap_call(when, self.function, *self.args,
                     **self.kwargs)
             end = clock()
+            if self.queue_name is not None:
+                stats.record_call(self.name, self.queue_name,
+                                  max(0, start - self.ready_time), end - start)
             if end-start > 0.5:
                 logging.timing("%s too slow (%.3f secs)",
                                self.name, end-start)
@@ -107,7 +270,9 @@ class Scheduler(object):
         if kwargs is None:
             kwargs = {}
         scheduled_time = clock() + delay
-        dc = DelayedCall(function,  "timeout (%s)" % (name,), args, kwargs)
+        dc = DelayedCall(function,  "timeout (%s)" % (name,), args, kwargs,
+                         'timeout')
+        dc.ready_time = scheduled_time
         heapq.heappush(self.heap, (scheduled_time, dc))
         return dc
 
@@ -125,18 +290,61 @@ class Scheduler(object):
         return dc.dispatch()
 
 class CallQueue(object):
-    def __init__(self):
-        self.queue = Queue.Queue()
+    """Queue of idle calls for the event loop.
+
+    Calls are stored in a deque.  append() and popleft() are atomic, so
+    adding an idle from another thread doesn't need to take a lock.
+
+    If wakeup is given, we call it whenever a call is added from a thread
+    other than the event loop thread.  Checking if the queue is empty first
+    isn't safe: the event loop could empty the queue right after the check,
+    then block in select() without seeing our call.  Calls added from the
+    event loop thread don't need a wakeup, the loop checks for pending
+    idles before it blocks.  in_loop_thread is a function that tells us if
+    we're running in the event loop thread.
+
+    Calls can pass a coalesce_key to add_idle().  If a call with the same key
+    is already waiting in the queue, we don't add a new one, instead the
+    waiting call will run with the new arguments.
+    """
+    def __init__(self, name='idle', wakeup=None, in_loop_thread=None):
+        self.name = name
+        self.wakeup = wakeup
+        self.in_loop_thread = in_loop_thread
+        self.queue = collections.deque()
+        # maps coalesce keys to the DelayedCall that's waiting for them.
+        self.pending_keys = {}
+        self.coalesce_lock = threading.Lock()
+        self.coalesced_count = 0
         self.quit_flag = False
         self.queue_size_warning_count = 0
 
-    def add_idle(self, function, name, args=None, kwargs=None):
+    def add_idle(self, function, name, args=None, kwargs=None,
+                 coalesce_key=None):
         if args is None:
             args = ()
         if kwargs is None:
             kwargs = {}
-        dc = DelayedCall(function, "idle (%s)" % (name,), args, kwargs)
-        self.queue.put(dc)
+        if coalesce_key is not None:
+            self.coalesce_lock.acquire()
+            try:
+                existing = self.pending_keys.get(coalesce_key)
+                if existing is not None and not existing.canceled:
+                    existing.function = function
+                    existing.args = args
+                    existing.kwargs = kwargs
+                    self.coalesced_count += 1
+                    return existing
+                dc = self._make_delayed_call(function, name, args, kwargs)
+                dc.coalesce_key = coalesce_key
+                self.pending_keys[coalesce_key] = dc
+            finally:
+                self.coalesce_lock.release()
+        else:
+            dc = self._make_delayed_call(function, name, args, kwargs)
+        self.queue.append(dc)
+        if self.wakeup is not None and not self._called_from_loop_thread():
+            self.wakeup()
 
         # Check if our queue size is too big and log a warning if so.  Only do
         # this a few times.  That should be enough to track down errors, but
@@ -145,19 +353,47 @@ class CallQueue(object):
         # NOTE: the code below doesn't take into account that this method
         # runs on multiple threads.  However, the worst that can happen is
         # we log an extra warning or two, so this doesn't seem bad.
-        if self.queue_size_warning_count < 5 and self.queue.qsize() > 1000:
+        if self.queue_size_warning_count < 5 and len(self.queue) > 1000:
             if self.queue_size_warning_count < 5:
                 logging.stacktrace("Queued called size too large")
                 self.queue_size_warning_count += 1
 
         return dc
 
+    def _called_from_loop_thread(self):
+        return self.in_loop_thread is not None and self.in_loop_thread()
+
+    def _make_delayed_call(self, function, name, args, kwargs):
+        dc = DelayedCall(function, "idle (%s)" % (name,), args, kwargs,
+                         self.name)
+        dc.ready_time = clock()
+        return dc
+
+    def _forget_coalesce_key(self, dc):
+        self.coalesce_lock.acquire()
+        try:
+            if self.pending_keys.get(dc.coalesce_key) is dc:
+                del self.pending_keys[dc.coalesce_key]
+        finally:
+            self.coalesce_lock.release()
+
     def process_next_idle(self):
-        dc = self.queue.get()
-        return dc.dispatch()
+        """Run the next idle call in the queue.
+
+        Canceled calls are skipped over without being counted as an event.
+        """
+        while self.queue:
+            dc = self.queue.popleft()
+            if dc.coalesce_key is not None:
+                # forget the key before running, since the call may want
+                # to schedule itself again.
+                self._forget_coalesce_key(dc)
+            if not dc.canceled:
+                return dc.dispatch()
+        return True
 
     def has_pending_idle(self):
-        return not self.queue.empty()
+        return len(self.queue) > 0
 
     def process_idles(self):
         # Note: used for testing purposes
@@ -165,60 +401,270 @@ class CallQueue(object):
             self.process_next_idle()
 
 
+# Priority classes for call_in_thread_with_priority().  Lower values run
+# first.
+THREAD_PRIORITY_HIGH = 0 # short calls that other work waits on (DNS, SSL)
+THREAD_PRIORITY_NORMAL = 1
+THREAD_PRIORITY_LOW = 2 # long-running calls (filesystem scans, codegen)
+
+class ThreadPoolCall(object):
+    """A call queued with ThreadPool.queue_call().
+
+    Use cancel() to stop it from running.  If the call is already running,
+    canceling it means its callback/errback won't be called.
+    """
+    def __init__(self, pool, priority, callback, errback, function, name,
+                 args, kwargs):
+        self.pool = pool
+        self.priority = priority
+        self.callback = callback
+        self.errback = errback
+        self.function = function
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.canceled = False
+
+    def _unlink(self):
+        self.callback = self.errback = self.function = None
+        self.args = self.kwargs = None
+
+    def cancel(self):
+        self.pool.cancel_call(self)
+
 class ThreadPool(object):
     """The thread pool is used to handle calls like gethostbyname()
     that block and there's no asynchronous workaround.  What we do
     instead is call them in a separate thread and return the result in
     a callback that executes in the event loop.
+
+    Calls are queued by priority class.  Each class has a limit on how many
+    of its calls can run at once (PRIORITY_LIMITS), so that a pile of slow
+    low priority calls can't starve things like DNS lookups.
+
+    The pool starts MIN_THREADS threads, adds threads as needed up to
+    MAX_THREADS, and lets extra threads exit after they've been idle for
+    IDLE_TIMEOUT seconds.
+
+    Results are delivered back to the event loop in batches, using a single
+    idle call for all the results that are ready.
     """
-    THREADS = 4
+    MIN_THREADS = 2
+    MAX_THREADS = 8
+    IDLE_TIMEOUT = 30.0
+    PRIORITY_LIMITS = {
+        THREAD_PRIORITY_HIGH: 8,
+        THREAD_PRIORITY_NORMAL: 4,
+        THREAD_PRIORITY_LOW: 2,
+    }
 
     def __init__(self, event_loop):
         self.event_loop = event_loop
-        self.queue = Queue.Queue()
+        self.condition = threading.Condition()
+        self.queues = dict((priority, collections.deque())
+                           for priority in self.PRIORITY_LIMITS)
+        self.running = dict((priority, 0) for priority in self.PRIORITY_LIMITS)
         self.threads = []
+        self.idle_thread_count = 0
+        self.thread_counter = 0
+        # incremented by close_threads() to tell old threads to exit
+        self.generation = 0
+        self.started = False
+        self.results = collections.deque()
 
     def init_threads(self):
-        while len(self.threads) < ThreadPool.THREADS:
-            t = threading.Thread(name='ThreadPool - %d' % len(self.threads),
-                                 target=thread_body,
-                                 args=[self.thread_loop])
-            t.setDaemon(True)
-            t.start()
-            self.threads.append(t)
-
-    def thread_loop(self):
+        self.condition.acquire()
+        try:
+            self.started = True
+            while len(self.threads) < self.MIN_THREADS:
+                self._start_thread()
+            self._start_threads_for_work()
+        finally:
+            self.condition.release()
+
+    def _start_thread(self):
+        # Note: must be called with condition acquired
+        t = threading.Thread(name='ThreadPool - %d' % self.thread_counter,
+                             target=thread_body,
+                             args=[self.thread_loop, self.generation])
+        t.setDaemon(True)
+        self.thread_counter += 1
+        self.threads.append(t)
+        # count the thread as idle until it starts running, otherwise we
+        # would start a new thread for each call queued before then.
+        self.idle_thread_count += 1
+        t.start()
+
+    def _start_threads_for_work(self):
+        # Note: must be called with condition acquired
+        runnable = 0
+        for priority, queue in self.queues.iteritems():
+            runnable += min(len(queue), self.PRIORITY_LIMITS[priority] -
+                            self.running[priority])
+        needed = min(runnable - self.idle_thread_count,
+                     self.MAX_THREADS - len(self.threads))
+        for i in xrange(needed):
+            self._start_thread()
+        if runnable > 0:
+            self.condition.notifyAll()
+
+    def _next_call(self):
+        # Note: must be called with condition acquired
+        for priority in sorted(self.queues):
+            queue = self.queues[priority]
+            if queue and self.running[priority] < self.PRIORITY_LIMITS[priority]:
+                return queue.popleft()
+        return None
+
+    def thread_loop(self, generation):
+        self.condition.acquire()
+        self.idle_thread_count -= 1
+        try:
+            while True:
+                call = self._wait_for_call(generation)
+                if call is None:
+                    break
+                self.running[call.priority] += 1
+                self.condition.release()
+                try:
+                    self._run_call(call)
+                finally:
+                    self.condition.acquire()
+                    self.running[call.priority] -= 1
+                    # finishing a call may have made room for another call
+                    # in its class.
+                    if self.queues[call.priority]:
+                        self.condition.notify()
+        finally:
+            try:
+                self.threads.remove(threading.currentThread())
+            except ValueError:
+                pass # close_threads() already forgot about us
+            self.condition.release()
+
+    def _wait_for_call(self, generation):
+        """Wait for the next call to run.
+
+        Returns None if the thread should exit.
+
+        Note: must be called with condition acquired
+        """
+        idle_start = clock()
         while True:
-            next_item = self.queue.get()
-            if next_item == "QUIT":
-                break
-            else:
-                callback, errback, func, name, args, kwargs, = next_item
+            if generation != self.generation:
+                return None
+            call = self._next_call()
+            if call is not None:
+                return call
+            if (clock() - idle_start >= self.IDLE_TIMEOUT and
+                    len(self.threads) > self.MIN_THREADS):
+                return None
+            self.idle_thread_count += 1
             try:
-                result = func(*args, **kwargs)
-            except KeyboardInterrupt:
-                raise
-            except Exception, exc:
-                logging.debug(">>> thread_loop: %s %s %s %s\n%s",
-                              func, name, args, kwargs,
-                              "".join(traceback.format_exc()))
-                func = errback
-                name = 'Thread Pool Errback (%s)' % name
-                args = (exc,)
-            else:
-                func = callback
-                name = 'Thread Pool Callback (%s)' % name
-                args = (result,)
-            if not self.event_loop.quit_flag:
-                self.event_loop.idle_queue.add_idle(func, name, args=args)
-                self.event_loop.wakeup()
+                self.condition.wait(self.IDLE_TIMEOUT)
+            finally:
+                self.idle_thread_count -= 1
+
+    def _run_call(self, call):
+        try:
+            result = call.function(*call.args, **call.kwargs)
+        except KeyboardInterrupt:
+            raise
+        except Exception, exc:
+            logging.debug(">>> thread_loop: %s %s %s %s\n%s",
+                          call.function, call.name, call.args, call.kwargs,
+                          "".join(traceback.format_exc()))
+            self._add_result(call, call.errback,
+                             'Thread Pool Errback (%s)' % call.name, exc)
+        else:
+            self._add_result(call, call.callback,
+                             'Thread Pool Callback (%s)' % call.name, result)
+
+    def _add_result(self, call, func, name, arg):
+        if self.event_loop.quit_flag:
+            return
+        self.results.append((call, func, name, arg))
+        # Only 1 idle call is needed to deliver any number of results
+        self.event_loop.idle_queue.add_idle(self._deliver_results,
+                                            'Thread Pool Results',
+                                            coalesce_key=self)
+        # If the call got coalesced, add_idle() doesn't wake up the event
+        # loop, so do it ourselves.
+        self.event_loop.wakeup()
+
+    def _deliver_results(self):
+        while self.results:
+            call, func, name, arg = self.results.popleft()
+            if not call.canceled:
+                trapcall.trap_call("While handling %s" % name, func, arg)
+            call._unlink()
 
     def queue_call(self, callback, errback, function, name, *args, **kwargs):
-        self.queue.put((callback, errback, function, name, args, kwargs))
+        return self.queue_call_with_priority(THREAD_PRIORITY_NORMAL,
+                                             callback, errback, function,
+                                             name, *args, **kwargs)
+
+    def queue_call_with_priority(self, priority, callback, errback, function,
+                                 name, *args, **kwargs):
+        call = ThreadPoolCall(self, priority, callback, errback, function,
+                              name, args, kwargs)
+        self.condition.acquire()
+        try:
+            self.queues[priority].append(call)
+            if self.started:
+                self._start_threads_for_work()
+        finally:
+            self.condition.release()
+        return call
+
+    def cancel_call(self, call):
+        self.condition.acquire()
+        try:
+            call.canceled = True
+            try:
+                self.queues[call.priority].remove(call)
+            except ValueError:
+                pass # already running or finished
+            else:
+                call._unlink()
+        finally:
+            self.condition.release()
+
+    def has_pending_calls(self):
+        """Check if there are calls waiting for a thread to run them."""
+        self.condition.acquire()
+        try:
+            for queue in self.queues.itervalues():
+                if queue:
+                    return True
+            return False
+        finally:
+            self.condition.release()
+
+    def get_stats(self):
+        """Get a dict describing the pool's current state."""
+        self.condition.acquire()
+        try:
+            return {
+                'threads': len(self.threads),
+                'idle_threads': self.idle_thread_count,
+                'queued': dict((priority, len(queue))
+                               for priority, queue in self.queues.iteritems()),
+                'running': self.running.copy(),
+            }
+        finally:
+            self.condition.release()
 
     def close_threads(self):
-        for x in xrange(len(self.threads)):
-            self.queue.put("QUIT")
+        self.condition.acquire()
+        try:
+            self.generation += 1
+            self.started = False
+            threads = self.threads
+            self.threads = []
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
         # Why is there a timeout on the join() here, what's wrong?  On
         # shutdown, the system waits for the eventloop to finish using 
         # eventloop.join() but eventloop calls close_threads() which wait
@@ -226,12 +672,11 @@ class ThreadPool(object):
         # in a blocking operation which is exactly the point of having them
         # so eventloop.join() in turn blocks.  So if it doesn't clean up
         # in time let the daemon flag in the Thread() do its job.  See #16584.
-        for t in self.threads:
+        for t in threads:
             try:
                 t.join(0.5)
             except StandardError:
                 pass
-        self.threads = []
 
 class SimpleEventLoop(signals.SignalEmitter):
     def __init__(self):
@@ -243,8 +688,13 @@ class SimpleEventLoop(signals.SignalEmitter):
         self.quit_flag = False
         self.wake_sender, self.wake_receiver = util.make_dummy_socket_pair()
         self.loop_ready = threading.Event()
+        self.loop_thread = None
+
+    def in_loop_thread(self):
+        return threading.currentThread() is self.loop_thread
 
     def loop(self):
+        self.loop_thread = threading.currentThread()
         self.loop_ready.set()
         self.emit('thread-will-start')
         self.emit('thread-started', threading.currentThread())
@@ -282,12 +732,17 @@ class SimpleEventLoop(signals.SignalEmitter):
         self.wake_receiver.recv(1024)
 
 class EventLoop(SimpleEventLoop):
+    # max time to spend on idle calls before going back to check for socket
+    # activity and timeouts.
+    IDLE_TIME_BUDGET = 0.1
+
     def __init__(self):
         SimpleEventLoop.__init__(self)
         self.create_signal('event-finished')
         self.scheduler = Scheduler()
-        self.idle_queue = CallQueue()
-        self.urgent_queue = CallQueue()
+        self.idle_queue = CallQueue('idle', self.wakeup, self.in_loop_thread)
+        self.urgent_queue = CallQueue('urgent', self.wakeup,
+                                      self.in_loop_thread)
         self.threadpool = ThreadPool(self)
         self.read_callbacks = {}
         self.write_callbacks = {}
@@ -314,8 +769,14 @@ class EventLoop(SimpleEventLoop):
 
     def call_in_thread(self, callback, errback, function, name,
                        *args, **kwargs):
-        self.threadpool.queue_call(callback, errback, function, name,
-                                  *args, **kwargs)
+        return self.threadpool.queue_call(callback, errback, function, name,
+                                          *args, **kwargs)
+
+    def call_in_thread_with_priority(self, priority, callback, errback,
+                                     function, name, *args, **kwargs):
+        return self.threadpool.queue_call_with_priority(priority, callback,
+                                                        errback, function,
+                                                        name, *args, **kwargs)
 
     def run_idle_next_loop(self, function, name, args=None, kwargs=None):
         """Add an idle callback to be called on the next event loop."""
@@ -338,6 +799,11 @@ class EventLoop(SimpleEventLoop):
         return (self.read_callbacks.keys(), self.write_callbacks.keys(), [])
 
     def calc_timeout(self):
+        # Idles added from the event loop thread don't write to the waker
+        # socket, so we can't block while any are pending.
+        if (self.idle_queue.has_pending_idle() or
+                self.urgent_queue.has_pending_idle()):
+            return 0
         return self.scheduler.next_timeout()
 
     def do_begin_loop(self):
@@ -350,9 +816,6 @@ class EventLoop(SimpleEventLoop):
         for func, name, args, kwargs in self.idles_for_next_loop:
             self.idle_queue.add_idle(func, name, args, kwargs)
         self.idles_for_next_loop = []
-        # call wakeup() to make sure we process the idles we just
-        # added
-        self.wakeup()
 
     def _process_urgent_events(self):
         queue = self.urgent_queue
@@ -378,8 +841,13 @@ class EventLoop(SimpleEventLoop):
             yield callback
         while self.scheduler.has_pending_timeout():
             yield self.scheduler.process_next_timeout
+        # Run idles until IDLE_TIME_BUDGET is used up.  Anything left over
+        # gets run on the next loop, after we've checked the sockets.
+        deadline = clock() + self.IDLE_TIME_BUDGET
         while self.idle_queue.has_pending_idle():
             yield self.idle_queue.process_next_idle
+            if clock() >= deadline:
+                break
 
     def generate_callbacks(self, ready_list, map_, removed):
         for fd in ready_list:
@@ -455,34 +923,69 @@ def add_timeout(delay, function, name, args=None, kwargs=None):
     _eventloop.wakeup()
     return dc
 
-def add_idle(function, name, args=None, kwargs=None):
+def add_idle(function, name, args=None, kwargs=None, coalesce_key=None):
     """Schedule a function to be called when we get some spare time.
     Returns a ``DelayedCall`` object that can be used to cancel the
     call.
+
+    If coalesce_key is given and there's already an idle waiting to run with
+    that key, no new idle is added.  Instead the waiting idle will call
+    function with the new args and kwargs, and is returned.
     """
-    dc = _eventloop.idle_queue.add_idle(function, name, args, kwargs)
-    _eventloop.wakeup()
-    return dc
+    return _eventloop.idle_queue.add_idle(function, name, args, kwargs,
+                                          coalesce_key)
 
-def add_urgent_call(function, name, args=None, kwargs=None):
+def add_urgent_call(function, name, args=None, kwargs=None,
+                    coalesce_key=None):
     """Schedule a function to be called as soon as possible.  This
     method should be used for things like GUI actions, where the user
     is waiting on us.
+
+    coalesce_key works the same as in ``add_idle()``.
     """
-    dc = _eventloop.urgent_queue.add_idle(function, name, args, kwargs)
-    _eventloop.wakeup()
-    return dc
+    return _eventloop.urgent_queue.add_idle(function, name, args, kwargs,
+                                            coalesce_key)
 
 def call_in_thread(callback, errback, function, name, *args, **kwargs):
     """Schedule a function to be called in a separate thread.
 
+    Returns a ``ThreadPoolCall`` object that can be used to cancel the
+    call.
+
     .. Warning::
 
        Do not put code that accesses the database or the UI here!
     """
-    _eventloop.call_in_thread(
+    return _eventloop.call_in_thread(
         callback, errback, function, name, *args, **kwargs)
 
+def call_in_thread_with_priority(priority, callback, errback, function, name,
+                                 *args, **kwargs):
+    """Like ``call_in_thread()``, but use a specific priority class.
+
+    priority should be one of the THREAD_PRIORITY_* constants.
+    """
+    return _eventloop.call_in_thread_with_priority(
+        priority, callback, errback, function, name, *args, **kwargs)
+
+def get_callback_stats(sort_by='total_time', limit=None):
+    """Get timing info for the callbacks that the event loop has run.
+
+    See ``EventLoopStats.get_callback_stats()`` for details.
+    """
+    return stats.get_callback_stats(sort_by, limit)
+
+def get_queue_stats():
+    """Get histograms of how long calls waited in the event loop queues.
+
+    See ``EventLoopStats.get_queue_stats()`` for details.
+    """
+    return stats.get_queue_stats()
+
+def reset_stats():
+    """Reset the event loop timing stats."""
+    stats.reset()
+
 lt = None
 
 profile_file = None
@@ -505,8 +1008,12 @@ def startup():
     _eventloop.loop_ready.wait()
 
 def setup_config_watcher():
+    # args is (watcher, signal, key, value).  Coalesce changes to the same
+    # key, the callback only needs to see the latest value.
     app.backend_config_watcher = config.ConfigWatcher(
-            lambda func, *args: add_idle(func, "config callback", args=args))
+            lambda func, *args: add_idle(func, "config callback", args=args,
+                                         coalesce_key=('config callback',) +
+                                         args[:-1]))
 
 def join():
     if lt is not None:
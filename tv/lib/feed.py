@@ -32,6 +32,7 @@
 FIXME - talk about Feed architecture here
 """
 
+import hashlib
 import os
 import re
 import time
@@ -68,6 +69,7 @@ from miro import fileutil
 from miro.plat.utils import filename_to_unicode, make_url_safe, unmake_url_safe
 from miro.plat.filebundle import is_file_bundle
 from miro import filetypes
+from miro import feeddiff
 from miro.item import FeedParserValues
 from miro import searchengines
 from miro import workerprocess
@@ -86,28 +88,6 @@ def default_feed_icon_url():
 def default_feed_icon_path():
     return resources.path(DEFAULT_FEED_ICON)
 
-class _RateLimiter(object):
-    """Helper class used by create_items_for_parsed() to avoid hogging the
-    GIL.
-
-    This class helps ensure that a potentially long-running operation doesn't
-    take more than a fixed-percentage of the CPU.  It's not really a great
-    solution, but it's the simplest way for 4.0.2
-    """
-    def __init__(self):
-        self.last_time = time.time()
-
-    def check_for_sleep(self):
-        elapsed = self.last_time - time.time()
-        if elapsed < 0.1:
-            return # don't sleep until a decent of time has passed.
-        # We want to yield at least 10% of the CPU.  Sleep for 10% of the time
-        # we took since the last check
-        sleep_time = elapsed / 10.0
-        time.sleep(sleep_time)
-        # get ready for the next check() call
-        self.last_time = time.time()
-
 # Notes on character set encoding of feeds:
 #
 # The parsing libraries built into Python mostly use byte strings
@@ -224,19 +204,109 @@ def _on_config_change(obj, key, value):
                 pass
             feed.set_update_frequency(update_freq)
 
-def run_feedparser(html, callback, errback):
+def run_feed_diff(html, index, callback, errback):
+    """Parse a feed and compare it to the items we already have.
+
+    :param html: feed data
+    :param index: feeddiff.FeedEntryIndex for our items
+    :param callback: function to call with a feeddiff.FeedDiff
+    :param errback: function to call if there's an error
+    """
     if _RUN_FEED_PARSER_INLINE:
         try:
-            rv = feedparserutil.parse(html)
+            rv = feeddiff.calc_feed_diff(feedparserutil.parse(html), index)
         except StandardError, e:
             errback(e)
         else:
             callback(rv)
     else:
-        workerprocess.send(workerprocess.FeedparserTask(html),
+        workerprocess.send(workerprocess.FeedDiffTask(html, index),
                            lambda msg, result: callback(result),
                            lambda msg, error: errback(error))
 
+def run_feed_diff_for_file(path, charset, index, stop_after_known, callback,
+                           errback):
+    """Like run_feed_diff(), but for a feed stored in a file.
+
+    The feed gets parsed a few entries at a time, so it never needs to be in
+    memory all at once.  The file is deleted once we're done with it.
+
+    :param path: file with the feed data
+    :param charset: charset from the HTTP headers or None
+    :param index: feeddiff.FeedEntryIndex for our items
+    :param stop_after_known: stop parsing after this many known entries in
+        a row, or None to parse the whole feed
+    :param callback: function to call with a feeddiff.FeedDiff
+    :param errback: function to call if there's an error
+    """
+    def remove_file():
+        try:
+            fileutil.remove(path)
+        except OSError:
+            logging.warn("error removing feed file: %s", path)
+    def on_result(result):
+        remove_file()
+        callback(result)
+    def on_error(error):
+        remove_file()
+        errback(error)
+    if _RUN_FEED_PARSER_INLINE:
+        try:
+            rv = feeddiff.calc_feed_diff_for_file(path, index, charset,
+                                                  stop_after_known)
+        except StandardError, e:
+            on_error(e)
+        else:
+            on_result(rv)
+    else:
+        task = workerprocess.FeedFileDiffTask(path, charset, index,
+                                              stop_after_known)
+        workerprocess.send(task, lambda msg, result: on_result(result),
+                           lambda msg, error: on_error(error))
+
+# Counts of how RSS feed updates went.  "fetched" is the number of feeds
+# where we got the whole body, including the body we got when the feed was
+# created.  "not_modified" is the number where the server sent a 304 and
+# "body_unchanged" is the number of fetched bodies that were the same as last
+# time, so we skipped parsing them.
+_update_stats = {
+    'fetched': 0,
+    'not_modified': 0,
+    'body_unchanged': 0,
+}
+
+def get_update_stats():
+    """Get stats on how many feed updates we were able to skip.
+
+    :returns: dict with the keys fetched, not_modified, body_unchanged and
+    skip_rate.  skip_rate is the fraction of updates where we didn't need to
+    parse the feed.
+    """
+    stats = _update_stats.copy()
+    total = stats['fetched'] + stats['not_modified']
+    skipped = stats['body_unchanged'] + stats['not_modified']
+    if total > 0:
+        stats['skip_rate'] = float(skipped) / total
+    else:
+        stats['skip_rate'] = 0.0
+    return stats
+
+def reset_update_stats():
+    for key in _update_stats:
+        _update_stats[key] = 0
+
+def calc_body_hash(body):
+    """Calculate the hash that we use to tell if a feed body has changed.
+    """
+    return unicode(hashlib.sha1(body).hexdigest())
+
+# Feed bodies bigger than this get saved to a file and parsed a few entries
+# at a time, rather than being kept in memory.
+STREAMING_FEED_THRESHOLD = 4 * 1024 * 1024
+# When parsing a feed from a file, stop after this many entries in a row
+# that we already have.
+STREAMING_STOP_AFTER_KNOWN = 50
+
 # Wait X seconds before updating the feeds at startup
 INITIAL_FEED_UPDATE_DELAY = 5.0
 
@@ -393,7 +463,7 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
     ICON_CACHE_VITAL = True
 
     def setup_new(self, url, initiallyAutoDownloadable=None,
-                 search_term=None, title=None):
+                 search_term=None, title=None, queue_generate=False):
         check_u(url)
         if initiallyAutoDownloadable == None:
             mode = app.config.get(prefs.CHANNEL_AUTO_DEFAULT)
@@ -435,6 +505,11 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
         self.searchTerm = search_term
         self.userTitle = None
         self.visible = True
+        # estimated chance that an update finds changes (see feedupdate.py)
+        self.change_rate = 1.0
+        # If True, we don't call generate_feed() when we get inserted.  The
+        # code creating us will call generate_feed_from_queue() instead.
+        self._queue_generate = queue_generate
         self.setup_common()
 
     def setup_restored(self):
@@ -514,7 +589,8 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
         return cls.make_view("orig_url LIKE 'dtv:directoryfeed:%'")
 
     def on_db_insert(self):
-        self.generate_feed(True)
+        if not self._queue_generate:
+            self.generate_feed(True)
 
     def in_folder(self):
         return self.folder_id is not None
@@ -533,7 +609,7 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
         DDBObject.signal_change(self, needs_save=needs_save)
 
     def on_signal_change(self):
-        is_updating = bool(self.actualFeed.updating)
+        is_updating = bool(self.is_updating())
         if self.wasUpdating and not is_updating:
             self.emit('update-finished')
         self.wasUpdating = is_updating
@@ -547,14 +623,14 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
         self.auto_pending_items = models.Item.feed_auto_pending_view(self.id)
         self.unwatched_items = models.Item.feed_unwatched_view(self.id)
 
-    def update_after_restore(self):
+    def update_after_restore(self, delay=INITIAL_FEED_UPDATE_DELAY):
         if self.actualFeed.__class__ == FeedImpl:
             # Our initial FeedImpl was never updated, call
             # generate_feed again
             self.loading = True
             eventloop.add_idle(lambda: self.generate_feed(True), "generate_feed")
         else:
-            self.schedule_update_events(INITIAL_FEED_UPDATE_DELAY)
+            self.schedule_update_events(delay)
 
     def clean_old_items(self):
         if self.actualFeed:
@@ -727,6 +803,12 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
         self.visible = visible
         self.signal_change()
 
+    def set_change_rate(self, change_rate):
+        if self.change_rate == change_rate:
+            return
+        self.change_rate = change_rate
+        self.signal_change()
+
     @returns_unicode
     def get_autodownload_mode(self):
         self.confirm_db_thread()
@@ -873,6 +955,22 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
         if newFeed:
             self.finish_generate_feed(newFeed)
 
+    def generate_feed_from_queue(self):
+        """Call generate_feed() from the feed update queue.
+
+        Used for feeds created with queue_generate=True, see
+        feedupdate.schedule_bulk_updates().
+        """
+        if not self.id_exists():
+            return
+        if not self.loading:
+            self.emit('update-finished')
+            return
+        # The update queue waits for update-finished, on_signal_change()
+        # will send it once we're done loading.
+        self.wasUpdating = True
+        self.generate_feed(True)
+
     def is_watched_folder(self):
         return self.orig_url.startswith("dtv:directoryfeed:")
 
@@ -1139,6 +1237,7 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
         if isinstance(self.actualFeed, DirectoryWatchFeedImpl):
             move_items_to = None
         self.cancel_update_events()
+        feedupdate.cancel_update(self)
         if self.download is not None:
             self.download.cancel()
             self.download = None
@@ -1154,6 +1253,7 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
                 item.remove()
         finally:
             app.bulk_sql_manager.finish()
+        models.Item.entry_index_tracker.remove_index(self.id)
         self.remove_icon_cache()
         DDBObject.remove(self)
         self.actualFeed.remove()
@@ -1200,8 +1300,8 @@ class ThrottledUpdateFeedImpl(FeedImpl):
                     self.update)
         else:
             if self.updateFreq > 0:
-                feedupdate.schedule_update(self.updateFreq, self.ufeed,
-                        self.update)
+                feedupdate.schedule_periodic_update(self.updateFreq,
+                        self.ufeed, self.update)
 
 class RSSFeedImplBase(ThrottledUpdateFeedImpl):
     """
@@ -1211,7 +1311,7 @@ class RSSFeedImplBase(ThrottledUpdateFeedImpl):
         FeedImpl.setup_new(self, url, ufeed, title)
         self.schedule_update_events(0)
 
-    def _handle_new_entry(self, entry, fp_values, channel_title):
+    def _handle_new_entry(self, fp_values, channel_title):
         """Handle getting a new entry from a feed."""
         enclosure = fp_values.first_video_enclosure
         if ((self.url.startswith('file://') and enclosure
@@ -1227,18 +1327,39 @@ class RSSFeedImplBase(ThrottledUpdateFeedImpl):
                 item.remove()
 
     def remember_old_items(self):
-        self.old_items = set(self.items)
+        # Items that aren't in the feed anymore are candidates for
+        # truncate_old_items().  We get them from the vanished_ids of the
+        # diffs in _create_items_for_diff().  None means we haven't seen a
+        # diff yet.
+        self.old_items = None
+
+    def make_entry_index(self):
+        """Get the FeedEntryIndex for the items in this feed.
 
-    def create_items_for_parsed(self, parsed):
-        """Update the feed using parsed XML passed in"""
+        The first time this is called we build the index from the item
+        table.  After that, Item keeps it up to date.
+        """
+        tracker = models.Item.entry_index_tracker
+        index = tracker.get_index(self.ufeed.id)
+        if index is None:
+            rows = models.Item.select(feeddiff.FeedEntryIndex.COLUMNS,
+                                      'feed_id=?', (self.ufeed.id,))
+            index = feeddiff.FeedEntryIndex(rows)
+            tracker.set_index(self.ufeed.id, index)
+        return index
+
+    def create_items_for_diff(self, diff):
+        """Update the feed using a FeedDiff from the worker process"""
+        feedupdate.record_update_result(self.ufeed, bool(
+            diff.new_entries or diff.changed_entries))
         app.bulk_sql_manager.start()
         try:
-            self._create_items_for_parsed(parsed)
+            self._create_items_for_diff(diff)
         finally:
             app.bulk_sql_manager.finish()
 
-    def _create_items_for_parsed(self, parsed):
-        rate_limiter = _RateLimiter()
+    def _create_items_for_diff(self, diff):
+        parsed = diff.parsed
         channel_title = None
         try:
             channel_title = parsed["feed"]["title"]
@@ -1267,55 +1388,26 @@ class RSSFeedImplBase(ThrottledUpdateFeedImpl):
                 self.thumbURL = image_url
                 self.ufeed.icon_cache.request_update(is_vital=True)
 
-        items_byid = {}
-        items_byURLTitle = {}
-        items_nokey = []
-        for item in self.items:
-            rate_limiter.check_for_sleep()
+        # items that are still in the feed shouldn't be truncated
+        if self.old_items is None:
+            self.old_items = set(diff.vanished_ids)
+        else:
+            self.old_items.intersection_update(diff.vanished_ids)
+        for item_id, fp_values in diff.changed_entries:
             try:
-                items_byid[item.get_rss_id()] = item
-            except KeyError:
-                items_nokey.append(item)
-            by_url_title_key = (item.url, item.entry_title)
-            if by_url_title_key != (None, None):
-                items_byURLTitle[by_url_title_key] = item
-        for entry in parsed.entries:
-            rate_limiter.check_for_sleep()
-            entry = self.add_scraped_thumbnail(entry)
-            fp_values = FeedParserValues(entry)
-            new = True
-            if fp_values.data['rss_id'] is not None:
-                id_ = fp_values.data['rss_id']
-                if items_byid.has_key(id_):
-                    item = items_byid[id_]
-                    if not fp_values.compare_to_item(item):
-                        item.update_from_feed_parser_values(fp_values)
-                    new = False
-                    self.old_items.discard(item)
-            if new:
-                by_url_title_key = (fp_values.data['url'],
-                        fp_values.data['entry_title'])
-                if by_url_title_key != (None, None):
-                    if items_byURLTitle.has_key(by_url_title_key):
-                        item = items_byURLTitle[by_url_title_key]
-                        if not fp_values.compare_to_item(item):
-                            item.update_from_feed_parser_values(fp_values)
-                        new = False
-                        self.old_items.discard(item)
-            if new:
-                for item in items_nokey:
-                    if fp_values.compare_to_item(item):
-                        new = False
-                    else:
-                        try:
-                            if fp_values.compare_to_item_enclosures(item):
-                                item.update_from_feed_parser_values(fp_values)
-                                new = False
-                                self.old_items.discard(item)
-                        except StandardError:
-                            pass
-            if new and fp_values.first_video_enclosure is not None:
-                self._handle_new_entry(entry, fp_values, channel_title)
+                item = models.Item.get_by_id(item_id)
+            except ObjectNotFoundError:
+                # removed while the worker process was parsing the feed
+                continue
+            if not fp_values.compare_to_item(item):
+                item.update_from_feed_parser_values(fp_values)
+            else:
+                # The item was created before we stored hashes.  Save it
+                # now, so next time we can skip loading the item.
+                item.feedparser_hash = fp_values.calc_hash()
+                item.signal_change(can_change_views=False)
+        for fp_values in diff.new_entries:
+            self._handle_new_entry(fp_values, channel_title)
 
     def _allow_feed_to_override_title(self):
         """Should the RSS feed override the default title?
@@ -1348,7 +1440,8 @@ class RSSFeedImplBase(ThrottledUpdateFeedImpl):
 
         self.ufeed.recalc_counts()
         if hasattr(self, "old_items"):
-            self.truncate_old_items()
+            if self.old_items is not None:
+                self.truncate_old_items()
             del self.old_items
         self.signal_change()
 
@@ -1374,23 +1467,17 @@ class RSSFeedImplBase(ThrottledUpdateFeedImpl):
             return
 
         candidates = []
-        for item in self.old_items:
+        for item_id in self.old_items:
+            try:
+                item = models.Item.get_by_id(item_id)
+            except ObjectNotFoundError:
+                continue
             if item.downloader is None:
                 candidates.append((item.creation_time, item))
         candidates.sort()
         for time_, item in candidates[:extra]:
             item.remove()
 
-    def add_scraped_thumbnail(self, entry):
-        # skip this if the entry already has a thumbnail.
-        if entry.has_key('thumbnail'):
-            return entry
-        if entry.has_key('enclosures'):
-            for enc in entry['enclosures']:
-                if enc.has_key('thumbnail'):
-                    return entry
-        return entry
-
 class RSSFeedImpl(RSSFeedImplBase):
     def setup_new(self, url, ufeed, title=None, initialHTML=None, etag=None,
                   modified=None):
@@ -1398,6 +1485,8 @@ class RSSFeedImpl(RSSFeedImplBase):
         self.initialHTML = initialHTML
         self.etag = etag
         self.modified = modified
+        self.body_hash = None
+        self.pending_body_hash = None
         self.download = None
 
     @returns_unicode
@@ -1426,20 +1515,30 @@ class RSSFeedImpl(RSSFeedImplBase):
         if not self.ufeed.id_exists():
             return
         logging.warning("Error updating feed: %s: %s", self.url, e)
+        self.pending_body_hash = None
         self.feedparser_finished()
 
     def feedparser_callback(self, parsed):
+        """Update the feed using an already parsed feed."""
+        self.feed_diff_callback(feeddiff.calc_feed_diff(
+            parsed, self.make_entry_index()))
+
+    def feed_diff_callback(self, diff):
         self.ufeed.confirm_db_thread()
         if not self.ufeed.id_exists():
             return
-        if len(parsed.entries) == len(parsed.feed) == 0:
+        # Only remember the body hash once we've successfully parsed the
+        # feed.  Otherwise a parse error would stop us from trying again.
+        self.body_hash = self.pending_body_hash
+        self.pending_body_hash = None
+        if diff.entry_count == len(diff.parsed.feed) == 0:
             logging.warn("Empty feed, not updating: %s", self.url)
             self.feedparser_finished()
             return
         start = clock()
-        self.parsed = parsed
+        self.parsed = diff.parsed
         self.remember_old_items()
-        self.create_items_for_parsed(parsed)
+        self.create_items_for_diff(diff)
 
         try:
             updateFreq = self.parsed["feed"]["ttl"]
@@ -1455,8 +1554,19 @@ class RSSFeedImpl(RSSFeedImplBase):
 
     def call_feedparser(self, html):
         self.ufeed.confirm_db_thread()
-        run_feedparser(html, self.feedparser_callback,
-                self.feedparser_errback)
+        run_feed_diff(html, self.make_entry_index(), self.feed_diff_callback,
+                      self.feedparser_errback)
+
+    def call_feedparser_for_file(self, path, charset):
+        self.ufeed.confirm_db_thread()
+        if self.initialUpdate:
+            # we want all the entries the first time around
+            stop_after_known = None
+        else:
+            stop_after_known = STREAMING_STOP_AFTER_KNOWN
+        run_feed_diff_for_file(path, charset, self.make_entry_index(),
+                               stop_after_known, self.feed_diff_callback,
+                               self.feedparser_errback)
 
     def update(self):
         """Updates a feed
@@ -1472,6 +1582,10 @@ class RSSFeedImpl(RSSFeedImplBase):
         if hasattr(self, 'initialHTML') and self.initialHTML is not None:
             html = self.initialHTML
             self.initialHTML = None
+            # We fetched this body when we figured out the feed type, so
+            # count it like any other fetch.
+            _update_stats['fetched'] += 1
+            self.pending_body_hash = calc_body_hash(html)
             self.call_feedparser(html)
         else:
             try:
@@ -1485,7 +1599,8 @@ class RSSFeedImpl(RSSFeedImplBase):
             logging.debug("updating %s", self.url)
             self.download = grab_url(self.url, self._update_callback,
                     self._update_errback, etag=etag, modified=modified,
-                                    default_mime_type=u'application/rss+xml')
+                    default_mime_type=u'application/rss+xml',
+                    body_file_threshold=STREAMING_FEED_THRESHOLD)
 
     def _update_errback(self, error):
         if not self.ufeed.id_exists():
@@ -1498,16 +1613,29 @@ class RSSFeedImpl(RSSFeedImplBase):
 
     def _update_callback(self, info):
         if not self.ufeed.id_exists():
+            if 'body-file' in info:
+                fileutil.remove(info['body-file'])
             return
         if info.get('status') == 304:
             logging.debug("RSSFeedImpl: _update_callback: "
                           "status 304 (%s)", self.ufeed)
+            _update_stats['not_modified'] += 1
+            feedupdate.record_update_result(self.ufeed, False)
             self.schedule_update_events(-1)
             self.updating = False
             self.ufeed.signal_change()
             return
-        html = info['body']
-        if info.has_key('charset'):
+        # Big feeds get saved to a file by grab_url() instead of being
+        # returned in info['body']
+        body_file = info.get('body-file')
+        if body_file is None:
+            html = info['body']
+        _update_stats['fetched'] += 1
+        if 'body-hash' in info:
+            body_hash = info['body-hash']
+        else:
+            body_hash = calc_body_hash(html)
+        if body_file is None and info.has_key('charset'):
             html = fix_xml_header(html, info['charset'])
 
         # FIXME HTML can be non-unicode here --NN
@@ -1520,7 +1648,25 @@ class RSSFeedImpl(RSSFeedImplBase):
             self.modified = unicodify(info['last-modified'])
         else:
             self.modified = None
-        self.call_feedparser(html)
+        if body_hash == self.body_hash:
+            # Lots of servers ignore etag/modified and send the whole feed
+            # every time.  If it's byte-for-byte the same as last time,
+            # there's no need to parse it again.
+            logging.debug("RSSFeedImpl: _update_callback: "
+                          "body unchanged (%s)", self.ufeed)
+            _update_stats['body_unchanged'] += 1
+            feedupdate.record_update_result(self.ufeed, False)
+            self.schedule_update_events(-1)
+            self.updating = False
+            self.ufeed.signal_change()
+            if body_file is not None:
+                fileutil.remove(body_file)
+            return
+        self.pending_body_hash = body_hash
+        if body_file is not None:
+            self.call_feedparser_for_file(body_file, info.get('charset'))
+        else:
+            self.call_feedparser(html)
 
     @returns_unicode
     def get_license(self):
@@ -1541,11 +1687,13 @@ class RSSFeedImpl(RSSFeedImplBase):
         """Called by pickle during deserialization
         """
         FeedImpl.setup_restored(self)
+        self.pending_body_hash = None
         self.download = None
 
     def clean_old_items(self):
         self.modified = None
         self.etag = None
+        self.body_hash = None
         self.update()
 
 class RSSMultiFeedBase(RSSFeedImplBase):
@@ -1604,12 +1752,12 @@ class RSSMultiFeedBase(RSSFeedImplBase):
                             self.url, url)
         self.feedparser_finished(url, True)
 
-    def feedparser_callback(self, parsed, url):
+    def feed_diff_callback(self, diff, url):
         self.ufeed.confirm_db_thread()
         if not self.ufeed.id_exists() or url not in self.download_dc:
             return
         start = clock()
-        self.create_items_for_parsed(parsed)
+        self.create_items_for_diff(diff)
         self.feedparser_finished(url)
         end = clock()
         if end - start > 1.0:
@@ -1618,8 +1766,8 @@ class RSSMultiFeedBase(RSSFeedImplBase):
 
     def call_feedparser(self, html, url):
         self.ufeed.confirm_db_thread()
-        run_feedparser(html,
-            lambda parsed, url=url: self.feedparser_callback(parsed, url),
+        run_feed_diff(html, self.make_entry_index(),
+            lambda diff, url=url: self.feed_diff_callback(diff, url),
             lambda e, url=url: self.feedparser_errback(e, url))
 
     def update(self):
@@ -1657,6 +1805,7 @@ class RSSMultiFeedBase(RSSFeedImplBase):
         if info.get('status') == 304:
             logging.debug("RSSMultiFeedBase: _update_callback: "
                           "status 304 (%s)", self.ufeed)
+            feedupdate.record_update_result(self.ufeed, False)
             self.schedule_update_events(-1)
             self.updating -= 1
             self.check_update_finished()
@@ -2466,7 +2615,7 @@ class SearchFeedImpl(RSSMultiFeedBase):
         self.update()
         self.ufeed.signal_change()
 
-    def _handle_new_entry(self, entry, fp_values, channel_title):
+    def _handle_new_entry(self, fp_values, channel_title):
         """Handle getting a new entry from a feed."""
         url = fp_values.data['url']
         if url is not None:
@@ -2475,22 +2624,20 @@ class SearchFeedImpl(RSSMultiFeedBase):
                 for item in dl.item_list:
                     if ((item.get_feed_url() == 'dtv:searchDownloads'
                          and item.get_url() == url)):
-                        try:
-                            if entry["id"] == item.get_rss_id():
-                                item.set_feed(self.ufeed.id)
-                                if not fp_values.compare_to_item(item):
-                                    item.update_from_feed_parser_values(fp_values)
-                                return
-                        except KeyError:
-                            pass
-                        title = entry.get("title")
+                        rss_id = fp_values.data['rss_id']
+                        if rss_id is not None and rss_id == item.get_rss_id():
+                            item.set_feed(self.ufeed.id)
+                            if not fp_values.compare_to_item(item):
+                                item.update_from_feed_parser_values(fp_values)
+                            return
+                        title = fp_values.data['entry_title']
                         oldtitle = item.entry_title
                         if title == oldtitle:
                             item.set_feed(self.ufeed.id)
                             if not fp_values.compare_to_item(item):
                                 item.update_from_feed_parser_values(fp_values)
                             return
-        RSSMultiFeedBase._handle_new_entry(self, entry, fp_values, channel_title)
+        RSSMultiFeedBase._handle_new_entry(self, fp_values, channel_title)
 
     def update_finished(self):
         self.searching = False
@@ -2715,5 +2862,6 @@ def start_updates():
         return
     for feed in restored_feeds:
         if feed.id_exists():
-            feed.update_after_restore()
+            feed.update_after_restore(feedupdate.calc_startup_delay(
+                INITIAL_FEED_UPDATE_DELAY, len(restored_feeds)))
     restored_feeds = []
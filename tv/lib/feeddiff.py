@@ -0,0 +1,421 @@
+# Miro - an RSS based video player application
+# Copyright (C) 2005, 2006, 2007, 2008, 2009, 2010, 2011
+# Participatory Culture Foundation
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# In addition, as a special exception, the copyright holders give
+# permission to link the code of portions of this program with the OpenSSL
+# library.
+#
+# You must obey the GNU General Public License in all respects for all of
+# the code used other than OpenSSL. If you modify file(s) with this
+# exception, you may extend this exception to your version of the file(s),
+# but you are not obligated to do so. If you do not wish to do so, delete
+# this exception statement from your version. If you delete this exception
+# statement from all source files in the program, then also delete it here.
+
+"""``miro.feeddiff`` -- Compare a parsed feed to the items we already have.
+
+The worker process uses this module to turn a feed into a FeedDiff.  The
+diff only contains the entries that are new or that have changed, so the
+work the backend does for a feed update depends on how much changed, not
+on how big the feed is.
+
+Big feeds can be diffed straight from a file with calc_feed_diff_for_file().
+FeedSplitter splits the file into small documents with a few entries each,
+so we never have the whole feed in memory at once.
+"""
+
+import gzip
+from xml.parsers import expat
+
+from miro import feedparserutil
+from miro.feedparser import FeedParserDict
+from miro.item import FeedParserValues
+from miro.xhtmltools import fix_xml_header
+
+class FeedSplitError(StandardError):
+    """FeedSplitter can't split a feed.
+
+    The feed should be parsed in one piece instead.
+    """
+
+class FeedEntryIndex(object):
+    """Index of the items in a feed, used to match up entries with items.
+
+    The index is built from rows in the item table, rather than from Item
+    objects.  Items are indexed by their rss_id, by (url, entry_title) and,
+    if they don't have an rss_id, by their enclosure data.
+
+    We also store each item's feedparser_hash.  If an entry's hash
+    matches, the item is up to date and we don't need to load it at all.
+
+    The backend keeps the index for each feed around and updates it with
+    add_item() and remove_item() as items change (see
+    item._FeedEntryIndexTracker).
+
+    FeedEntryIndex objects only contain simple types, so they can be sent
+    to the worker process.
+    """
+    # columns to select from the item table to build the index.  Items
+    # have attributes with the same names.
+    COLUMNS = ['id', 'rss_id', 'url', 'entry_title', 'enclosure_size',
+               'enclosure_type', 'enclosure_format', 'feedparser_hash']
+
+    def __init__(self, rows):
+        self.by_rss_id = {}
+        self.by_url_title = {}
+        self.by_enclosure = {}
+        self.hashes = {}
+        # maps item ids to the (rss_id, url_title, enclosure) keys we stored
+        # them under, so that remove_item() can find them
+        self.keys = {}
+        for row in rows:
+            self._add_row(row)
+
+    def __getstate__(self):
+        # the worker process only looks things up, it doesn't need keys
+        state = self.__dict__.copy()
+        del state['keys']
+        return state
+
+    def _add_row(self, row):
+        (id_, rss_id, url, entry_title, enclosure_size, enclosure_type,
+         enclosure_format, feedparser_hash) = row
+        self.hashes[id_] = feedparser_hash
+        enclosure_key = url_title_key = None
+        if rss_id is not None:
+            self.by_rss_id[rss_id] = id_
+        else:
+            enclosure_key = (url, enclosure_size, enclosure_type,
+                             enclosure_format)
+            self.by_enclosure[enclosure_key] = id_
+        if (url, entry_title) != (None, None):
+            url_title_key = (url, entry_title)
+            self.by_url_title[url_title_key] = id_
+        self.keys[id_] = (rss_id, url_title_key, enclosure_key)
+
+    def add_item(self, item):
+        """Add an item to the index, replacing any old data for it."""
+        self.remove_item(item.id)
+        self._add_row([getattr(item, name) for name in self.COLUMNS])
+
+    def remove_item(self, item_id):
+        """Remove an item from the index, if it's there."""
+        if item_id not in self.keys:
+            return
+        del self.hashes[item_id]
+        rss_id, url_title_key, enclosure_key = self.keys.pop(item_id)
+        for mapping, key in ((self.by_rss_id, rss_id),
+                             (self.by_url_title, url_title_key),
+                             (self.by_enclosure, enclosure_key)):
+            # another item may have the same key, leave it alone in that
+            # case
+            if key is not None and mapping.get(key) == item_id:
+                del mapping[key]
+
+    def find(self, fp_values):
+        """Find the item for an entry.
+
+        :returns: item id or None if the entry is new
+        """
+        data = fp_values.data
+        if data['rss_id'] is not None and data['rss_id'] in self.by_rss_id:
+            return self.by_rss_id[data['rss_id']]
+        url_title_key = (data['url'], data['entry_title'])
+        if (url_title_key != (None, None) and
+                url_title_key in self.by_url_title):
+            return self.by_url_title[url_title_key]
+        enclosure_key = (data['url'], data['enclosure_size'],
+                         data['enclosure_type'], data['enclosure_format'])
+        return self.by_enclosure.get(enclosure_key)
+
+class FeedDiff(object):
+    """The changes between a parsed feed and a FeedEntryIndex.
+
+    Attributes:
+        parsed -- the parsed feed, without its entries.  This has the
+            channel data (title, image, ttl, etc).
+        entry_count -- number of entries in the feed
+        new_entries -- FeedParserValues for entries that don't match an item
+            and have a video enclosure
+        changed_entries -- list of (item_id, FeedParserValues) tuples for
+            entries where the item may need to be updated
+
+    The FeedParserValues have had strip_entry() called on them, so we don't
+    send the whole feedparser entry back to the backend.
+        vanished_ids -- set of ids for items that weren't in the feed
+        complete -- False if we stopped before the end of the feed.  In that
+            case vanished_ids is always empty, since we don't know which
+            items are missing.
+    """
+    def __init__(self, parsed, entry_count):
+        self.parsed = parsed
+        self.entry_count = entry_count
+        self.new_entries = []
+        self.changed_entries = []
+        self.vanished_ids = set()
+        self.complete = True
+
+    def __str__(self):
+        return ('FeedDiff (%s entries, %s new, %s changed, %s vanished)' %
+                (self.entry_count, len(self.new_entries),
+                 len(self.changed_entries), len(self.vanished_ids)))
+
+def _make_channel_data(parsed):
+    channel_data = FeedParserDict(parsed)
+    channel_data['entries'] = []
+    return channel_data
+
+def _add_entry(diff, index, fp_values, seen_ids):
+    """Add an entry to a FeedDiff.
+
+    :returns: True if the entry matches an item that's up to date
+    """
+    item_id = index.find(fp_values)
+    if item_id is None:
+        if fp_values.first_video_enclosure is not None:
+            fp_values.strip_entry()
+            diff.new_entries.append(fp_values)
+        return False
+    seen_ids.add(item_id)
+    if index.hashes[item_id] != fp_values.calc_hash():
+        fp_values.strip_entry()
+        diff.changed_entries.append((item_id, fp_values))
+        return False
+    return True
+
+def calc_feed_diff(parsed, index):
+    """Calculate a FeedDiff for a parsed feed.
+
+    :param parsed: FeedParserDict returned by feedparser
+    :param index: FeedEntryIndex for the items we already have
+    """
+    diff = FeedDiff(_make_channel_data(parsed), len(parsed.entries))
+    seen_ids = set()
+    for entry in parsed.entries:
+        _add_entry(diff, index, FeedParserValues(entry), seen_ids)
+    diff.vanished_ids = set(index.hashes).difference(seen_ids)
+    return diff
+
+class FeedSplitter(object):
+    """Split a feed into small documents with a few entries each.
+
+    We run the feed through expat and remember where the top-level
+    item/entry elements start and end.  Each document that we yield has the
+    channel data that comes before the first entry, a batch of entries,
+    then the closing tags for the channel.  Feedparser can handle each of
+    them separately.
+
+    Channel elements that come after the entries are ignored.  Feeds
+    without any entries are yielded in one piece.
+
+    If the feed isn't well-formed XML, FeedSplitError is raised while
+    iterating.
+    """
+    CHUNK_SIZE = 64 * 1024
+    ENTRY_TAGS = ('item', 'entry')
+    TAG_END_CHARS = ('>', ' ', '\t', '\r', '\n')
+
+    def __init__(self, fileobj, batch_size=20, header_filter=None):
+        """Create a FeedSplitter.
+
+        :param fileobj: file object to read the feed from
+        :param batch_size: number of entries in each document
+        :param header_filter: function to call on the first chunk of data,
+            for example to fix the XML declaration
+        """
+        self.fileobj = fileobj
+        self.batch_size = batch_size
+        self.header_filter = header_filter
+
+    def _reset(self):
+        self.data = ''
+        # stream offset of the first byte in self.data
+        self.data_start = 0
+        self.header = None
+        self.footer = None
+        self.depth = 0
+        self.entry_depth = None
+        self.entry_start = None
+        # stream offset where the last entry ended
+        self.entry_end = None
+        self.open_tags = []
+        self.entries = []
+
+    def __iter__(self):
+        self._reset()
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = self._on_start_element
+        parser.EndElementHandler = self._on_end_element
+        self.parser = parser
+        try:
+            for data in self._read_chunks():
+                self.data += data
+                parser.Parse(data, False)
+                for batch in self._pop_batches(self.batch_size):
+                    yield batch
+                self._trim_data()
+            parser.Parse('', True)
+        except expat.ExpatError, e:
+            raise FeedSplitError(str(e))
+        finally:
+            self.parser = None
+        if self.header is None:
+            # no entries, the whole feed is in self.data
+            yield self.data
+        else:
+            for batch in self._pop_batches(1):
+                yield batch
+
+    def _read_chunks(self):
+        data = self.fileobj.read(self.CHUNK_SIZE)
+        if data.startswith(('\xff\xfe', '\xfe\xff')):
+            # byte offsets and our closing tags don't work with UTF-16
+            raise FeedSplitError("UTF-16 feed")
+        if self.header_filter is not None:
+            data = self.header_filter(data)
+        while data:
+            yield data
+            data = self.fileobj.read(self.CHUNK_SIZE)
+
+    def _pop_batches(self, min_size):
+        while self.entries and len(self.entries) >= min_size:
+            batch = self.entries[:self.batch_size]
+            self.entries = self.entries[self.batch_size:]
+            yield ''.join([self.header] + batch + [self.footer])
+
+    def _trim_data(self):
+        # drop data that we don't need anymore.  We need to keep the data
+        # before the first entry and the data after the last entry that we
+        # saw.  Expat doesn't always handle all the data that we give it
+        # right away, so we can't just throw away everything.
+        if self.header is None:
+            return
+        if self.entry_start is not None:
+            keep_from = self.entry_start
+        else:
+            keep_from = self.entry_end
+        self.data = self.data[keep_from - self.data_start:]
+        self.data_start = keep_from
+
+    def _on_start_element(self, name, attrs):
+        if (self.entry_start is None and
+                name.split(':')[-1] in self.ENTRY_TAGS and
+                self.entry_depth in (None, self.depth)):
+            self.entry_start = self.parser.CurrentByteIndex
+            if self.entry_depth is None:
+                self.entry_depth = self.depth
+                self.header = self.data[:self.entry_start]
+                self.footer = ''.join('</%s>' % tag for tag in
+                                      reversed(self.open_tags))
+                self.footer = self.footer.encode('utf-8')
+        self.open_tags.append(name)
+        self.depth += 1
+
+    def _on_end_element(self, name):
+        self.open_tags.pop()
+        self.depth -= 1
+        if self.entry_start is not None and self.depth == self.entry_depth:
+            entry_start = self.entry_start - self.data_start
+            pos = self.parser.CurrentByteIndex - self.data_start
+            end_tag = ('</%s' % name).encode('utf-8')
+            after_name = pos + len(end_tag)
+            if (self.data.startswith(end_tag, pos) and
+                    self.data[after_name:after_name+1] in self.TAG_END_CHARS):
+                # CurrentByteIndex points to the start of the end tag, find
+                # the end of it.
+                entry_end = self.data.index('>', pos) + 1
+            else:
+                # empty element, CurrentByteIndex points past it
+                entry_end = pos
+            self.entries.append(self.data[entry_start:entry_end])
+            self.entry_start = None
+            self.entry_end = entry_end + self.data_start
+
+def open_feed_file(path):
+    """Open a feed file, uncompressing it if needed."""
+    f = open(path, 'rb')
+    magic = f.read(2)
+    f.seek(0)
+    if magic == '\x1f\x8b':
+        f.close()
+        return gzip.GzipFile(path, 'rb')
+    return f
+
+def calc_feed_diff_for_file(path, index, charset=None,
+                            stop_after_known=None):
+    """Calculate a FeedDiff for a feed stored in a file.
+
+    The feed is parsed a few entries at a time, so that big feeds don't use
+    a lot of memory.
+
+    :param path: path to the feed file
+    :param index: FeedEntryIndex for the items we already have
+    :param charset: charset from the HTTP headers, if any
+    :param stop_after_known: if not None, stop after this many entries in a
+        row match items that are up to date, as long as the feed is sorted
+        newest-first.  The FeedDiff that we return won't be complete.
+    """
+    if charset is not None:
+        header_filter = lambda data: fix_xml_header(data, charset)
+    else:
+        header_filter = None
+    f = open_feed_file(path)
+    try:
+        try:
+            return _calc_feed_diff_for_splitter(
+                FeedSplitter(f, header_filter=header_filter), index,
+                stop_after_known)
+        except FeedSplitError:
+            # parse the feed the old way.  Feedparser can handle a lot of
+            # things that expat can't.
+            f.seek(0)
+            data = f.read()
+            if header_filter is not None:
+                data = header_filter(data)
+            return calc_feed_diff(feedparserutil.parse(data), index)
+    finally:
+        f.close()
+
+def _calc_feed_diff_for_splitter(splitter, index, stop_after_known):
+    diff = None
+    seen_ids = set()
+    known_count = 0
+    last_release_date = None
+    sorted_newest_first = True
+    for document in splitter:
+        parsed = feedparserutil.parse(document)
+        if diff is None:
+            diff = FeedDiff(_make_channel_data(parsed), 0)
+        diff.entry_count += len(parsed.entries)
+        for entry in parsed.entries:
+            fp_values = FeedParserValues(entry)
+            if _add_entry(diff, index, fp_values, seen_ids):
+                known_count += 1
+            else:
+                known_count = 0
+            release_date = fp_values.data['release_date']
+            if (last_release_date is not None and release_date is not None
+                    and release_date > last_release_date):
+                sorted_newest_first = False
+            last_release_date = release_date
+            if (stop_after_known is not None and sorted_newest_first and
+                    known_count >= stop_after_known):
+                diff.complete = False
+                return diff
+    diff.vanished_ids = set(index.hashes).difference(seen_ids)
+    return diff
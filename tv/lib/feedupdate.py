@@ -30,15 +30,49 @@
 """feedupdate.py -- Handles updating feeds.
 
 Our basic strategy is to limit the number of feeds that are
-simultaniously updating at any given time.  Right now the limit is set
-to 3.
+simultaniously updating at any given time.  The limit is set by the
+MAX_FEED_UPDATES pref.  We also limit how many feeds from the same host
+can update at once, so that we don't hammer a single server.
+
+Feeds that are updated regularly get scheduled with
+schedule_periodic_update().  We keep track of how often each feed has
+changed when we updated it, and feeds that rarely change get updated less
+often.  The estimate is stored in the feed's change_rate column, so it
+carries over between runs.
 """
 
 import collections
+import random
+import urlparse
 
+from miro import app
 from miro import eventloop
+from miro import prefs
+from miro.clock import clock
+
+# Max number of feeds from the same host that can update at the same time
+MAX_UPDATES_PER_HOST = 2
+
+# How fast we adapt to changes in how often a feed changes.  Each update
+# moves our estimate this fraction of the way towards the latest result.
+CHANGE_RATE_WEIGHT = 0.25
+# Feeds that never change get updated at most this many times less often
+# than their normal update frequency.
+MAX_BACKOFF = 8.0
+
+# When we start up, spread the first updates over a few seconds per feed,
+# up to STARTUP_SPREAD_MAX seconds.
+STARTUP_SPREAD_PER_FEED = 2.0
+STARTUP_SPREAD_MAX = 600.0
 
-MAX_UPDATES = 3
+# When lots of feeds get added at once, start their first updates this many
+# seconds apart.
+BULK_UPDATE_INTERVAL = 0.5
+
+class UpdateLagHistogram(eventloop.LatencyHistogram):
+    """Tracks how long feeds wait in the queue before they start updating.
+    """
+    BUCKETS = (1, 5, 10, 30, 60, 300, 900, 3600)
 
 class FeedUpdateQueue(object):
     def __init__(self):
@@ -46,12 +80,37 @@ class FeedUpdateQueue(object):
         self.timeouts = {}
         self.callback_handles = {}
         self.currently_updating = set()
+        self.updating_hosts = {}
+        self.host_counts = {}
+        self.update_lag = UpdateLagHistogram()
+        self.max_queue_depth = 0
 
     def schedule_update(self, delay, feed, update_callback):
         name = "Feed update (%s)" % feed.get_title()
         self.timeouts[feed.id] = eventloop.add_timeout(delay, self.do_update, 
                 name, args=(feed, update_callback))
 
+    def schedule_periodic_update(self, base_delay, feed, update_callback):
+        self.schedule_update(self.calc_periodic_delay(base_delay, feed),
+                             feed, update_callback)
+
+    def calc_periodic_delay(self, base_delay, feed):
+        """Calculate when to update a feed next.
+
+        If we expect an update to find changes with probability p, we wait
+        base_delay / p, which means we update about once for each change.
+        """
+        change_rate = feed.change_rate
+        return base_delay * min(1.0 / max(change_rate, 1e-6), MAX_BACKOFF)
+
+    def record_update_result(self, feed, changed):
+        if changed:
+            result = 1.0
+        else:
+            result = 0.0
+        feed.set_change_rate(feed.change_rate * (1 - CHANGE_RATE_WEIGHT)
+                             + result * CHANGE_RATE_WEIGHT)
+
     def cancel_update(self, feed):
         try:
             timeout = self.timeouts.pop(feed.id)
@@ -62,29 +121,70 @@ class FeedUpdateQueue(object):
 
     def do_update(self, feed, update_callback):
         del self.timeouts[feed.id]
-        self.update_queue.append((feed, update_callback))
+        self.update_queue.append((feed, update_callback, clock()))
+        self.max_queue_depth = max(self.max_queue_depth,
+                                   len(self.update_queue))
         self.run_update_queue()
 
     def update_finished(self, feed):
         for callback_handle in self.callback_handles.pop(feed.id):
             feed.disconnect(callback_handle)
         self.currently_updating.remove(feed)
+        host = self.updating_hosts.pop(feed.id)
+        if host:
+            self.host_counts[host] -= 1
+            if self.host_counts[host] <= 0:
+                del self.host_counts[host]
         # call run_update_queue in an idle to avoid re-updating the feed that
         # just finished.  That could cause weird effects since we are in the
         # update-finished callback right now.  See #16277
-        eventloop.add_idle(self.run_update_queue, 'run feed update queue')
+        eventloop.add_idle(self.run_update_queue, 'run feed update queue',
+                           coalesce_key='run feed update queue')
+
+    def feed_removed(self, feed):
+        self.update_finished(feed)
+
+    def _get_host(self, feed):
+        try:
+            return urlparse.urlparse(feed.get_url())[1].lower()
+        except (AttributeError, ValueError):
+            return ''
 
     def run_update_queue(self):
+        max_updates = app.config.get(prefs.MAX_FEED_UPDATES)
+        # feeds that have to wait because their host is busy.  They keep
+        # their place at the front of the queue.
+        waiting = collections.deque()
         while (len(self.update_queue) > 0 and 
-               len(self.currently_updating) < MAX_UPDATES):
-            feed, update_callback = self.update_queue.popleft()
-            if feed in self.currently_updating:
+               len(self.currently_updating) < max_updates):
+            feed, update_callback, queued_time = self.update_queue.popleft()
+            if feed in self.currently_updating or not feed.id_exists():
+                continue
+            host = self._get_host(feed)
+            if host and self.host_counts.get(host, 0) >= MAX_UPDATES_PER_HOST:
+                waiting.append((feed, update_callback, queued_time))
                 continue
             handle = feed.connect('update-finished', self.update_finished)
-            handle2 = feed.connect('removed', self.update_finished)
+            handle2 = feed.connect('removed', self.feed_removed)
             self.callback_handles[feed.id] = (handle, handle2)
             self.currently_updating.add(feed)
+            self.updating_hosts[feed.id] = host
+            if host:
+                self.host_counts[host] = self.host_counts.get(host, 0) + 1
+            self.update_lag.add(clock() - queued_time)
             update_callback()
+        if waiting:
+            waiting.extend(self.update_queue)
+            self.update_queue = waiting
+
+    def get_stats(self):
+        return {
+            'queue_depth': len(self.update_queue),
+            'max_queue_depth': self.max_queue_depth,
+            'updating': len(self.currently_updating),
+            'scheduled': len(self.timeouts),
+            'update_lag': self.update_lag.get_stats(),
+        }
 
 global_update_queue = FeedUpdateQueue()
 
@@ -97,3 +197,48 @@ def schedule_update(delay, feed, update_callback):
     the future.
     """
     global_update_queue.schedule_update(delay, feed, update_callback)
+
+def schedule_periodic_update(base_delay, feed, update_callback):
+    """Schedules a regular update for a feed.
+
+    base_delay is the feed's normal update frequency in seconds.  If past
+    updates haven't found changes, we will wait longer than that.
+    """
+    global_update_queue.schedule_periodic_update(base_delay, feed,
+                                                 update_callback)
+
+def schedule_bulk_updates(updates):
+    """Schedule the first update for a bunch of new feeds.
+
+    The updates are spread out BULK_UPDATE_INTERVAL seconds apart, so that
+    adding thousands of feeds doesn't fill the update queue all at once.
+
+    :param updates: list of (feed, update_callback) tuples
+    """
+    for i, (feed, update_callback) in enumerate(updates):
+        schedule_update(i * BULK_UPDATE_INTERVAL, feed, update_callback)
+
+def record_update_result(feed, changed):
+    """Record if updating a feed found any changes.
+
+    This is used to adjust how often we update the feed.
+    """
+    global_update_queue.record_update_result(feed, changed)
+
+def calc_startup_delay(base_delay, feed_count):
+    """Calculate when to first update a feed after we start up.
+
+    We add some random jitter to base_delay, so that feeds don't all try
+    to update at once.
+    """
+    spread = min(feed_count * STARTUP_SPREAD_PER_FEED, STARTUP_SPREAD_MAX)
+    return base_delay + random.uniform(0, spread)
+
+def get_stats():
+    """Get stats on the feed update queue.
+
+    :returns: dict with the keys queue_depth, max_queue_depth, updating,
+    scheduled and update_lag.  update_lag is a dict describing how long
+    feeds waited to start updating (see LatencyHistogram.get_stats()).
+    """
+    return global_update_queue.get_stats()
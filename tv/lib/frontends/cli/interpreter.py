@@ -423,3 +423,13 @@ class MiroInterpreter(cmd.Cmd):
         def callback(dialog):
             print "TEST CHOICE: %s" % dialog.choice
         d.run(callback)
+
+    @run_in_event_loop
+    def do_eventstats(self, line):
+        """eventstats [reset] -- Shows the slowest event loop callbacks."""
+        for output in eventloop.format_stats(
+                eventloop.get_callback_stats(limit=20),
+                eventloop.get_queue_stats()):
+            print output
+        if line.strip() == 'reset':
+            eventloop.reset_stats()
@@ -1675,6 +1675,11 @@ class WidgetsMessageHandler(messages.MessageHandler):
         print "handle_message_to_user"
         dialogs.show_message(title, desc)
 
+    def handle_current_event_loop_stats(self, message):
+        lines = eventloop.format_stats(message.callback_stats,
+                                       message.queue_stats)
+        logging.info("event loop stats:\n%s", '\n'.join(lines))
+
     def handle_notify_user(self, message):
         # if the user has selected that they aren't interested in this
         # notification type, return here...
@@ -39,6 +39,7 @@ in the interface.
 import collections
 
 from miro import app
+from miro import messages
 from miro import prefs
 from miro.data import item
 from miro.data import itemtrack
@@ -113,8 +114,8 @@ class ItemList(itemtrack.ItemTracker):
         # This code should work for either
         return int(self.tab_id.split("-")[1])
 
-    def _fetch_id_list(self):
-        itemtrack.ItemTracker._fetch_id_list(self)
+    def _sync_with_result(self):
+        itemtrack.ItemTracker._sync_with_result(self)
         self._reset_group_info()
 
     def _uncache_row_data(self, id_list):
@@ -122,6 +123,16 @@ class ItemList(itemtrack.ItemTracker):
         # items have changed, so we need to reset all group info
         self._reset_group_info()
 
+    def _rows_loaded_on_demand(self, item_infos):
+        # These rows are about to be displayed.  If their metadata hasn't
+        # been extracted yet, ask the backend to do them before the rest.
+        if self.is_for_device() or self.is_for_share():
+            return
+        item_ids = [info.id for info in item_infos
+                    if info.has_filename and info.duration_ms is None]
+        if item_ids:
+            messages.PrioritizeMetadata(item_ids).send_to_backend()
+
     def _make_base_query(self, tab_type, tab_id):
         if self.is_for_device():
             query = itemtrack.DeviceItemTrackerQuery()
@@ -461,6 +461,18 @@ class DevMenu(Menu):
         item_list.emit('will-change')
         item_list.emit('items-changed', changed_ids)
 
+    @menu_item(_("Log Database Cache Stats"))
+    def on_log_database_cache_stats(menu_item):
+        messages.LogDatabaseCacheStats().send_to_backend()
+
+    @menu_item(_("Log Worker Task Stats"))
+    def on_log_worker_task_stats(menu_item):
+        messages.LogWorkerTaskStats().send_to_backend()
+
+    @menu_item(_("Log Event Loop Stats"))
+    def on_log_event_loop_stats(menu_item):
+        messages.QueryEventLoopStats().send_to_backend()
+
     @menu_item(_("Force Main DB Save Error"))
     def on_force_device_db_save_error(menu_item):
         messages.ForceDBSaveError().send_to_backend()
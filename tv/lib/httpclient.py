@@ -35,9 +35,13 @@ The main ways this module used is grab_url() and grab_headers().  grab_url
 fetches a HTTP or HTTPS url, while grab_headers only fetches the headers.
 """
 
+import errno
+import hashlib
 import logging
 import os
+import select
 import stat
+import tempfile
 import threading
 import urllib
 import Queue
@@ -54,6 +58,7 @@ from miro import net
 from miro import prefs
 from miro import signals
 from miro import util
+from miro.clock import clock
 from miro.gtcache import gettext as _
 from miro.xhtmltools import url_encode_dict, multipart_encode
 from miro.plat import utils
@@ -70,6 +75,10 @@ MAX_AUTH_ATTEMPTS = 5
 
 _logged_noproxy_error = False
 
+# HTTP_VERSION value that enables HTTP/2 over https, or None if our libcurl
+# doesn't support it
+_HTTP_VERSION_2TLS = getattr(pycurl, 'CURL_HTTP_VERSION_2TLS', None)
+
 def user_agent():
     return "%s/%s (%s; %s)" % (app.config.get(prefs.SHORT_APP_NAME),
             app.config.get(prefs.APP_VERSION),
@@ -209,7 +218,7 @@ class TransferOptions(object):
 
     def __init__(self, url, etag=None, modified=None, resume=False,
             post_vars=None, post_files=None, write_file=None,
-                 extra_headers=None):
+                 extra_headers=None, body_file_threshold=None):
         self.url = url
         self.etag = etag
         self.modified = modified
@@ -218,6 +227,7 @@ class TransferOptions(object):
         self.post_vars = post_vars
         self.post_files = post_files
         self.write_file = write_file
+        self.body_file_threshold = body_file_threshold
         self.requires_cookies = False
         self.head_request = False
         self.invalid_url = False
@@ -244,9 +254,12 @@ class TransferOptions(object):
             self.invalid_url = True
             return
 
-    def build_handle(self, out_headers):
+    def build_handle(self, out_headers, handle=None):
         """Build a libCURL handle.  This should only be called inside the
         LibCURLManager thread.
+
+        :param out_headers: dict of headers to send
+        :param handle: clean handle to setup, or None to create a new one
         """
         if self.etag is not None:
             out_headers['etag'] = self.etag
@@ -255,13 +268,14 @@ class TransferOptions(object):
         if self.extra_headers is not None:
             out_headers.update(self.extra_headers)
 
-        handle = self._init_handle()
+        handle = self._init_handle(handle)
         self._setup_post(handle, out_headers)
         self._setup_headers(handle, out_headers)
         return handle
 
-    def _init_handle(self):
-        handle = pycurl.Curl()
+    def _init_handle(self, handle):
+        if handle is None:
+            handle = pycurl.Curl()
         handle.setopt(pycurl.USERAGENT, user_agent())
         handle.setopt(pycurl.FOLLOWLOCATION, 1)
         handle.setopt(pycurl.MAXREDIRS, REDIRECTION_LIMIT)
@@ -280,6 +294,12 @@ class TransferOptions(object):
         handle.setopt(pycurl.URL, self.url)
         if self.head_request:
             handle.setopt(pycurl.NOBODY, 1)
+        if _HTTP_VERSION_2TLS is not None:
+            # Use HTTP/2 for https URLs if the server supports it, that way
+            # the LibCURLManager can multiplex transfers over 1 connection.
+            handle.setopt(pycurl.HTTP_VERSION, _HTTP_VERSION_2TLS)
+            if hasattr(pycurl, 'PIPEWAIT'):
+                handle.setopt(pycurl.PIPEWAIT, 1)
         self._setup_proxy(handle)
         return handle
 
@@ -359,6 +379,11 @@ class CurlTransfer(object):
         self.lock = threading.Lock()
 
     def _reset_transfer_data(self):
+        if getattr(self, 'body_file', None) is not None:
+            # we're sending a new request, throw away the last body
+            self._cleanup_body_file()
+        self.body_file = None
+        self.body_hash = hashlib.sha1()
         self.headers = {}
         self.handle = None
         self.current_auth_type = None
@@ -460,11 +485,13 @@ class CurlTransfer(object):
                 self.proxy_auth = auth
             self._send_new_request()
 
-    def build_handle(self):
+    def build_handle(self, handle=None):
         """Build a libCURL handle.  This should only be called inside the
         LibCURLManager thread.
+
+        :param handle: clean handle to setup, or None to create a new one
         """
-        self.handle = self.options.build_handle(self.out_headers)
+        self.handle = self.options.build_handle(self.out_headers, handle)
         # don't authenticate SSL certificates see #15180
         self.handle.setopt(pycurl.SSL_VERIFYPEER, 0)
 
@@ -485,6 +512,8 @@ class CurlTransfer(object):
                 self.handle.setopt(pycurl.WRITEFUNCTION, self._write_file)
         elif self.content_check_callback is not None:
             self.handle.setopt(pycurl.WRITEFUNCTION, self._call_content_check)
+        elif self.options.body_file_threshold is not None:
+            self.handle.setopt(pycurl.WRITEFUNCTION, self._write_body)
         else:
             self.handle.setopt(pycurl.WRITEFUNCTION, self.buffer.write)
         self.handle.setopt(pycurl.HEADERFUNCTION, self.header_func)
@@ -497,6 +526,30 @@ class CurlTransfer(object):
         if self.check_response_code(self.status_code):
             self._filehandle.write(buf)
 
+    def _write_body(self, buf):
+        self.body_hash.update(buf)
+        if (self.body_file is None and self.buffer.tell() + len(buf) >
+                self.options.body_file_threshold):
+            # The body is too big to keep in memory, move it to a
+            # temporary file.
+            fd, self.body_file = tempfile.mkstemp(prefix='miro-body-')
+            self._filehandle = os.fdopen(fd, 'wb')
+            self._filehandle.write(self.buffer.getvalue())
+            self.buffer = StringIO()
+        if self.body_file is not None:
+            self._filehandle.write(buf)
+        else:
+            self.buffer.write(buf)
+
+    def _cleanup_body_file(self):
+        self._cleanup_filehandle()
+        if self.body_file is not None:
+            try:
+                fileutil.remove(self.body_file)
+            except OSError:
+                pass
+            self.body_file = None
+
     def _lookup_auth(self):
         """Lookup existing HTTP passwords to use.
 
@@ -639,6 +692,9 @@ class CurlTransfer(object):
 
     def on_headers_finished(self):
         if self.header_callback:
+            # stats are only updated periodically, make sure download_total
+            # is correct for the content-length
+            self.update_stats()
             eventloop.add_idle(self.header_callback,
                     'httpclient header callback',
                     args=(self._make_callback_info(),))
@@ -675,7 +731,15 @@ class CurlTransfer(object):
     def on_finished(self):
         info = self._make_callback_info()
         self.last_url = self.handle.getinfo(pycurl.EFFECTIVE_URL)
-        if self.options.write_file is None:
+        if self.options.body_file_threshold is not None:
+            info['body-hash'] = unicode(self.body_hash.hexdigest())
+        if self.body_file is not None:
+            # The caller is responsible for deleting the file.  Content
+            # encoding is left alone, since we can't decode the file here
+            # without reading it all into memory.
+            self._cleanup_filehandle()
+            info['body-file'] = self.body_file
+        elif self.options.write_file is None:
             if gzip and info.get('content-encoding', '') == 'gzip':
                 try:
                     self.buffer.seek(0)
@@ -728,6 +792,7 @@ class CurlTransfer(object):
 
     def on_cancel(self, remove_file):
         self._cleanup_filehandle()
+        self._cleanup_body_file()
         if remove_file and self.options.write_file:
             try:
                 fileutil.remove(self.options.write_file)
@@ -807,11 +872,14 @@ class CurlTransfer(object):
 
     def call_callback(self, info):
         self._cleanup_filehandle()
+        # the callback owns the body file now
+        self.body_file = None
         msg = 'curl transfer callback: %s' % (self.callback,)
         eventloop.add_idle(self.callback, msg, args=(info,))
 
     def call_errback(self, error):
         self._cleanup_filehandle()
+        self._cleanup_body_file()
         msg = 'curl transfer errback: %s' % (self.errback,)
         eventloop.add_idle(self.errback, msg, args=(error,))
 
@@ -872,6 +940,176 @@ class TransferStats(object):
         self.initial_size = 0
         self.status_code = None
 
+def _make_curl_share():
+    """Make a CurlShare to share DNS and SSL session data between our
+    handles.
+
+    We don't share cookies.  Transfers that need them load them from the
+    cookies file themselves (see TransferOptions.requires_cookies), and
+    sharing them would leak cookies from one transfer to all the others.
+
+    :returns: CurlShare object or None if pycurl doesn't support it
+    """
+    try:
+        share = pycurl.CurlShare()
+    except AttributeError:
+        return None
+    for name in ('LOCK_DATA_DNS', 'LOCK_DATA_SSL_SESSION'):
+        # older pycurl/libcurl versions don't support all of these
+        lock_data = getattr(pycurl, name, None)
+        if lock_data is None:
+            continue
+        try:
+            share.setopt(pycurl.SH_SHARE, lock_data)
+        except pycurl.error, e:
+            logging.warn("Error setting up CurlShare (%s): %s", name, e)
+    return share
+
+class CurlHandlePool(object):
+    """Reuses libcurl easy handles between transfers.
+
+    Handles get reset before they go back to the pool, so all options are
+    cleared out.  The only thing that we keep is the CurlShare object,
+    which keeps the DNS cache and SSL sessions around for the next transfer.
+
+    This class should only be used inside the LibCURLManager thread.
+    """
+    # max number of unused handles to keep around
+    MAX_IDLE_HANDLES = 20
+
+    def __init__(self):
+        self.share = _make_curl_share()
+        self.idle_handles = []
+        self.handles_created = 0
+        self.handles_reused = 0
+
+    def get(self):
+        """Get a clean handle to use for a transfer."""
+        if self.idle_handles:
+            handle = self.idle_handles.pop()
+            self.handles_reused += 1
+        else:
+            handle = pycurl.Curl()
+            self.handles_created += 1
+            # reset() doesn't detach the share, so only set it up for new
+            # handles.  pycurl raises an error if we set it twice.
+            if self.share is not None:
+                handle.setopt(pycurl.SHARE, self.share)
+        return handle
+
+    def release(self, handle):
+        """Put a handle back into the pool once a transfer is done with it.
+        """
+        if len(self.idle_handles) < self.MAX_IDLE_HANDLES:
+            # reset() also drops the references to our callback functions,
+            # which lets the CurlTransfer get garbage collected.
+            handle.reset()
+            self.idle_handles.append(handle)
+        else:
+            handle.close()
+
+    def close(self):
+        for handle in self.idle_handles:
+            handle.close()
+        self.idle_handles = []
+        if self.share is not None:
+            self.share.close()
+            self.share = None
+
+class EPollSocketPoller(object):
+    """Waits for events on a set of sockets using epoll.
+
+    The cost of a poll() call only depends on the number of sockets that
+    are ready, not on the number of sockets that we are watching.
+    """
+    def __init__(self):
+        self.epoll = select.epoll()
+        self.registered = {}
+
+    def set_events(self, fd, read, write):
+        """Start or stop watching fd for read/write events.
+
+        If both read and write are False, fd gets unregistered.
+        """
+        mask = 0
+        if read:
+            mask |= select.EPOLLIN
+        if write:
+            mask |= select.EPOLLOUT
+        old_mask = self.registered.get(fd)
+        if mask == 0:
+            if old_mask is not None:
+                del self.registered[fd]
+                try:
+                    self.epoll.unregister(fd)
+                except (IOError, OSError):
+                    # libcurl may have already closed the socket
+                    pass
+        elif old_mask is None:
+            self.registered[fd] = mask
+            self.epoll.register(fd, mask)
+        elif old_mask != mask:
+            self.registered[fd] = mask
+            self.epoll.modify(fd, mask)
+
+    def poll(self, timeout):
+        """Wait for socket events.
+
+        :param timeout: max time to wait in seconds, or None to wait forever
+        :returns: list of (fd, readable, writable, error) tuples
+        """
+        if timeout is None:
+            timeout = -1
+        rv = []
+        for fd, mask in self.epoll.poll(timeout):
+            rv.append((fd, bool(mask & select.EPOLLIN),
+                       bool(mask & select.EPOLLOUT),
+                       bool(mask & (select.EPOLLERR | select.EPOLLHUP))))
+        return rv
+
+    def close(self):
+        self.epoll.close()
+        self.registered = {}
+
+class SelectSocketPoller(object):
+    """Fallback for platforms without epoll.
+
+    This has the same interface as EPollSocketPoller, but uses select().
+    """
+    def __init__(self):
+        self.read_fds = set()
+        self.write_fds = set()
+
+    def set_events(self, fd, read, write):
+        if read:
+            self.read_fds.add(fd)
+        else:
+            self.read_fds.discard(fd)
+        if write:
+            self.write_fds.add(fd)
+        else:
+            self.write_fds.discard(fd)
+
+    def poll(self, timeout):
+        all_fds = list(self.read_fds | self.write_fds)
+        read_ready, write_ready, exc_ready = select.select(
+            list(self.read_fds), list(self.write_fds), all_fds, timeout)
+        ready = {}
+        for index, fds in enumerate((read_ready, write_ready, exc_ready)):
+            for fd in fds:
+                ready.setdefault(fd, [False, False, False])[index] = True
+        return [(fd, r, w, e) for fd, (r, w, e) in ready.items()]
+
+    def close(self):
+        self.read_fds = set()
+        self.write_fds = set()
+
+def make_socket_poller():
+    if hasattr(select, 'epoll'):
+        return EPollSocketPoller()
+    else:
+        return SelectSocketPoller()
+
 class LibCURLManager(eventloop.SimpleEventLoop):
     """Manage a set of CurlTransfers.
 
@@ -880,15 +1118,55 @@ class LibCURLManager(eventloop.SimpleEventLoop):
       - Runs a thread for pycurl to use
       - Manages the libcurl multi object
       - Handles adding/removing CurlTransfers objects
+      - Reuses libcurl handles and connections between transfers
+
+    We use libcurl's socket interface: libcurl tells us which sockets to
+    watch and when its timer should fire, and we call socket_action() for
+    each socket that is ready.  This means the work we do each loop depends
+    on how many sockets have activity, rather than on how many transfers we
+    have.
     """
+    # Max number of connections to a single host.  Transfers past this wait
+    # for a connection to become free.
+    MAX_HOST_CONNECTIONS = 6
+    # Max number of idle connections to keep open for reuse
+    MAX_CACHED_CONNECTIONS = 30
+    # How often to update the TransferStats for our transfers (seconds)
+    STATS_INTERVAL = 0.5
+    # Max time to wait when libcurl doesn't have a timer set (seconds)
+    MAX_TIMEOUT = 2.0
 
     def __init__(self):
         eventloop.SimpleEventLoop.__init__(self)
+        self.poller = make_socket_poller()
+        self.poller.set_events(self.wake_receiver.fileno(), True, False)
+        self.timer_deadline = None
+        self.next_stats_update = 0
         self.multi = pycurl.CurlMulti()
+        self.multi.setopt(pycurl.M_SOCKETFUNCTION, self.on_socket_change)
+        self.multi.setopt(pycurl.M_TIMERFUNCTION, self.on_timer_change)
+        self._setup_multi()
+        self.handle_pool = CurlHandlePool()
         self.transfer_map = {}
         self.transfers_to_add = Queue.Queue()
         self.transfers_to_remove = Queue.Queue()
         self.after_perform_callbacks = []
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def _setup_multi(self):
+        # older pycurl/libcurl versions don't support all of these options
+        for name, value in (
+                ('M_MAX_HOST_CONNECTIONS', self.MAX_HOST_CONNECTIONS),
+                ('M_MAXCONNECTS', self.MAX_CACHED_CONNECTIONS),
+                ('M_PIPELINING', getattr(pycurl, 'PIPE_MULTIPLEX', None))):
+            option = getattr(pycurl, name, None)
+            if option is None or value is None:
+                continue
+            try:
+                self.multi.setopt(option, value)
+            except pycurl.error, e:
+                logging.warn("Error setting %s: %s", name, e)
 
     def start(self):
         self.thread = threading.Thread(target=utils.thread_body,
@@ -902,11 +1180,34 @@ class LibCURLManager(eventloop.SimpleEventLoop):
         self.thread.join()
 
     def loop(self):
-        eventloop.SimpleEventLoop.loop(self)
+        self.loop_ready.set()
+        self.emit('thread-will-start')
+        self.emit('thread-started', threading.currentThread())
+        self.emit('thread-did-start')
+
+        while not self.quit_flag:
+            self.emit('begin-loop')
+            try:
+                events = self.poller.poll(self.calc_timeout())
+            except (select.error, IOError, OSError), e:
+                if e.args[0] == errno.EINTR:
+                    logging.warning("httpclient: %s", e)
+                    events = []
+                else:
+                    self.emit('end-loop')
+                    raise
+            if self.quit_flag:
+                self.emit('end-loop')
+                break
+            self.process_events(events)
+            self.emit('end-loop')
+
         for transfer in self.transfer_map.values():
             self.multi.remove_handle(transfer.handle)
             transfer.handle.close()
+        self.handle_pool.close()
         self.multi.close()
+        self.poller.close()
 
     def add_transfer(self, transfer):
         self.transfers_to_add.put(transfer)
@@ -919,34 +1220,89 @@ class LibCURLManager(eventloop.SimpleEventLoop):
     def call_after_perform(self, callback):
         self.after_perform_callbacks.append(callback)
 
-    def calc_fds(self):
-        return self.multi.fdset()
+    def get_stats(self):
+        """Get stats on how well we're reusing handles and connections.
+
+        :returns: dict with the keys handles_created, handles_reused,
+        new_connections and reused_connections
+        """
+        return {
+            'handles_created': self.handle_pool.handles_created,
+            'handles_reused': self.handle_pool.handles_reused,
+            'new_connections': self.new_connections,
+            'reused_connections': self.reused_connections,
+        }
 
-    def calc_timeout(self):
-        timeout = self.multi.timeout()
-        if timeout < 0:
-            # libcurl documentation says this means to wait "not too long"
-            # Let's try 2 seconds
-            return 2.0
+    def on_socket_change(self, what, fd, multi, data):
+        """Called by libcurl when it wants us to change how we watch a
+        socket.
+        """
+        if what == pycurl.POLL_REMOVE:
+            self.poller.set_events(fd, False, False)
         else:
-            return timeout / 1000.0
+            self.poller.set_events(fd,
+                                   what in (pycurl.POLL_IN, pycurl.POLL_INOUT),
+                                   what in (pycurl.POLL_OUT, pycurl.POLL_INOUT))
 
-    def process_events(self, readfds, writefds, excfds):
+    def on_timer_change(self, timeout_ms):
+        """Called by libcurl when it wants us to change its timer.
+
+        A negative timeout means to delete the timer.
+        """
+        if timeout_ms < 0:
+            self.timer_deadline = None
+        else:
+            self.timer_deadline = clock() + timeout_ms / 1000.0
+
+    def calc_timeout(self):
+        now = clock()
+        if self.timer_deadline is not None:
+            timeout = self.timer_deadline - now
+        else:
+            # libcurl documentation says no timer means to wait "not too
+            # long"
+            timeout = self.MAX_TIMEOUT
+        if self.transfer_map:
+            timeout = min(timeout, self.next_stats_update - now)
+        return max(timeout, 0)
+
+    def process_events(self, events):
         self.process_queues()
-        while True:
-            rv, num_handles = self.multi.perform()
+        wake_fd = self.wake_receiver.fileno()
+        for fd, readable, writable, error in events:
+            if fd == wake_fd:
+                self._slurp_waker_data()
+                continue
+            mask = 0
+            if readable:
+                mask |= pycurl.CSELECT_IN
+            if writable:
+                mask |= pycurl.CSELECT_OUT
+            if error:
+                mask |= pycurl.CSELECT_ERR
+            self.socket_action(fd, mask)
+        if (self.timer_deadline is not None and
+                self.timer_deadline <= clock()):
+            self.timer_deadline = None
+            self.socket_action(pycurl.SOCKET_TIMEOUT, 0)
+        self.process_queues()
+        self.check_finished()
+        if self.next_stats_update <= clock():
             self.update_stats()
+
+    def socket_action(self, fd, mask):
+        while True:
+            rv, num_handles = self.multi.socket_action(fd, mask)
             for callback in self.after_perform_callbacks:
                 trap_call('after perform callback', callback)
             self.after_perform_callbacks = []
             if rv != pycurl.E_CALL_MULTI_PERFORM:
                 break
-        self.process_queues()
-        self.check_finished()
 
     def update_stats(self):
         for transfer in self.transfer_map.values():
             transfer.update_stats()
+        self.next_stats_update = clock() + self.STATS_INTERVAL
 
     def process_queues(self):
         while True:
@@ -954,9 +1310,11 @@ class LibCURLManager(eventloop.SimpleEventLoop):
                 transfer = self.transfers_to_add.get_nowait()
             except Queue.Empty:
                 break
+            handle = self.handle_pool.get()
             try:
-                transfer.build_handle()
+                transfer.build_handle(handle)
             except NetworkError, e:
+                self.handle_pool.release(handle)
                 transfer.call_errback(e)
                 continue
             self.transfer_map[transfer.handle] = transfer
@@ -973,19 +1331,42 @@ class LibCURLManager(eventloop.SimpleEventLoop):
             except KeyError:
                 continue
             self.multi.remove_handle(transfer.handle)
+            self.handle_pool.release(transfer.handle)
 
     def check_finished(self):
         queued, finished, errors = self.multi.info_read()
+        # Always give the handle back to the pool, even if the callback
+        # fails.  The transfer is done with it either way.
         for handle in finished:
+            transfer = self.pop_transfer(handle)
             try:
-                self.pop_transfer(handle).on_finished()
+                # stats are only updated periodically, make sure the final
+                # values are correct
+                transfer.update_stats()
+                self.update_connection_stats(handle)
+                transfer.on_finished()
             except StandardError:
                 logging.warning("Error calling on_finished()", exc_info=True)
+            finally:
+                self.handle_pool.release(handle)
         for handle, code, message in errors:
+            transfer = self.pop_transfer(handle)
             try:
-                self.pop_transfer(handle).on_error(code, handle)
+                transfer.on_error(code, handle)
             except StandardError:
                 logging.warning("Error calling on_error()", exc_info=True)
+            finally:
+                self.handle_pool.release(handle)
+
+    def update_connection_stats(self, handle):
+        # NUM_CONNECTS is the number of new connections that the transfer
+        # needed.  0 means that it reused a connection from an earlier
+        # transfer.
+        new_connections = handle.getinfo(pycurl.NUM_CONNECTS)
+        if new_connections == 0:
+            self.reused_connections += 1
+        else:
+            self.new_connections += new_connections
 
     def pop_transfer(self, handle):
         transfer = self.transfer_map.pop(handle)
@@ -1024,7 +1405,7 @@ def sanitize_url(url):
 def grab_url(url, callback, errback, header_callback=None,
         content_check_callback=None, write_file=None, etag=None, modified=None,
         default_mime_type=None, resume=False, post_vars=None,
-        post_files=None, extra_headers=None):
+        post_files=None, extra_headers=None, body_file_threshold=None):
     """Quick way to download a network resource
 
     grab_url is a simple interface to the HTTPClient class.
@@ -1046,11 +1427,20 @@ def grab_url(url, callback, errback, header_callback=None,
     :param post_files: files to send as POST data (see
         xhtmltools.multipart_encode for the format)
     :param extra_headers: an option dictionary of extra headers to send
+    :param body_file_threshold: if set, bodies bigger than this many bytes
+        get written to a temporary file instead of kept in memory.  Also
+        computes a SHA-1 of the body as it's received.
 
     The callback will be passed a dictionary that contains all the HTTP
     headers, as well as the following keys:
         'status': HTTP response code
         'body': The request body (if write_file is not given)
+        'body-file': Path to a temporary file with the request body, if
+            body_file_threshold was exceeded.  The callback must delete it.
+            In this case 'body' isn't set and the content-encoding isn't
+            decoded.
+        'body-hash': SHA-1 hex digest of the body, as we received it (if
+            body_file_threshold is given)
         'content-length': Length of the downloads as an int
         'total-size': Total size of the download (this is different from
             content-length because it includes the data we are resuming from)
@@ -1069,7 +1459,7 @@ def grab_url(url, callback, errback, header_callback=None,
         return _grab_file_url(url, callback, errback, default_mime_type)
     else:
         options = TransferOptions(url, etag, modified, resume, post_vars,
-                post_files, write_file, extra_headers)
+                post_files, write_file, extra_headers, body_file_threshold)
         transfer = CurlTransfer(options, callback, errback, header_callback,
                 content_check_callback)
         transfer.start()
@@ -1135,6 +1525,16 @@ def register_on_start(fun):
 # FIXME - this is a singleton global and the name should be all-caps
 curl_manager = None
 
+def get_connection_stats():
+    """Get stats on how well we're reusing handles and connections.
+
+    See LibCURLManager.get_stats() for the format.  Returns None if the
+    LibCURLManager thread isn't running.
+    """
+    if curl_manager is None:
+        return None
+    return curl_manager.get_stats()
+
 def start_thread():
     global curl_manager
     curl_manager = LibCURLManager()
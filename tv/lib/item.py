@@ -31,6 +31,7 @@
 """
 
 import collections
+import hashlib
 from datetime import datetime, timedelta
 import locale
 import os.path
@@ -121,11 +122,36 @@ class FeedParserValues(object):
             'release_date': self._calc_release_date(),
         }
 
+    def strip_entry(self):
+        """Drop the feedparser entry to make us smaller to send between
+        processes.
+
+        After this, we only have data and the URL from
+        first_video_enclosure.  That's enough to create and update items.
+        """
+        self.entry = None
+        if self.first_video_enclosure is not None:
+            enclosure = self.first_video_enclosure
+            self.first_video_enclosure = {}
+            if 'url' in enclosure:
+                self.first_video_enclosure['url'] = enclosure['url']
+
     def update_item(self, item):
         for key, value in self.data.items():
             setattr(item, key, value)
+        item.feedparser_hash = self.calc_hash()
         item.calc_title()
 
+    def calc_hash(self):
+        """Calculate a hash of our data.
+
+        Items store this in their feedparser_hash attribute.  If the hash for
+        an entry matches an item's hash, then compare_to_item() would return
+        True and we don't need to load the item to check.
+        """
+        return unicode(hashlib.sha1(repr(sorted(self.data.items()))
+                                    ).hexdigest())
+
     def compare_to_item(self, item):
         for key, value in self.data.items():
             if getattr(item, key) != value:
@@ -381,6 +407,55 @@ class _ItemsForPathCountTracker(object):
         except AttributeError:
             return # counts not created yet we can just ignore
 
+class _FeedEntryIndexTracker(object):
+    """Keeps the FeedEntryIndex objects for feeds up to date.
+
+    Feeds build their index from the item table the first time they update
+    (see RSSFeedImplBase.make_entry_index()).  After that, Item calls us
+    when items are added, removed, or change one of the indexed columns, so
+    the index never needs to be rebuilt.
+    """
+    # attributes that affect the index
+    ATTRIBUTES = frozenset(['feed_id', 'rss_id', 'url', 'entry_title',
+                            'enclosure_size', 'enclosure_type',
+                            'enclosure_format', 'feedparser_hash'])
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # maps feed ids to their FeedEntryIndex
+        self.indexes = {}
+        # maps item ids to the feed id of the index they're in
+        self.item_feeds = {}
+
+    def get_index(self, feed_id):
+        return self.indexes.get(feed_id)
+
+    def set_index(self, feed_id, index):
+        self.remove_index(feed_id)
+        self.indexes[feed_id] = index
+        for item_id in index.hashes:
+            self.item_feeds[item_id] = feed_id
+
+    def remove_index(self, feed_id):
+        index = self.indexes.pop(feed_id, None)
+        if index is not None:
+            for item_id in index.hashes:
+                del self.item_feeds[item_id]
+
+    def item_changed(self, item):
+        self.item_removed(item)
+        index = self.indexes.get(item.feed_id)
+        if index is not None:
+            index.add_item(item)
+            self.item_feeds[item.id] = item.feed_id
+
+    def item_removed(self, item):
+        feed_id = self.item_feeds.pop(item.id, None)
+        if feed_id is not None:
+            self.indexes[feed_id].remove_item(item.id)
+
 class ItemChangeTracker(signals.SignalEmitter):
     """Tracks changes to items and send the ItemChanges message."""
     def __init__(self):
@@ -404,6 +479,10 @@ class ItemChangeTracker(signals.SignalEmitter):
 
     def send_changes(self):
         if self.has_changes():
+            # The frontend reads items from the database, so our changes
+            # need to be committed before we tell it about them.  In group
+            # commit mode they might not be yet.
+            app.db.finish_transaction()
             m = messages.ItemChanges(self.added, self.changed, self.removed,
                                      self.changed_columns,
                                      self.dlstats_changed,
@@ -553,10 +632,17 @@ class Item(MetadataItemBase, iconcache.IconCacheOwnerMixin):
         self.playing = False
         Item._path_count_tracker.add_item(self)
 
+    def after_setup_new(self):
+        MetadataItemBase.after_setup_new(self)
+        Item.entry_index_tracker.item_changed(self)
+
     def signal_change(self, needs_save=True, can_change_views=True):
         if ('torrent_title' in self.changed_attributes or
             'metadata_title' in self.changed_attributes):
             self.calc_title()
+        if not self.changed_attributes.isdisjoint(
+                _FeedEntryIndexTracker.ATTRIBUTES):
+            Item.entry_index_tracker.item_changed(self)
         ItemBase.signal_change(self, needs_save, can_change_views)
 
     def playlists_changed(self, added=False):
@@ -939,6 +1025,7 @@ class Item(MetadataItemBase, iconcache.IconCacheOwnerMixin):
         return cls.make_view("downloader_id=?", (dler_id,))
 
     _path_count_tracker = _ItemsForPathCountTracker()
+    entry_index_tracker = _FeedEntryIndexTracker()
 
     @classmethod
     def have_item_for_path(cls, path):
@@ -1520,6 +1607,7 @@ class Item(MetadataItemBase, iconcache.IconCacheOwnerMixin):
     def remove_rss_id(self):
         self.confirm_db_thread()
         self.rss_id = None
+        self.feedparser_hash = None
         self.signal_change()
 
     def set_auto_downloaded(self, autodl=True):
@@ -2087,6 +2175,7 @@ class Item(MetadataItemBase, iconcache.IconCacheOwnerMixin):
 
     def remove(self):
         Item._path_count_tracker.remove_item(self)
+        Item.entry_index_tracker.item_removed(self)
         if self.has_downloader():
             self.set_downloader(None)
         self.remove_icon_cache()
@@ -2335,6 +2424,8 @@ class FileItem(Item):
         self.make_undeleted()
 
     def set_release_date(self):
+        # our data no longer matches the FeedParserValues that set it
+        self.feedparser_hash = None
         try:
             self.release_date = datetime.fromtimestamp(
                 fileutil.getmtime(self.filename))
@@ -55,6 +55,7 @@ from miro import singleclick
 from miro import subscription
 from miro import tabs
 from miro import opml
+from miro import workerprocess
 from miro.data.item import fetch_item_infos
 from miro.widgetstate import DisplayState, ViewState, GlobalState
 from miro.feed import Feed, lookup_feed
@@ -1619,6 +1620,26 @@ New ids: %s""", playlist_item_ids, message.item_ids)
                 f.actualFeed.signal_change()
                 f.update()
 
+    def handle_log_database_cache_stats(self, message):
+        for category, stats in sorted(app.db.cache.get_stats().items()):
+            logging.info("object cache %s: %s", category, stats)
+        logging.info("statement cache: %s",
+                     app.db.get_statement_cache_stats())
+        logging.info("object map: %s", app.db.get_object_map_stats())
+        logging.info("commits: %s", app.db.get_commit_stats())
+
+    def handle_log_worker_task_stats(self, message):
+        for name, stats in sorted(workerprocess.get_task_stats().items()):
+            logging.info("worker tasks %s: %s", name, stats)
+
+    def handle_query_event_loop_stats(self, message):
+        m = messages.CurrentEventLoopStats(
+            eventloop.get_callback_stats(limit=message.limit),
+            eventloop.get_queue_stats())
+        if message.reset:
+            eventloop.reset_stats()
+        m.send_to_frontend()
+
     def handle_force_dbsave_error(self, message):
         app.db.simulate_db_save_error()
 
@@ -1645,6 +1666,19 @@ New ids: %s""", playlist_item_ids, message.item_ids)
         app.local_metadata_manager.set_net_lookup_enabled(paths,
                                                           message.enabled)
 
+    def handle_prioritize_metadata(self, message):
+        paths = set()
+        for item_id in message.item_ids:
+            try:
+                i = item.Item.get_by_id(item_id)
+            except database.ObjectNotFoundError:
+                logging.warn("handle_prioritize_metadata: id not found: %s",
+                             item_id)
+            else:
+                paths.add(i.get_filename())
+        paths.discard(None)
+        app.local_metadata_manager.prioritize_paths(paths)
+
     def handle_remove_echonest_data(self, message):
         paths = set()
         for item_id in message.item_ids:
@@ -868,6 +868,15 @@ class SetNetLookupEnabled(BackendMessage):
         self.item_ids = item_ids
         self.enabled = enabled
 
+class PrioritizeMetadata(BackendMessage):
+    """Extract metadata for a set of items before other items.
+
+    The frontend sends this when the user is looking at items that don't
+    have their metadata yet.
+    """
+    def __init__(self, item_ids):
+        self.item_ids = item_ids
+
 class ClogBackend(BackendMessage):
     """Dev message: intentionally clog the backend for a specified number of 
     seconds.
@@ -880,6 +889,24 @@ class ForceFeedparserProcessing(BackendMessage):
     """
     pass
 
+class LogDatabaseCacheStats(BackendMessage):
+    """Dev message: log cache and commit stats for the main database."""
+    pass
+
+class LogWorkerTaskStats(BackendMessage):
+    """Dev message: log queue-depth stats for the worker process tasks."""
+    pass
+
+class QueryEventLoopStats(BackendMessage):
+    """Ask the backend to send a CurrentEventLoopStats message.
+
+    :param limit: max number of callbacks to include
+    :param reset: reset the stats after sending them
+    """
+    def __init__(self, limit=50, reset=False):
+        self.limit = limit
+        self.reset = reset
+
 class ForceDBSaveError(BackendMessage):
     """Simulate an error running an INSERT/UPDATE statement on the main DB.
     """
@@ -926,6 +953,17 @@ class ShowWarning(FrontendMessage):
         self.title = title
         self.description = description
 
+class CurrentEventLoopStats(FrontendMessage):
+    """Sends the backend event loop timing stats to the frontend.
+
+    :param callback_stats: list of eventloop.CallbackStats tuples, slowest
+    first
+    :param queue_stats: dict mapping queue names to wait time histograms
+    """
+    def __init__(self, callback_stats, queue_stats):
+        self.callback_stats = callback_stats
+        self.queue_stats = queue_stats
+
 class FrontendQuit(FrontendMessage):
     """The frontend should exit."""
     pass
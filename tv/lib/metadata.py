@@ -191,11 +191,23 @@ class MetadataStatus(database.DDBObject):
             return
         self.db_info.db.cache.set('metadata', self.path, self)
 
+    def _remove_from_cache(self):
+        # The cache has a limited size, so we may have already been evicted.
+        # Also, make sure not to remove a different object with our path
+        # (see _add_to_cache()).
+        cache = self.db_info.db.cache
+        try:
+            cache_value = cache.get('metadata', self.path)
+        except KeyError:
+            return
+        if cache_value is self:
+            cache.remove('metadata', self.path)
+
     def insert_into_db_failed(self):
-        self.db_info.db.cache.remove('metadata', self.path)
+        self._remove_from_cache()
 
     def remove(self):
-        self.db_info.db.cache.remove('metadata', self.path)
+        self._remove_from_cache()
         database.DDBObject.remove(self)
 
     def get_has_drm(self):
@@ -324,9 +336,9 @@ class MetadataStatus(database.DDBObject):
 
     def rename(self, new_path):
         """Change the path for this object."""
-        self.db_info.db.cache.remove('metadata', self.path)
-        self.db_info.db.cache.set('metadata', new_path, self)
+        self._remove_from_cache()
         self.path = new_path
+        self.db_info.db.cache.set('metadata', new_path, self)
         self.signal_change()
 
     @classmethod
@@ -469,6 +481,13 @@ class _MetadataProcessor(signals.SignalEmitter):
         """
         pass
 
+    def prioritize_paths(self, paths):
+        """Process tasks for paths before other tasks.
+
+        This is a hint that the user is waiting for the metadata for paths.
+        """
+        pass
+
 class _TaskProcessor(_MetadataProcessor):
     """Handle sending tasks to the worker process.  """
 
@@ -510,6 +529,18 @@ class _TaskProcessor(_MetadataProcessor):
             path, task = self._pending_tasks.popitem()
             self._send_task(task)
 
+    def prioritize_paths(self, paths):
+        # Send pending tasks for paths to the worker process now, even if
+        # that goes over our limit.  The worker queue will bump them in front
+        # of the other tasks.
+        for path in paths:
+            try:
+                task = self._pending_tasks.pop(path)
+            except KeyError:
+                pass
+            else:
+                self._send_task(task)
+
     def _callback(self, task, result):
         if task.source_path not in self._active_tasks:
             logging.debug("%s done but already removed: %r", self.source_name,
@@ -1103,6 +1134,8 @@ class MetadataManagerBase(signals.SignalEmitter):
     RETRY_TEMPORARY_INTERVAL = 3600
     # how often to re-try net lookups that have failed
     NET_LOOKUP_RETRY_INTERVAL = 60 * 60 * 24 * 7 # 1 week
+    # how many MetadataStatus objects to keep in the DatabaseObjectCache
+    STATUS_CACHE_SIZE = 5000
 
     def __init__(self, cover_art_dir, screenshot_dir, db_info=None):
         signals.SignalEmitter.__init__(self)
@@ -1147,7 +1180,9 @@ class MetadataManagerBase(signals.SignalEmitter):
         self._retry_net_lookup_caller = \
                 eventloop.DelayedFunctionCaller(self.retry_net_lookup)
         self._retry_net_lookup_entries = {}
-        self._setup_path_placeholders()
+        self.db_info.db.cache.set_capacity('metadata',
+                                           self.STATUS_CACHE_SIZE)
+        self._setup_paths_in_system()
         self._setup_net_lookup_count()
         # send initial NetLookupCounts message
         self._send_net_lookup_counts()
@@ -1180,16 +1215,16 @@ class MetadataManagerBase(signals.SignalEmitter):
                         logging.warn("MetadataManager: error creating: %s" 
                                      "(%s)", path, e)
 
-    def _setup_path_placeholders(self):
-        """Add None values to the cache for all MetadataStatus objects
+    def _setup_paths_in_system(self):
+        """Set up paths_in_system
 
-        This makes path_in_system() work since it checks if the key exists.
-        However, we don't actually want to load the objects yet, since this is
-        called pretty early in the startup process.
+        paths_in_system is the set of all paths that have a MetadataStatus
+        object.  We track it separately from the DatabaseObjectCache, since
+        that can evict objects.  We don't want to load the objects yet, since
+        this is called pretty early in the startup process.
         """
         rows = MetadataStatus.select(["path"], db_info=self.db_info)
-        for row in rows:
-            self.db_info.db.cache.set('metadata', row[0], None)
+        self.paths_in_system = set(row[0] for row in rows)
         # also set up total_count here, since it's convenient.  total_count
         # tracks the total number of paths in the system
         self.total_count = len(rows)
@@ -1261,6 +1296,7 @@ class MetadataManagerBase(signals.SignalEmitter):
 
         status = MetadataStatus(path, self.net_lookup_enabled_default(),
                                 db_info=self.db_info)
+        self.paths_in_system.add(path)
         if status.net_lookup_enabled:
             self.net_lookup_count += 1
         self.total_count += 1
@@ -1287,7 +1323,7 @@ class MetadataManagerBase(signals.SignalEmitter):
 
     def path_in_system(self, path):
         """Test if a path is in the metadata system."""
-        return self.db_info.db.cache.key_exists('metadata', path)
+        return path in self.paths_in_system
 
     def worker_task_count(self):
         return (self.mutagen_processor.task_count() +
@@ -1300,6 +1336,17 @@ class MetadataManagerBase(signals.SignalEmitter):
         for processor in self.metadata_processors:
             processor.remove_tasks_for_paths(paths)
 
+    def prioritize_paths(self, paths):
+        """Process metadata for paths before other files.
+
+        Call this when the user is waiting for the metadata for paths, for
+        example when their items are visible.
+        """
+        paths = [self._translate_path(p) for p in paths]
+        for processor in self.metadata_processors:
+            processor.prioritize_paths(paths)
+        workerprocess.bump_tasks_for_files(paths)
+
     def remove_file(self, path):
         """Remove a file from the metadata system.
 
@@ -1354,6 +1401,7 @@ class MetadataManagerBase(signals.SignalEmitter):
                     self.remove_screenshot(entry.screenshot)
                 entry.remove()
             status.remove()
+            self.paths_in_system.discard(path)
             if status.current_processor is not None:
                 self.count_tracker.file_finished(path)
         self._run_update_caller.call_after_timeout(self.UPDATE_INTERVAL)
@@ -1388,7 +1436,7 @@ class MetadataManagerBase(signals.SignalEmitter):
         except KeyError:
             logging.warn("_process_files_moved: %s not in DB", old_path)
             return
-        if self.db_info.db.cache.key_exists('metadata', new_path):
+        if self.path_in_system(new_path):
             # There's already an entry for the new status.  What to do
             # here?  Let's use the new one
             logging.warn("_process_files_moved: already an object for "
@@ -1398,6 +1446,8 @@ class MetadataManagerBase(signals.SignalEmitter):
             return
 
         status.rename(new_path)
+        self.paths_in_system.discard(old_path)
+        self.paths_in_system.add(new_path)
         if status.mutagen_status == MetadataStatus.STATUS_NOT_RUN:
             self._run_mutagen(new_path)
         elif status.moviedata_status == MetadataStatus.STATUS_NOT_RUN:
@@ -29,6 +29,7 @@
 
 import os
 import logging
+import time
 
 from xml.dom import minidom
 from xml.sax import saxutils
@@ -43,6 +44,7 @@ from miro import app
 from miro import folder
 from miro import dialogs
 from miro import eventloop
+from miro import messages
 from miro import tabs
 
 from miro.gtcache import gettext as _
@@ -187,6 +189,8 @@ class Importer(object):
         self.current_folder = None
         self.ignored_feeds = 0
         self.imported_feeds = 0
+        self.show_progress = False
+        self.last_progress_time = 0
 
     @eventloop.as_idle
     def import_subscriptions(self, pathname, show_summary=True):
@@ -201,12 +205,34 @@ class Importer(object):
 
         try:
             subscriptions = self.import_content(content)
-            self.result = subscription.Subscriber().add_subscriptions(
-                subscriptions)
-            if show_summary:
-                self.show_import_summary()
         except expat.ExpatError:
             self.show_xml_error()
+            return
+        # show_summary is False when we import feeds at startup, before
+        # the UI is ready for a progress dialog.
+        self.show_progress = show_summary
+        if self.show_progress:
+            messages.ProgressDialogStart(
+                _("Importing Podcasts")).send_to_frontend()
+        try:
+            subscriber = subscription.BulkSubscriber(self.report_progress)
+            self.result = subscriber.add_subscriptions(subscriptions)
+        finally:
+            if self.show_progress:
+                messages.ProgressDialogFinished().send_to_frontend()
+        if show_summary:
+            self.show_import_summary()
+
+    def report_progress(self, feeds_handled, feed_count):
+        current_time = time.time()
+        if (not self.show_progress or
+                current_time < self.last_progress_time + 0.5):
+            return
+        text = _("Importing Podcasts (%(current)d/%(total)d)",
+                 {"current": feeds_handled, "total": feed_count})
+        progress = float(feeds_handled) / feed_count
+        messages.ProgressDialog(text, progress).send_to_frontend()
+        self.last_progress_time = current_time
 
     def import_content(self, content):
         dom = minidom.parseString(content)
@@ -136,6 +136,17 @@ REMEMBER_LAST_DISPLAY       = Pref(key='rememberLastDisplay', default=False, pla
 PODCASTS_DEFAULT_VIEW       = Pref(key='podcastsDefaultView', default=0, platformSpecific=False)
 # metadata
 LAST_RETRY_NET_LOOKUP       = Pref(key='lastRetryNetLookup', default=0, platformSpecific=False)
+# database
+LAZY_DATABASE_OBJECTS       = Pref(key='lazyDatabaseObjects', default=False, platformSpecific=False)
+# seconds to group database changes before committing.  0 commits after every
+# event.  Higher values mean fewer disk syncs, but more lost changes on a crash
+GROUP_COMMIT_DELAY          = Pref(key='groupCommitDelay', default=0, platformSpecific=False)
+GROUP_COMMIT_MAX_STATEMENTS = Pref(key='groupCommitMaxStatements', default=5000, platformSpecific=False)
+# number of worker processes to run.  0 means one per CPU core
+WORKER_PROCESS_COUNT        = Pref(key='workerProcessCount', default=0, platformSpecific=False)
+# feeds
+# max number of feeds that can update at the same time
+MAX_FEED_UPDATES            = Pref(key='maxFeedUpdates', default=3, platformSpecific=False)
 # This doesn't need to be defined on the platform, but it can be overridden there if the platform wants to.
 SHOW_ERROR_DIALOG           = Pref(key='showErrorDialog',       default=True,  platformSpecific=True)
 
@@ -455,6 +455,7 @@ class ItemSchema(MultiClassObjectSchema):
         ('enclosure_size', SchemaInt(noneOk=True)),
         ('enclosure_type', SchemaString(noneOk=True)),
         ('enclosure_format', SchemaString(noneOk=True)),
+        ('feedparser_hash', SchemaString(noneOk=True)),
         ('was_downloaded', SchemaBool()),
         ('filename', SchemaFilename(noneOk=True)),
         ('deleted', SchemaBool()),
@@ -627,6 +628,7 @@ class FeedSchema(DDBObjectSchema):
         ('expire_timedelta', SchemaTimeDelta(noneOk=True)),
         ('section', SchemaString()), # not used anymore
         ('visible', SchemaBool()),
+        ('change_rate', SchemaFloat()),
     ]
 
     indexes = (
@@ -653,6 +655,7 @@ class RSSFeedImplSchema(FeedImplSchema):
         ('initialHTML', SchemaBinary(noneOk=True)),
         ('etag', SchemaString(noneOk=True)),
         ('modified', SchemaString(noneOk=True)),
+        ('body_hash', SchemaString(noneOk=True)),
     ]
 
 class SavedSearchFeedImplSchema(FeedImplSchema):
@@ -998,7 +1001,7 @@ class MetadataEntrySchema(DDBObjectSchema):
         ('metadata_entry_status_and_source', ('status_id', 'source')),
     )
 
-VERSION = 201
+VERSION = 205
 
 object_schemas = [
     IconCacheSchema, ItemSchema, FeedSchema,
@@ -249,7 +249,10 @@ def startup_for_frontend(obj, thread):
     item.setup_deleted_checker()
     logging.info("Restoring database...")
     start = time.time()
-    app.db = storedatabase.LiveStorage()
+    app.db = storedatabase.LiveStorage(
+        lazy_objects=app.config.get(prefs.LAZY_DATABASE_OBJECTS))
+    app.db.set_group_commit(app.config.get(prefs.GROUP_COMMIT_DELAY),
+                            app.config.get(prefs.GROUP_COMMIT_MAX_STATEMENTS))
     try:
         app.db.upgrade_database()
     except databaseupgrade.DatabaseTooNewError:
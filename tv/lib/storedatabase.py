@@ -40,10 +40,10 @@ separate column.
 Most columns are stored using SQLite datatypes (``INTEGER``, ``REAL``,
 ``TEXT``, ``DATETIME``, etc.).  However some of our python values,
 don't have an equivalent (lists, dicts and timedelta objects).  For
-those, we store the python representation of the object.  This makes
-the column look similar to a JSON value, although not quite the same.
-The hope is that it will be human readable.  We use the type
-``pythonrepr`` to label these columns.
+containers, we store a JSON value with a couple of extensions (see
+containerjson).  The hope is that it will be human readable.  We use the
+type ``pythonrepr`` to label these columns, since older versions stored
+the python representation of the object.
 """
 
 import glob
@@ -56,6 +56,7 @@ import traceback
 import time
 import os
 import sys
+import weakref
 from cStringIO import StringIO
 
 try:
@@ -65,6 +66,7 @@ except ImportError:
 
 from miro import app
 from miro import crashreport
+from miro import containerjson
 from miro import convert20database
 from miro import databaseupgrade
 from miro import dbupgradeprogress
@@ -78,6 +80,7 @@ from miro import prefs
 from miro import util
 from miro.data import fulltextsearch
 from miro.data import item
+from miro.data import storagetuning
 from miro.gtcache import gettext as _
 from miro.plat.utils import PlatformFilenameType, filename_to_unicode
 
@@ -110,15 +113,138 @@ _sqlite_type_map = {
 
 VERSION_KEY = "Democracy Version"
 
+# How many SQL statements should we keep prepared?  This is used both for our
+# StatementCache and for the sqlite3 module's own prepared statement cache.
+STATEMENT_CACHE_SIZE = 250
+
+# In lazy mode, how many objects should we keep in memory after they stop
+# being used?
+OBJECT_MAP_SIZE = 5000
+
+# How long after opening the database should we wait before changing its page
+# size?
+PAGE_SIZE_CHANGE_DELAY = 300
+
+class StatementCache(util.Cache):
+    """Caches the SQL that LiveStorage uses to manipulate objects.
+
+    Statements are keyed by (object_schema, kind, columns) where kind is one
+    of "insert", "update", "delete", or "select".  For "update", columns is
+    the tuple of column names being set.  For "delete" and "select" it's the
+    number of ids that the statement takes.
+
+    All statements use placeholders for the object ids, so the same SQL text
+    gets sent to sqlite each time.  This means that the sqlite3 module can
+    reuse its prepared statement rather than re-compiling it.
+
+    The cache keeps track of hits and misses, which can be used to check how
+    well we are reusing statements.
+    """
+    def __init__(self, size=STATEMENT_CACHE_SIZE):
+        util.Cache.__init__(self, size)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, invalidator=None):
+        if key in self.dict:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return util.Cache.get(self, key, invalidator)
+
+    def create_new_value(self, key, invalidator=None):
+        obj_schema, kind, columns = key
+        table_name = obj_schema.table_name
+        if kind == 'insert':
+            return "INSERT INTO %s (%s) VALUES(%s)" % (table_name,
+                    ', '.join(name for name, schema_item in obj_schema.fields),
+                    ', '.join('?' for i in xrange(len(obj_schema.fields))))
+        elif kind == 'update':
+            return "UPDATE %s SET %s WHERE id=?" % (table_name,
+                    ', '.join('%s=?' % name for name in columns))
+        elif kind == 'delete':
+            return "DELETE FROM %s WHERE %s" % (table_name,
+                    self._id_where(columns))
+        elif kind == 'select':
+            column_names = ['%s.%s' % (table_name, f[0])
+                    for f in obj_schema.fields]
+            return "SELECT %s FROM %s WHERE %s" % (', '.join(column_names),
+                    table_name, self._id_where(columns))
+        else:
+            raise ValueError("Unknown statement kind: %s" % kind)
+
+    def _id_where(self, id_count):
+        if id_count == 1:
+            return 'id=?'
+        else:
+            return 'id IN (%s)' % ', '.join('?' for i in xrange(id_count))
+
+    def get_stats(self):
+        """Get statistics about how well the cache is working.
+
+        :returns: dict with the keys "hits", "misses", and "size"
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.dict),
+        }
+
+    def reset_stats(self):
+        self.hits = self.misses = 0
+
 class DatabaseObjectCache(object):
     """Handles caching objects for a database.
 
     This class implements a generic caching system for DDBObjects.  Other
     components can use it reduce the number of database queries they run.
+
+    By default, categories have no size limit and objects stay in the cache
+    until they are removed.  Use set_capacity() to limit the size of a
+    category.  Once a limited category goes over its capacity, we evict the
+    least recently used objects from it.  Since objects can be evicted, don't
+    use key_exists() to check if something exists in the database.
+
+    We also track hits, misses and evictions for each category.  Use
+    get_stats() to get them.
     """
+    # When a category goes over its capacity, evict objects until it's at
+    # this fraction of its capacity.  Evicting a bunch at once means we
+    # don't have to search for the least recently used object on every set()
+    SHRINK_RATIO = 0.75
+
     def __init__(self):
         # map (category, cache_key) to objects
         self._objects = {}
+        # map category to DatabaseObjectCacheCategory
+        self._categories = {}
+
+    def _get_category(self, category):
+        try:
+            return self._categories[category]
+        except KeyError:
+            self._categories[category] = DatabaseObjectCacheCategory()
+            return self._categories[category]
+
+    def set_capacity(self, category, capacity, weight_func=None):
+        """Limit the size of a category.
+
+        :param category: category to limit
+        :param capacity: max total weight of the objects in the category, or
+        None for no limit
+        :param weight_func: function that inputs an object and returns its
+        weight.  By default each object has a weight of 1, so capacity is
+        the max number of objects.
+        """
+        cat = self._get_category(category)
+        cat.capacity = capacity
+        cat.weight_func = weight_func
+        cat.total_weight = 0
+        for cache_key in cat.access_times:
+            obj = self._objects[(category, cache_key)]
+            cat.weights[cache_key] = weight = cat.calc_weight(obj)
+            cat.total_weight += weight
+        self._shrink_if_needed(category, cat)
 
     def set(self, category, cache_key, obj):
         """Add an object to the cache
@@ -131,7 +257,14 @@ class DatabaseObjectCache(object):
         :param key: key to retrieve the object with
         :param obj: object to add
         """
+        cat = self._get_category(category)
+        if cache_key in cat.access_times:
+            cat.total_weight -= cat.weights[cache_key]
         self._objects[(category, cache_key)] = obj
+        cat.access_times[cache_key] = cat.counter.next()
+        cat.weights[cache_key] = weight = cat.calc_weight(obj)
+        cat.total_weight += weight
+        self._shrink_if_needed(category, cat)
 
     def get(self, category, cache_key):
         """Get an object from the cache
@@ -141,7 +274,15 @@ class DatabaseObjectCache(object):
         :returns: object passed in with set
         :raises KeyError: object not in cache
         """
-        return self._objects[(category, cache_key)]
+        cat = self._get_category(category)
+        try:
+            obj = self._objects[(category, cache_key)]
+        except KeyError:
+            cat.misses += 1
+            raise
+        cat.hits += 1
+        cat.access_times[cache_key] = cat.counter.next()
+        return obj
 
     def key_exists(self, category, cache_key):
         """Test if an object is in the cache
@@ -160,19 +301,221 @@ class DatabaseObjectCache(object):
         :raises KeyError: object not in cache
         """
         del self._objects[(category, cache_key)]
+        self._get_category(category).forget(cache_key)
 
     def clear(self, category):
         """Clear all objects in a category.
 
         :param category: category to clear
         """
-        for key in self._objects.keys():
-            if key[0] == category:
-                del self._objects[key]
+        cat = self._get_category(category)
+        for cache_key in cat.access_times.keys():
+            del self._objects[(category, cache_key)]
+            cat.forget(cache_key)
 
     def clear_all(self):
         """Clear all objects in the cache"""
         self._objects = {}
+        for cat in self._categories.values():
+            cat.clear()
+
+    def _shrink_if_needed(self, category, cat):
+        if cat.capacity is None or cat.total_weight <= cat.capacity:
+            return
+        target = cat.capacity * self.SHRINK_RATIO
+        to_sort = cat.access_times.items()
+        to_sort.sort(key=lambda m: m[1])
+        for cache_key, access_time in to_sort:
+            if cat.total_weight <= target:
+                break
+            del self._objects[(category, cache_key)]
+            cat.forget(cache_key)
+            cat.evictions += 1
+
+    def get_stats(self):
+        """Get stats for each category.
+
+        :returns: dict mapping category names to dicts with these keys:
+            - size: number of objects in the category
+            - weight: total weight of the objects
+            - capacity: max weight (or None)
+            - hits: number of get() calls that found an object
+            - misses: number of get() calls that didn't
+            - evictions: number of objects evicted to stay under capacity
+        """
+        return dict((category, cat.get_stats())
+                    for category, cat in self._categories.items())
+
+    def reset_stats(self):
+        for cat in self._categories.values():
+            cat.hits = cat.misses = cat.evictions = 0
+
+class DatabaseObjectCacheCategory(object):
+    """Tracks capacity, LRU info and stats for a DatabaseObjectCache category
+    """
+    def __init__(self):
+        self.capacity = None
+        self.weight_func = None
+        self.total_weight = 0
+        # map cache keys to their weight and last access time
+        self.weights = {}
+        self.access_times = {}
+        self.counter = itertools.count()
+        self.hits = self.misses = self.evictions = 0
+
+    def calc_weight(self, obj):
+        if self.weight_func is None:
+            return 1
+        else:
+            return self.weight_func(obj)
+
+    def forget(self, cache_key):
+        self.total_weight -= self.weights.pop(cache_key)
+        del self.access_times[cache_key]
+
+    def clear(self):
+        self.total_weight = 0
+        self.weights = {}
+        self.access_times = {}
+
+    def get_stats(self):
+        return {
+            'size': len(self.access_times),
+            'weight': self.total_weight,
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+class ObjectMap(object):
+    """Tracks the DDBObjects that are loaded in memory.
+
+    Objects are keyed by (id, table_name) tuples.  By default we keep a
+    strong reference to every object, so once an object is loaded it stays
+    in memory until it's removed.
+
+    If max_size is given, we only keep strong references to the most
+    recently used objects.  The rest are kept with weak references, so they
+    stay in the map as long as something else is using them.  Once nothing
+    is, python frees them and LiveStorage reloads them from disk the next
+    time they're needed.  We never drop objects whose can_evict() method
+    returns False.
+    """
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.evictions = 0
+        if max_size is None:
+            self._objects = {}
+        else:
+            self._objects = weakref.WeakValueDictionary()
+            # strong references to recently used objects
+            self._recent = {}
+            self._access_times = {}
+            self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, key):
+        return key in self._objects
+
+    def __getitem__(self, key):
+        obj = self._objects[key]
+        if self.max_size is not None:
+            self._touch(key, obj)
+        return obj
+
+    def __setitem__(self, key, obj):
+        self._objects[key] = obj
+        if self.max_size is not None:
+            self._touch(key, obj)
+
+    def __delitem__(self, key):
+        del self._objects[key]
+        if self.max_size is not None and key in self._recent:
+            del self._recent[key]
+            del self._access_times[key]
+
+    def _touch(self, key, obj):
+        self._recent[key] = obj
+        self._access_times[key] = self._counter.next()
+        if len(self._recent) > self.max_size:
+            self._shrink()
+
+    def _shrink(self):
+        # Like util.Cache, drop the least recently used half of the objects
+        # at once so that we don't have to sort on every access.
+        to_sort = self._access_times.items()
+        to_sort.sort(key=lambda m: m[1])
+        for key, access_time in to_sort[:len(to_sort) - self.max_size // 2]:
+            if self._recent[key].can_evict():
+                del self._recent[key]
+                del self._access_times[key]
+                self.evictions += 1
+
+    def get_stats(self):
+        """Get stats about the objects in memory.
+
+        :returns: dict with these keys:
+            - size: number of objects in memory
+            - strong_refs: number of objects that we keep alive
+            - evictions: number of times we dropped our reference to an
+              object
+        """
+        if self.max_size is None:
+            strong_refs = len(self._objects)
+        else:
+            strong_refs = len(self._recent)
+        return {
+            'size': len(self._objects),
+            'strong_refs': strong_refs,
+            'evictions': self.evictions,
+        }
+
+class RestoredRow(object):
+    """Stores the undecoded values for a lazily restored DDBObject.
+
+    In lazy mode LiveStorage doesn't decode the columns that take work to
+    convert (repr containers, string sets, etc) when it restores an object.
+    Instead, it stores their database values in a RestoredRow and the values
+    get decoded the first time they are accessed.  We only keep the values
+    that haven't been decoded yet, so big values don't stay in memory twice.
+    See database.AttributeUpdateTracker.
+    """
+    __slots__ = ('storage', 'schema', 'id', 'raw_values')
+
+    def __init__(self, storage, schema, row, lazy_columns):
+        self.storage = storage
+        self.schema = schema
+        self.id = row[storage._schema_column_index[schema, 'id']]
+        self.raw_values = dict(
+            (name, row[storage._schema_column_index[schema, name]])
+            for name in lazy_columns)
+
+    def decode(self, name):
+        """Decode the value for a column
+
+        After this, we forget the database value for the column.
+
+        :raises AttributeError: name is not an undecoded column in our row
+        """
+        try:
+            raw_value = self.raw_values.pop(name)
+        except KeyError:
+            raise AttributeError(name)
+        return self.storage._decode_lazy_column(self, name, raw_value)
+
+    def forget(self, name):
+        """Forget the database value for a column.
+
+        Call this when a column gets set before it was decoded.
+        """
+        self.raw_values.pop(name, None)
+
+    def is_empty(self):
+        """Check if there are any columns left to decode."""
+        return not self.raw_values
 
 class LiveStorageErrorHandler(object):
     """Handle database errors for LiveStorage.
@@ -381,6 +724,10 @@ class LiveStorage(signals.SignalEmitter):
 
     - cache -- DatabaseObjectCache object
 
+    Normally we commit a transaction at the end of each event loop callback
+    that changed the database.  Call set_group_commit() to group the changes
+    from several callbacks into one commit.
+
     Signals:
 
     - transaction-finished(success) -- We committed or rolled back a
@@ -388,7 +735,8 @@ class LiveStorage(signals.SignalEmitter):
     """
     def __init__(self, path=None, error_handler=None, preallocate=None,
                  object_schemas=None, schema_version=None,
-                 start_in_temp_mode=False):
+                 start_in_temp_mode=False, lazy_objects=False,
+                 object_map_size=None):
         """Create a LiveStorage for a database
 
         :param path: path to the database (or ":memory:")
@@ -402,6 +750,12 @@ class LiveStorage(signals.SignalEmitter):
         :param start_in_temp_mode: True if this database should start in
                                    temporary mode (running in memory, but
                                    checking if it can write to the disk)
+        :param lazy_objects: Use lazy mode.  In lazy mode, expensive columns
+                             are decoded on first access and we don't keep
+                             every restored object in memory.
+        :param object_map_size: In lazy mode, max number of unused objects
+                                to keep in memory.  Defaults to
+                                OBJECT_MAP_SIZE.
         """
         signals.SignalEmitter.__init__(self)
         self.create_signal("transaction-finished")
@@ -440,25 +794,48 @@ class LiveStorage(signals.SignalEmitter):
         self._schema_map = {}
         self._schema_column_map = {}
         self._all_schemas = []
-        self._object_map = {} # maps object id -> DDBObjects in memory
-        self._ids_loaded = set()
+        self.lazy_objects = lazy_objects
+        if lazy_objects and object_map_size is None:
+            object_map_size = OBJECT_MAP_SIZE
+        self.object_map_size = object_map_size
+        # maps (id, table_name) -> DDBObjects in memory
+        self._object_map = ObjectMap(object_map_size)
         self._statements_in_transaction = []
+        self._statements = StatementCache()
+        self.group_commit_delay = 0
+        self.group_commit_max_statements = None
+        self._transaction_start = None
+        self._need_event_savepoint = False
+        self._event_savepoint_index = None
+        self._group_commit_dc = None
+        self._reset_commit_stats()
         eventloop.connect("event-finished", self.on_event_finished)
+        self._schema_column_index = {}
+        self._lazy_columns = {}
+        # maps (schema, columns) -> RowDecoder
+        self._row_decoders = {}
+        self._converter = SQLiteConverter()
         for oschema in object_schemas:
             self._all_schemas.append(oschema)
             for klass in oschema.ddb_object_classes():
                 self._schema_map[klass] = oschema
                 for field_name, schema_item in oschema.fields:
                     klass.track_attribute_changes(field_name)
-            for name, schema_item in oschema.fields:
+            lazy_columns = set()
+            for i, (name, schema_item) in enumerate(oschema.fields):
                 self._schema_column_map[oschema, name] = schema_item
-        self._converter = SQLiteConverter()
+                self._schema_column_index[oschema, name] = i
+                if self._converter.can_decode_lazily(schema_item):
+                    lazy_columns.add(name)
+            if lazy_objects:
+                self._lazy_columns[oschema] = lazy_columns
 
         self.open_connection(start_in_temp_mode=start_in_temp_mode)
 
         self.created_new = self._calc_created_new()
         if self.created_new:
             self._init_database()
+        self._apply_tuning_profile()
         if self.preallocate:
             self._preallocate_space()
 
@@ -473,7 +850,8 @@ class LiveStorage(signals.SignalEmitter):
             try:
                 self.connection = sqlite3.connect(path,
                         isolation_level=None,
-                        detect_types=sqlite3.PARSE_DECLTYPES)
+                        detect_types=sqlite3.PARSE_DECLTYPES,
+                        cached_statements=STATEMENT_CACHE_SIZE)
             except sqlite3.DatabaseError, e:
                 logging.warn("Error opening sqlite database: %s", e)
                 action = self.error_handler.handle_open_error()
@@ -528,7 +906,8 @@ class LiveStorage(signals.SignalEmitter):
         """
         self.connection = sqlite3.connect(':memory:',
                                           isolation_level=None,
-                                          detect_types=sqlite3.PARSE_DECLTYPES)
+                                          detect_types=sqlite3.PARSE_DECLTYPES,
+                                          cached_statements=STATEMENT_CACHE_SIZE)
         self.temp_mode = True
         eventloop.add_timeout(300,
                               self._try_save_temp_to_disk,
@@ -866,7 +1245,6 @@ class LiveStorage(signals.SignalEmitter):
     def remember_object(self, obj):
         key = (obj.id, obj.db_info.db.table_name(obj.__class__))
         self._object_map[key] = obj
-        self._ids_loaded.add(key)
 
     def forget_object(self, obj):
         key = (obj.id, obj.db_info.db.table_name(obj.__class__))
@@ -877,16 +1255,35 @@ class LiveStorage(signals.SignalEmitter):
                        'key error in forget_object: %s (obj: %s)' %
                        (obj.id, obj))
             logging.error(details)
-        self._ids_loaded.discard(key)
 
     def forget_all_objects(self):
-        self._object_map = {}
-        self._ids_loaded = set()
+        self._object_map = ObjectMap(self.object_map_size)
+
+    def get_object_map_stats(self):
+        """Get stats about the DDBObjects in memory.
+
+        See ObjectMap.get_stats() for details
+        """
+        return self._object_map.get_stats()
 
     def _insert_sql_for_schema(self, obj_schema):
-        return "INSERT INTO %s (%s) VALUES(%s)" % (obj_schema.table_name,
-                ', '.join(name for name, schema_item in obj_schema.fields),
-                ', '.join('?' for i in xrange(len(obj_schema.fields))))
+        return self._statements.get((obj_schema, 'insert', None))
+
+    def _update_sql_for_schema(self, obj_schema, columns):
+        return self._statements.get((obj_schema, 'update', tuple(columns)))
+
+    def _delete_sql_for_schema(self, obj_schema, id_count=1):
+        return self._statements.get((obj_schema, 'delete', id_count))
+
+    def _select_sql_for_schema(self, obj_schema, id_count=1):
+        return self._statements.get((obj_schema, 'select', id_count))
+
+    def get_statement_cache_stats(self):
+        """Get hit/miss counts for our SQL statement cache.
+
+        See StatementCache.get_stats() for details
+        """
+        return self._statements.get_stats()
 
     def _values_for_obj(self, obj_schema, obj):
         values = []
@@ -929,17 +1326,26 @@ class LiveStorage(signals.SignalEmitter):
         for obj in objects:
             obj.reset_changed_attributes()
 
-    def update_obj(self, obj):
-        """Update a DDBObject on disk."""
+    def _update_values_for_obj(self, obj_schema, obj):
+        """Get the columns that need to be written to update an object.
 
-        obj_schema = self._schema_map[obj.__class__]
-        setters = []
+        Simple values are only written if they're in changed_attributes.
+        Container values (lists, dicts, etc) are always written since we
+        can't track changes inside them.
+
+        :returns: (columns, values) tuple
+        """
+        columns = []
         values = []
+        lazy = '_restored_row' in obj.__dict__
         for name, schema_item in obj_schema.fields:
             if (isinstance(schema_item, schema.SchemaSimpleItem) and
                     name not in obj.changed_attributes):
                 continue
-            setters.append('%s=?' % name)
+            if lazy and name not in obj.__dict__:
+                # value was never decoded, so it can't have changed
+                continue
+            columns.append(name)
             value = getattr(obj, name)
             try:
                 schema_item.validate(value)
@@ -949,9 +1355,16 @@ class LiveStorage(signals.SignalEmitter):
             values.append(self._converter.to_sql(obj_schema, name,
                 schema_item, value))
         obj.reset_changed_attributes()
+        return columns, values
+
+    def update_obj(self, obj):
+        """Update a DDBObject on disk."""
+
+        obj_schema = self._schema_map[obj.__class__]
+        columns, values = self._update_values_for_obj(obj_schema, obj)
         if values:
-            sql = "UPDATE %s SET %s WHERE id=%s" % (obj_schema.table_name,
-                    ', '.join(setters), obj.id)
+            values.append(obj.id)
+            sql = self._update_sql_for_schema(obj_schema, columns)
             self.execute(sql, values, is_update=True)
             if (self.cursor.rowcount != 1 and not
                     self._quitting_from_operational_error):
@@ -963,11 +1376,41 @@ class LiveStorage(signals.SignalEmitter):
                             "(id: %s, count: %s)" %
                             (obj.id, self.cursor.rowcount))
 
+    def bulk_update(self, objects):
+        """Update a list of objects in one go.
+
+        Only the changed columns for each object get written.  Objects that
+        change the same set of columns are grouped together and sent to
+        sqlite with a single executemany() call.
+
+        Throws a ValueError if the objects don't all use the same database
+        table.
+        """
+        if len(objects) == 0:
+            return
+        obj_schema = self._schema_map[objects[0].__class__]
+        # map tuples of column names to lists of values to update
+        batches = {}
+        for obj in objects:
+            if obj_schema != self._schema_map[obj.__class__]:
+                raise ValueError("Incompatible types for bulk update")
+            columns, values = self._update_values_for_obj(obj_schema, obj)
+            if values:
+                values.append(obj.id)
+                batches.setdefault(tuple(columns), []).append(values)
+        for columns, value_list in batches.iteritems():
+            sql = self._update_sql_for_schema(obj_schema, columns)
+            self.execute(sql, value_list, is_update=True, many=True)
+            if (self.cursor.rowcount != len(value_list) and not
+                    self._quitting_from_operational_error):
+                raise KeyError("Bulk update changed %s rows (expected %s)" %
+                               (self.cursor.rowcount, len(value_list)))
+
     def remove_obj(self, obj):
         """Remove a DDBObject from disk."""
 
-        schema = self._schema_map[obj.__class__]
-        sql = "DELETE FROM %s WHERE id=?" % (schema.table_name)
+        obj_schema = self._schema_map[obj.__class__]
+        sql = self._delete_sql_for_schema(obj_schema)
         self.execute(sql, (obj.id,), is_update=True)
         self.forget_object(obj)
 
@@ -987,9 +1430,7 @@ class LiveStorage(signals.SignalEmitter):
         # we can only feed sqlite so many variables at once, send it chunks of
         # 900 ids at once
         for objects_chunk in util.split_values_for_sqlite(objects):
-            commas = ','.join('?' for x in xrange(len(objects_chunk)))
-            sql = "DELETE FROM %s WHERE id IN (%s)" % (obj_schema.table_name,
-                    commas)
+            sql = self._delete_sql_for_schema(obj_schema, len(objects_chunk))
             self.execute(sql, [o.id for o in objects_chunk], is_update=True)
         for obj in objects:
             self.forget_object(obj)
@@ -1055,7 +1496,7 @@ class LiveStorage(signals.SignalEmitter):
         table_name = self.table_name(klass)
         unrestored_ids = []
         for id_ in id_list:
-            if (id_, table_name) not in self._ids_loaded:
+            if (id_, table_name) not in self._object_map:
                 unrestored_ids.append(id_)
         if unrestored_ids:
             # restore any objects that we don't already have in memory.
@@ -1074,45 +1515,73 @@ class LiveStorage(signals.SignalEmitter):
         return (row[0] for row in self.cursor.fetchall())
 
     def _restore_objects(self, schema, id_set, db_info):
-        column_names = ['%s.%s' % (schema.table_name, f[0])
-                for f in schema.fields]
-
         # we can only feed sqlite so many variables at once, send it chunks of
         # 900 ids at once
         id_list = tuple(id_set)
+        decoder = self._get_row_decoder(schema, None)
         for id_list_chunk in util.split_values_for_sqlite(id_list):
-            sql = StringIO()
-            sql.write("SELECT %s " % (', '.join(column_names),))
-            sql.write("FROM %s WHERE id IN (%s)" % (schema.table_name, 
-                ', '.join('?' for i in xrange(len(id_list_chunk)))))
+            sql = self._select_sql_for_schema(schema, len(id_list_chunk))
+            self.cursor.execute(sql, id_list_chunk)
+            rows = self.cursor.fetchall()
+            try:
+                decoded_rows = decoder.decode_rows(rows)
+            except StandardError:
+                # Some of the data is malformed.  Restore the objects one
+                # column at a time so that we can try to fix it.
+                for row in rows:
+                    self._restore_object_from_row(schema, row, db_info)
+            else:
+                for row, values in itertools.izip(rows, decoded_rows):
+                    self._restore_object_from_values(schema, row, values,
+                                                     db_info)
 
-            self.cursor.execute(sql.getvalue(), id_list_chunk)
-            for row in self.cursor.fetchall():
-                self._restore_object_from_row(schema, row, db_info)
+    def _get_row_decoder(self, schema, columns):
+        """Get a RowDecoder for a schema
+
+        :param columns: list of column names, or None to decode all the
+        columns used to restore objects
+        """
+        key = (schema, columns)
+        try:
+            return self._row_decoders[key]
+        except KeyError:
+            if columns is None:
+                decoder = self._converter.make_row_decoder(schema.fields,
+                        self._lazy_columns.get(schema, ()))
+            else:
+                fields = [(name, self._schema_column_map[schema, name])
+                          for name in columns]
+                decoder = self._converter.make_row_decoder(fields)
+            self._row_decoders[key] = decoder
+            return decoder
+
+    def _restore_object_from_values(self, schema, db_row, values, db_info):
+        """Restore an object from a row decoded with a RowDecoder."""
+        lazy_columns = self._lazy_columns.get(schema)
+        if lazy_columns:
+            restored_data = dict((name, value) for ((name, schema_item), value)
+                                 in itertools.izip(schema.fields, values)
+                                 if name not in lazy_columns)
+            restored_data['_restored_row'] = RestoredRow(self, schema, db_row,
+                                                         lazy_columns)
+        else:
+            restored_data = dict((name, value) for ((name, schema_item), value)
+                                 in itertools.izip(schema.fields, values))
+        klass = schema.get_ddb_class(restored_data)
+        return klass(restored_data=restored_data, db_info=db_info)
 
     def _restore_object_from_row(self, schema, db_row, db_info):
         restored_data = {}
         columns_to_update = []
         values_to_update = []
+        lazy_columns = self._lazy_columns.get(schema, ())
         for (name, schema_item), value in \
                 itertools.izip(schema.fields, db_row):
-            try:
-                value = self._converter.from_sql(schema, name, schema_item,
-                        value)
-            except StandardError:
-                logging.exception('self._converter.from_sql failed.')
-                handler = self._converter.get_malformed_data_handler(schema,
-                        name, schema_item, value)
-                if handler is None:
-                    if util.chatter:
-                        logging.warn("error converting %s (%r)", name, value)
-                    raise
-                try:
-                    value = handler(value)
-                except StandardError:
-                    if util.chatter:
-                        logging.warn("error converting %s (%r)", name, value)
-                    raise
+            if name in lazy_columns:
+                continue
+            value, malformed = self._value_from_sql(schema, name,
+                                                    schema_item, value)
+            if malformed:
                 columns_to_update.append(name)
                 values_to_update.append(self._converter.to_sql(schema, name,
                     schema_item, value))
@@ -1120,13 +1589,54 @@ class LiveStorage(signals.SignalEmitter):
         if columns_to_update:
             # We are using some values that are different than what's stored
             # in disk.  Update the database to make things match.
-            setters = ['%s=?' % c for c in columns_to_update]
-            sql = "UPDATE %s SET %s WHERE id=%s" % (schema.table_name,
-                    ', '.join(setters), restored_data['id'])
+            values_to_update.append(restored_data['id'])
+            sql = self._update_sql_for_schema(schema, columns_to_update)
             self.execute(sql, values_to_update)
+        if lazy_columns:
+            restored_data['_restored_row'] = RestoredRow(self, schema, db_row,
+                                                         lazy_columns)
         klass = schema.get_ddb_class(restored_data)
         return klass(restored_data=restored_data, db_info=db_info)
 
+    def _value_from_sql(self, schema, name, schema_item, value):
+        """Convert a value from the database
+
+        If the value is malformed, we try to fix it using the schema's
+        malformed data handler.
+
+        :returns: (value, malformed) tuple.  If malformed is True, the value
+        was fixed and should be written back to the database.
+        """
+        try:
+            return (self._converter.from_sql(schema, name, schema_item,
+                                             value), False)
+        except StandardError:
+            logging.exception('self._converter.from_sql failed.')
+            handler = self._converter.get_malformed_data_handler(schema,
+                    name, schema_item, value)
+            if handler is None:
+                if util.chatter:
+                    logging.warn("error converting %s (%r)", name, value)
+                raise
+            try:
+                return handler(value), True
+            except StandardError:
+                if util.chatter:
+                    logging.warn("error converting %s (%r)", name, value)
+                raise
+
+    def _decode_lazy_column(self, restored_row, name, raw_value):
+        schema = restored_row.schema
+        schema_item = self._schema_column_map[schema, name]
+        value, malformed = self._value_from_sql(schema, name, schema_item,
+                                                raw_value)
+        if malformed:
+            sql = self._update_sql_for_schema(schema, [name])
+            self.execute(sql, [self._converter.to_sql(schema, name,
+                                                      schema_item, value),
+                               restored_row.id])
+        return value
+
     def persistent_object_count(self):
         return len(self._object_map)
 
@@ -1156,21 +1666,86 @@ class LiveStorage(signals.SignalEmitter):
         results = self.execute(sql.getvalue(), values)
         if not convert:
             return results
-        schema_items = [self._schema_column_map[schema, c] for c in columns]
-        rows = []
-        for row in results:
-            converted_row = []
-            for name, schema_item, value in itertools.izip(columns,
-                    schema_items, row):
-                converted_row.append(self._converter.from_sql(schema, name,
-                    schema_item, value))
-            rows.append(converted_row)
-        return rows
+        decoder = self._get_row_decoder(schema, tuple(columns))
+        return [list(row) for row in decoder.decode_rows(results)]
+
+    def set_group_commit(self, delay, max_statements=None):
+        """Set up group commit mode.
+
+        In group commit mode, we don't commit at the end of each event.
+        Instead, we keep the transaction open until it's delay seconds old or
+        has max_statements statements in it.  This means a lot fewer commits
+        (and fsyncs) when we are running many small events, at the cost of
+        losing up to delay seconds of changes if we crash.  Call
+        finish_transaction() to commit before that.
+
+        If an event fails, only the changes from that event are rolled back.
+
+        :param delay: max number of seconds to keep a transaction open.  Use 0
+        to commit after every event (the default).
+        :param max_statements: max number of statements to group in a
+        transaction, or None for no limit
+        """
+        self.group_commit_delay = delay
+        self.group_commit_max_statements = max_statements
+        if not delay:
+            self.finish_transaction()
 
     def on_event_finished(self, eventloop, success):
-        self.finish_transaction(commit=success)
+        if not self.group_commit_delay:
+            self.finish_transaction(commit=success)
+            return
+        if not success:
+            self._rollback_event()
+        if not self._statements_in_transaction:
+            return
+        if self._group_commit_budget_used():
+            self.finish_transaction()
+        else:
+            # Set a savepoint before the next event changes anything so that
+            # we can roll back just its changes if it fails.
+            self._need_event_savepoint = True
+            self._schedule_group_commit()
+
+    def _schedule_group_commit(self):
+        if self._group_commit_dc is None:
+            self._group_commit_dc = eventloop.add_timeout(
+                self.group_commit_delay, self._group_commit_timeout,
+                "group commit")
+
+    def _group_commit_budget_used(self):
+        if (time.time() - self._transaction_start >=
+                self.group_commit_delay):
+            return True
+        return (self.group_commit_max_statements is not None and
+                len(self._statements_in_transaction) >=
+                self.group_commit_max_statements)
+
+    def _group_commit_timeout(self):
+        self._group_commit_dc = None
+        self.finish_transaction()
+
+    def _rollback_event(self):
+        """Roll back the changes from the last event in group commit mode."""
+        if self._need_event_savepoint:
+            # the event didn't change anything
+            return
+        if self._event_savepoint_index is None:
+            # all changes in the transaction are from the event
+            self.finish_transaction(commit=False)
+            return
+        if not self._quitting_from_operational_error:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT event")
+        del self._statements_in_transaction[self._event_savepoint_index:]
+        self._event_savepoint_index = None
+        self._commit_stats['rollbacks'] += 1
 
     def finish_transaction(self, commit=True):
+        if self._group_commit_dc is not None:
+            self._group_commit_dc.cancel()
+            self._group_commit_dc = None
+        self._need_event_savepoint = False
+        self._event_savepoint_index = None
         if len(self._statements_in_transaction) == 0:
             return
         if not self._quitting_from_operational_error:
@@ -1178,9 +1753,53 @@ class LiveStorage(signals.SignalEmitter):
                 self.cursor.execute("COMMIT TRANSACTION")
             else:
                 self.cursor.execute("ROLLBACK TRANSACTION")
+        stats = self._commit_stats
+        if commit:
+            stats['commits'] += 1
+            stats['statements'] += len([
+                sql for (sql, values, many) in self._statements_in_transaction
+                if sql != "SAVEPOINT event"])
+        else:
+            stats['rollbacks'] += 1
         self._statements_in_transaction = []
         self.emit("transaction-finished", commit)
 
+    def get_commit_stats(self):
+        """Get stats about our transactions.
+
+        :returns: dict with these keys:
+            - commits: number of commits
+            - rollbacks: number of rollbacks (including rolling back a single
+              event in group commit mode)
+            - statements: number of statements committed
+            - statements_per_commit: average number of statements per commit
+            - commits_per_sec: average number of commits per second since the
+              stats were reset
+        """
+        stats = self._commit_stats.copy()
+        elapsed = time.time() - stats.pop('start_time')
+        if stats['commits']:
+            stats['statements_per_commit'] = (float(stats['statements']) /
+                                              stats['commits'])
+        else:
+            stats['statements_per_commit'] = 0.0
+        if elapsed > 0:
+            stats['commits_per_sec'] = stats['commits'] / elapsed
+        else:
+            stats['commits_per_sec'] = 0.0
+        return stats
+
+    def _reset_commit_stats(self):
+        self._commit_stats = {
+            'commits': 0,
+            'rollbacks': 0,
+            'statements': 0,
+            'start_time': time.time(),
+        }
+
+    def reset_commit_stats(self):
+        self._reset_commit_stats()
+
     def execute(self, sql, values=None, is_update=False, many=False):
         """Execute an sql statement and return the results.
 
@@ -1196,8 +1815,19 @@ class LiveStorage(signals.SignalEmitter):
             # We want to avoid updating the database at this point.
             return
 
-        if is_update and len(self._statements_in_transaction) == 0:
-            self.cursor.execute("BEGIN TRANSACTION")
+        if is_update:
+            if len(self._statements_in_transaction) == 0:
+                self.cursor.execute("BEGIN TRANSACTION")
+                self._transaction_start = time.time()
+            elif self._need_event_savepoint:
+                # store the SAVEPOINT with the other statements so that
+                # _try_rerunning_transaction() recreates it.
+                self._event_savepoint_index = len(
+                    self._statements_in_transaction)
+                self._statements_in_transaction.append(
+                    ("SAVEPOINT event", (), False))
+                self.cursor.execute("SAVEPOINT event")
+            self._need_event_savepoint = False
 
         if values is None:
             values = ()
@@ -1305,6 +1935,7 @@ class LiveStorage(signals.SignalEmitter):
             # reset _statements_in_transaction.  The data for the old DB is
             # now lost
             self._statements_in_transaction = []
+            self._event_savepoint_index = None
             self.cursor = self.connection.cursor()
             self._init_database()
             return False
@@ -1381,6 +2012,65 @@ class LiveStorage(signals.SignalEmitter):
             rv.append(row[0])
         return rv
 
+    def _apply_tuning_profile(self):
+        """Tune our connection based on the size of the database.
+
+        See miro.data.storagetuning for details.
+        """
+        self.tuning_profile = None
+        size_info = self._get_size_info()
+        if size_info is None:
+            logging.warn("_get_size_info() returned None.  Not "
+                         "tuning database: %s", self.path)
+            return
+        db_size = storagetuning.calc_db_size(*size_info)
+        profile = storagetuning.profile_for_size(db_size)
+        logging.info("using %s tuning profile for database (%s bytes)",
+                     profile.name, db_size)
+        for name, value in storagetuning.connection_pragmas(profile):
+            self.cursor.execute("PRAGMA %s=%s" % (name, value))
+        self.cursor.execute("PRAGMA wal_autocheckpoint=%s" %
+                            profile.wal_autocheckpoint)
+        if (storagetuning.should_change_page_size(profile, size_info[0]) and
+            not self.temp_mode and self.path != ':memory:'):
+            # Changing the page size means a VACUUM, which can take a long
+            # time for big databases.  Don't make startup wait on it.
+            eventloop.add_timeout(PAGE_SIZE_CHANGE_DELAY,
+                                  self._change_page_size,
+                                  'change database page size',
+                                  args=(profile.page_size,))
+        self.tuning_profile = profile
+
+    def _change_page_size(self, page_size):
+        """Change the page size for our database.
+
+        This requires a VACUUM, which rewrites the entire database file.  For
+        big databases this can take a while, so _apply_tuning_profile()
+        schedules it to run a while after startup rather than running it
+        right away.
+
+        The page size can't be changed in WAL mode, so we switch out of it
+        while we run the VACUUM.  VACUUM also throws away our preallocated
+        space, so we allocate it again afterwards.
+        """
+        if self.is_closed() or self.temp_mode:
+            return
+        logging.info("changing database page size to %s", page_size)
+        # VACUUM can't run inside a transaction
+        self.finish_transaction()
+        start = time.time()
+        try:
+            self.cursor.execute("PRAGMA journal_mode=delete")
+            self.cursor.execute("PRAGMA page_size=%s" % page_size)
+            self.cursor.execute("VACUUM")
+        except sqlite3.DatabaseError, e:
+            logging.warn("error changing database page size: %s", e)
+        self._switch_to_wal_mode()
+        if self.preallocate:
+            self._preallocate_space()
+        logging.timing("changing page size took %0.3f seconds",
+                       time.time() - start)
+
     def _preallocate_space(self, db_name='main'):
         if db_name == 'main':
             size_info = self._get_size_info()
@@ -1523,8 +2213,14 @@ class SQLiteConverter(object):
                 schema.SchemaList,
                 )
         for schema_class in repr_types:
-            self._to_sql_converters[schema_class] = self._repr_to_sql
-            self._from_sql_converters[schema_class] = self._repr_from_sql
+            self._to_sql_converters[schema_class] = self._container_to_sql
+            self._from_sql_converters[schema_class] = \
+                    self._container_from_sql
+        # These types are expensive to convert and their python values take
+        # more memory than the database values, so in lazy mode we wait
+        # until they're accessed to convert them.
+        self._lazy_types = set(repr_types)
+        self._lazy_types.add(schema.SchemaStringSet)
 
     def to_sql(self, schema, name, schema_item, value):
         if value is None:
@@ -1540,6 +2236,25 @@ class SQLiteConverter(object):
                 self._null_convert)
         return converter(value, schema_item)
 
+    def get_from_sql_converter(self, schema_item):
+        """Get the function that converts values for a schema item.
+
+        :returns: function that inputs (value, schema_item), or None if
+        values for schema_item don't need to be converted
+        """
+        return self._from_sql_converters.get(schema_item.__class__)
+
+    def make_row_decoder(self, fields, skip_columns=()):
+        """Make a RowDecoder for rows selected from a table.
+
+        :param fields: list of (name, schema_item) tuples for the columns
+        :param skip_columns: don't convert values for these columns
+        """
+        return RowDecoder(self, fields, skip_columns)
+
+    def can_decode_lazily(self, schema_item):
+        return schema_item.__class__ in self._lazy_types
+
     def get_malformed_data_handler(self, schema, name, schema_item, value):
         handler_name = 'handle_malformed_%s' % name
         if hasattr(schema, handler_name):
@@ -1580,11 +2295,11 @@ class SQLiteConverter(object):
     def _filename_to_sql(self, value, schema_item):
         return filename_to_unicode(value)
 
-    def _repr_to_sql(self, value, schema_item):
-        return repr(value)
+    def _container_to_sql(self, value, schema_item):
+        return containerjson.dumps(value)
 
-    def _repr_from_sql(self, value, schema_item):
-        return eval(value, __builtins__, {'datetime': datetime, 'time': _TIME_MODULE_SHADOW})
+    def _container_from_sql(self, value, schema_item):
+        return containerjson.loads(value)
 
     def _string_set_to_sql(self, value, schema_item):
         return schema_item.delimiter.join(value)
@@ -1599,12 +2314,35 @@ class SQLiteConverter(object):
     def _timedelta_from_sql(self, value, schema_item):
         return datetime.timedelta(*(int(c) for c in value.split(":")))
 
-class TimeModuleShadow:
-    """In Python 2.6, time.struct_time is a named tuple and evals poorly,
-    so we have struct_time_shadow which takes the arguments that struct_time
-    should have and returns a 9-tuple
+class RowDecoder(object):
+    """Converts rows from the database to python values.
+
+    A RowDecoder is made once for a set of columns.  It figures out ahead of
+    time which columns need converting, and then decodes all the rows from a
+    query column by column.  Columns that don't need converting (integers,
+    text, etc) are skipped entirely.
     """
-    def struct_time(self, tm_year=0, tm_mon=0, tm_mday=0, tm_hour=0, tm_min=0, tm_sec=0, tm_wday=0, tm_yday=0, tm_isdst=0):
-        return (tm_year, tm_mon, tm_mday, tm_hour, tm_min, tm_sec, tm_wday, tm_yday, tm_isdst)
+    def __init__(self, converter, fields, skip_columns=()):
+        self.conversions = []
+        for i, (name, schema_item) in enumerate(fields):
+            if name in skip_columns:
+                continue
+            func = converter.get_from_sql_converter(schema_item)
+            if func is not None:
+                self.conversions.append((i, func, schema_item))
 
-_TIME_MODULE_SHADOW = TimeModuleShadow()
+    def decode_rows(self, rows):
+        """Decode a list of rows.
+
+        :returns: list of decoded rows
+        :raises StandardError: some value couldn't be converted.  Use
+        SQLiteConverter.from_sql() for each value to handle that case.
+        """
+        if not self.conversions or not rows:
+            return rows
+        columns = zip(*rows)
+        for i, func, schema_item in self.conversions:
+            columns[i] = [func(value, schema_item) if value is not None
+                          else None
+                          for value in columns[i]]
+        return zip(*columns)
@@ -73,7 +73,10 @@ def _on_windows():
 #
 # We spawn a child process and communicate to it by sending messages through
 # it's stdin and stdout.  Each message contains a length (a unsigned long)
-# followed by a pickled object.
+# followed by a pickled object.  We use the highest pickle protocol, since
+# both sides are always running the same python.  Large binary data like
+# cover art and screenshots doesn't go through the pipe, the subprocess
+# writes it to a file and sends the path back instead.
 #
 # The communication goes like this:
 #
@@ -248,6 +251,14 @@ class SubprocessResponder(messagetools.MessageHandler):
         """Called after the subprocess shuts down."""
         pass
 
+    def on_crash(self):
+        """Called when the subprocess quits unexpectedly.
+
+        This is called right away, before we restart the subprocess, which
+        may be delayed (see SubprocessManager.restart_delay).
+        """
+        pass
+
     def on_restart(self):
         """Called after the subprocess restarts after a crash."""
         pass
@@ -262,6 +273,10 @@ class LoadError(StandardError):
     """Exception for corrupt data when reading from a pipe."""
 
 SIZEOF_LONG = struct.calcsize("Q")
+PICKLE_PROTOCOL = pickle.HIGHEST_PROTOCOL
+# Messages smaller than this get sent with a single write() call.  Larger
+# ones are written in 2 parts to avoid copying the pickle data.
+SINGLE_WRITE_LIMIT = 65536
 
 def _read_bytes_from_pipe(pipe, length):
     """Read size bytes from a pipe.
@@ -273,7 +288,13 @@ def _read_bytes_from_pipe(pipe, length):
       a) read() returns no data, meaning the pipe is closed
       b) we've read length bytes
     """
-    data = []
+    # Usually read() returns all the data in one go, in that case avoid
+    # copying it with join()
+    d = pipe.read(length)
+    if len(d) == length or d == '':
+        return d
+    data = [d]
+    length -= len(d)
     while length > 0:
         d = pipe.read(length)
         if d == '':
@@ -319,7 +340,7 @@ def _dump_obj(obj, pipe):
     :raises pickle.PickleError: obj could not be pickled
     """
 
-    pickle_data = pickle.dumps(obj)
+    pickle_data = pickle.dumps(obj, PICKLE_PROTOCOL)
     size_data = struct.pack("Q", len(pickle_data))
     # NOTE: We do a blocking write here.  This should be fine, since on both
     # sides we have a thread dedicated to just reading from the pipe and
@@ -327,8 +348,11 @@ def _dump_obj(obj, pipe):
     # process on the other side has gone really haywire and the reader thread
     # is hung.  I (BDK) can't really see a way for this to realistically
     # happen, so we stick with blocking writes.
-    pipe.write(size_data)
-    pipe.write(pickle_data)
+    if len(pickle_data) < SINGLE_WRITE_LIMIT:
+        pipe.write(size_data + pickle_data)
+    else:
+        pipe.write(size_data)
+        pipe.write(pickle_data)
     pipe.flush()
 
 class SubprocessManager(object):
@@ -476,6 +500,7 @@ class SubprocessManager(object):
             logging.warn("Subprocess quit unexpectedly (quit_type: %s, "
                          "sent_quit: %s).  Will restart subprocess",
                          self.thread.quit_type, self.sent_quit)
+            trapcall.trap_call("subprocess crash", self.responder.on_crash)
             # NOTE: should we enforce some sort of cool-down time before
             # restarting the subprocess?
             time_since_start = clock.clock() - self.start_time
@@ -47,9 +47,11 @@ import logging
 import urllib2
 import urlparse
 
+from miro import app
 from miro import httpclient
 from miro import singleclick
 from miro import feed
+from miro import feedupdate
 from miro import folder
 from miro import guide
 
@@ -213,7 +215,7 @@ class Subscriber(object):
         search_term = feed_dict.get('search_term')
         f = feed.lookup_feed(url, search_term)
         if f is None:
-            f = feed.Feed(url, search_term=search_term)
+            f = self.make_feed(url, search_term)
             title = feed_dict.get('title')
             if title is not None and title != '':
                 f.set_title(title)
@@ -235,6 +237,10 @@ class Subscriber(object):
         else:
             return False
 
+    def make_feed(self, url, search_term):
+        """Create a new Feed for handle_feed()."""
+        return feed.Feed(url, search_term=search_term)
+
     def handle_site(self, site_dict, parent_folder):
         """
         Site subscriptions look like::
@@ -279,3 +285,69 @@ class Subscriber(object):
         singleclick.download_video(entry)
         # it's all async, so we don't know right away
         return False
+
+class BulkSubscriber(Subscriber):
+    """Subscriber that's optimized for adding lots of subscriptions at once.
+
+    This is used for OPML import.  All the new objects are inserted into the
+    database in a single batch, feeds with the same URL are only added once,
+    and the new feeds are fetched through the feed update queue rather than
+    all at once (see feedupdate.schedule_bulk_updates()).
+    """
+    def __init__(self, progress_callback=None):
+        """Create a BulkSubscriber.
+
+        :param progress_callback: function to call as we handle each feed.
+            It's passed the number of feeds handled and the total number of
+            feeds.
+        """
+        self.progress_callback = progress_callback
+        self.feed_count = 0
+        self.feeds_handled = 0
+        self.seen_feeds = set()
+        self.new_feeds = []
+
+    def add_subscriptions(self, subscriptions_list, parent_folder=None):
+        if parent_folder is not None:
+            # called by handle_folder(), we're already inside the batch
+            return Subscriber.add_subscriptions(self, subscriptions_list,
+                                                parent_folder)
+        self.feed_count = self._count_feeds(subscriptions_list)
+        app.bulk_sql_manager.start()
+        try:
+            rv = Subscriber.add_subscriptions(self, subscriptions_list)
+        finally:
+            app.bulk_sql_manager.finish()
+        feedupdate.schedule_bulk_updates([(f, f.generate_feed_from_queue)
+                                          for f in self.new_feeds])
+        self.new_feeds = []
+        return rv
+
+    def _count_feeds(self, subscriptions_list):
+        count = 0
+        for subscription in subscriptions_list:
+            if subscription['type'] == 'feed':
+                count += 1
+            elif subscription['type'] == 'folder':
+                count += self._count_feeds(subscription['children'])
+        return count
+
+    def handle_feed(self, feed_dict, parent_folder):
+        self.feeds_handled += 1
+        if self.progress_callback is not None:
+            self.progress_callback(self.feeds_handled, self.feed_count)
+        # feed.lookup_feed() can't find feeds that we're about to insert, so
+        # we need to check for duplicates ourselves
+        url = feed.normalize_feed_url(feed_dict['url'])
+        key = (url, feed_dict.get('search_term'))
+        if key in self.seen_feeds:
+            return False
+        self.seen_feeds.add(key)
+        feed_dict = feed_dict.copy()
+        feed_dict['url'] = url
+        return Subscriber.handle_feed(self, feed_dict, parent_folder)
+
+    def make_feed(self, url, search_term):
+        f = feed.Feed(url, search_term=search_term, queue_generate=True)
+        self.new_feeds.append(f)
+        return f
@@ -85,6 +85,7 @@ from miro.test.itemfiltertest import *
 from miro.test.extensiontest import *
 from miro.test.idleiteratetest import *
 from miro.test.itemtracktest import *
+from miro.test.connectionpooltest import *
 from miro.test.itemlisttest import *
 from miro.test.itemrenderertest import *
 from miro.test.sharingtest import *
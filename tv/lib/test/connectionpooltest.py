@@ -0,0 +1,163 @@
+# Miro - an RSS based video player application
+# Copyright (C) 2012
+# Participatory Culture Foundation
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# In addition, as a special exception, the copyright holders give
+# permission to link the code of portions of this program with the OpenSSL
+# library.
+#
+# You must obey the GNU General Public License in all respects for all of
+# the code used other than OpenSSL. If you modify file(s) with this
+# exception, you may extend this exception to your version of the file(s),
+# but you are not obligated to do so. If you do not wish to do so, delete
+# this exception statement from your version. If you delete this exception
+# statement from all source files in the program, then also delete it here.
+
+"""connectionpooltest -- Test the miro.data.connectionpool module.  """
+
+import threading
+import time
+
+from miro.data import connectionpool
+from miro.test.framework import MiroTestCase
+
+class ConnectionPoolTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.db_path = self.make_temp_path(".sqlite")
+        self.pool = connectionpool.ConnectionPool(self.db_path,
+                                                  min_connections=1,
+                                                  max_connections=2,
+                                                  timeout=0)
+
+    def tearDown(self):
+        self.pool.destroy()
+        MiroTestCase.tearDown(self)
+
+    def test_reuse(self):
+        connection = self.pool.get_connection()
+        self.pool.release_connection(connection)
+        self.assert_(self.pool.get_connection() is connection)
+
+    def test_limit(self):
+        self.pool.get_connection()
+        self.pool.get_connection()
+        self.assertRaises(connectionpool.ConnectionLimitError,
+                          self.pool.get_connection)
+        self.assertEquals(self.pool.get_stats()['timeouts'], 1)
+
+    def test_limit_same_thread(self):
+        # we have all the connections checked out, so waiting for one to be
+        # released would just block.  We should raise right away.
+        self.pool.get_connection()
+        self.pool.get_connection()
+        start = time.time()
+        self.assertRaises(connectionpool.ConnectionLimitError,
+                          self.pool.get_connection, timeout=5.0)
+        self.assert_(time.time() - start < 1.0)
+
+    def test_wait(self):
+        def get_in_thread():
+            self.thread_connection = self.pool.get_connection()
+        thread = threading.Thread(target=get_in_thread)
+        thread.start()
+        thread.join()
+        connection = self.thread_connection
+        self.pool.get_connection()
+        def release_later():
+            time.sleep(0.1)
+            self.pool.release_connection(connection)
+        thread = threading.Thread(target=release_later)
+        thread.start()
+        # get_connection() should wait for the other thread to release the
+        # connection
+        self.assert_(self.pool.get_connection(timeout=5.0) is connection)
+        thread.join()
+        stats = self.pool.get_stats()
+        self.assertEquals(stats['waits'], 1)
+        self.assert_(stats['max_wait_time'] > 0)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0
+        connection1 = self.pool.get_connection()
+        connection2 = self.pool.get_connection()
+        self.pool.release_connection(connection1)
+        self.pool.release_connection(connection2)
+        # we should close idle connections, but keep min_connections open
+        self.assertEquals(len(self.pool.all_connections), 1)
+        self.assertEquals(self.pool.get_stats()['idle_closed'], 1)
+
+    def test_idle_reaper(self):
+        self.pool.idle_timeout = 0.1
+        connection1 = self.pool.get_connection()
+        connection2 = self.pool.get_connection()
+        self.pool.release_connection(connection1)
+        self.pool.release_connection(connection2)
+        self.assertEquals(len(self.pool.all_connections), 2)
+        # the pool isn't used again, but the idle connection should still
+        # get closed
+        time.sleep(0.5)
+        self.assertEquals(len(self.pool.all_connections), 1)
+
+    def test_destroy(self):
+        def get_in_thread():
+            self.thread_connection = self.pool.get_connection()
+        thread = threading.Thread(target=get_in_thread)
+        thread.start()
+        thread.join()
+        self.pool.get_connection()
+        errors = []
+        def wait_for_connection():
+            try:
+                self.pool.get_connection(timeout=5.0)
+            except connectionpool.PoolClosedError, e:
+                errors.append(e)
+        thread = threading.Thread(target=wait_for_connection)
+        thread.start()
+        time.sleep(0.1)
+        self.pool.destroy()
+        thread.join()
+        self.assertEquals(len(errors), 1)
+        self.assertEquals(len(self.pool.all_connections), 0)
+
+    def test_stats(self):
+        connection1 = self.pool.get_connection()
+        connection2 = self.pool.get_connection()
+        self.pool.release_connection(connection1)
+        self.pool.release_connection(connection2)
+        stats = self.pool.get_stats()
+        # the constructor checks out 1 connection for its setup work
+        self.assertEquals(stats['checkouts'], 3)
+        self.assertEquals(stats['peak_checked_out'], 2)
+        self.assertEquals(stats['checked_out'], 0)
+        self.pool.reset_stats()
+        self.assertEquals(self.pool.get_stats()['checkouts'], 0)
+
+    def get_cache_size(self, connection):
+        return connection.execute("PRAGMA cache_size").fetchone()[0]
+
+    def test_pragmas(self):
+        self.pool.destroy()
+        self.pool = connectionpool.ConnectionPool(
+            self.db_path, pragmas=[('cache_size', 1234)])
+        connection = self.pool.get_connection()
+        self.assertEquals(self.get_cache_size(connection), 1234)
+        self.pool.release_connection(connection)
+        # set_pragmas() should change connections in the pool
+        self.pool.set_pragmas([('cache_size', 4321)])
+        connection = self.pool.get_connection()
+        self.assertEquals(self.get_cache_size(connection), 4321)
@@ -1,12 +1,16 @@
 import os
 import unittest
+from StringIO import StringIO
 from time import sleep
 
 from miro import app
 from miro import prefs
 from miro import dialogs
+from miro import feed
+from miro import feeddiff
+from miro import feedupdate
 from miro import feedparserutil
-from miro.item import Item
+from miro.item import Item, FeedParserValues
 from miro.feed import validate_feed_url, normalize_feed_url, Feed
 
 from miro.test.framework import MiroTestCase, EventLoopTest
@@ -203,6 +207,19 @@ Instead, astronauts have other options.</description>
         self.assertEqual(len(items), 1)
         my_feed.remove()
 
+    def test_unchanged_body(self):
+        feed.reset_update_stats()
+        my_feed = self.make_feed()
+        self.assertEqual(feed.get_update_stats()['body_unchanged'], 0)
+        # updating again with the same body should skip parsing
+        self.update_feed(my_feed)
+        stats = feed.get_update_stats()
+        self.assertEqual(stats['fetched'], 2)
+        self.assertEqual(stats['body_unchanged'], 1)
+        self.assertEqual(stats['skip_rate'], 0.5)
+        self.assertEqual(len(list(Item.make_view())), 1)
+        my_feed.remove()
+
 class EnclosureFeedTestCase(FeedTestCase):
     def setUp(self):
         FeedTestCase.setUp(self)
@@ -461,5 +478,186 @@ by-nd/1.0</creativeCommons:license>
         self.save_then_restore_db()
         self.assertEquals(self.item.get_rss_id(), None)
 
+    def test_feedparser_hash(self):
+        fp_values = FeedParserValues(self.parsed_feed.entries[0])
+        self.assertEquals(self.item.feedparser_hash, fp_values.calc_hash())
+
+    def test_feed_diff_unchanged(self):
+        index = self.feed.actualFeed.make_entry_index()
+        diff = feeddiff.calc_feed_diff(self.parsed_feed, index)
+        self.assertEquals(diff.entry_count, 1)
+        self.assertEquals(diff.new_entries, [])
+        self.assertEquals(diff.changed_entries, [])
+        self.assertEquals(diff.vanished_ids, set())
+
+    def test_feed_diff_for_file(self):
+        index = self.feed.actualFeed.make_entry_index()
+        diff = feeddiff.calc_feed_diff_for_file(self.filename, index)
+        self.assertEquals(diff.entry_count, 1)
+        self.assertEquals(diff.new_entries, [])
+        self.assertEquals(diff.changed_entries, [])
+        self.assertEquals(diff.vanished_ids, set())
+        self.assertEquals(diff.complete, True)
+        self.assertEquals(diff.parsed.feed.title, u'Downhill Battle Pics')
+
+    def test_entry_index_tracks_items(self):
+        # make_entry_index() should build the index once, after that item
+        # changes update it.
+        index = self.feed.actualFeed.make_entry_index()
+        self.assertEquals(index.hashes.keys(), [self.item.id])
+        self.item.feedparser_hash = u'abc'
+        self.item.signal_change()
+        self.assertEquals(index.hashes[self.item.id], u'abc')
+        self.item.remove()
+        self.assert_(self.feed.actualFeed.make_entry_index() is index)
+        self.assertEquals(index.hashes, {})
+        self.assertEquals(index.by_rss_id, {})
+        self.assertEquals(index.by_url_title, {})
+        # the entry should be new again.  We don't send the feedparser entry
+        # back with it.
+        diff = feeddiff.calc_feed_diff(self.parsed_feed, index)
+        self.assertEquals(len(diff.new_entries), 1)
+        self.assertEquals(diff.new_entries[0].entry, None)
+
+    def test_feed_diff_for_file_stop_early(self):
+        index = self.feed.actualFeed.make_entry_index()
+        diff = feeddiff.calc_feed_diff_for_file(self.filename, index,
+                                                stop_after_known=1)
+        self.assertEquals(diff.complete, False)
+        # since we didn't see the whole feed, we can't tell if anything
+        # vanished
+        self.assertEquals(diff.vanished_ids, set())
+
+    def test_update_changed_entry(self):
+        # The rss_id stays the same, but the title changes.  The item's
+        # feedparser_hash won't match, so it should get updated.
+        content = open(self.filename).read()
+        self.write_file(content.replace('Bumper Sticker', 'New Title'))
+        self.update_feed(self.feed)
+        self.item = Item.make_view().get_singleton()
+        self.assertEquals(self.item.get_title(), u'New Title')
+        fp_values = FeedParserValues(
+            feedparserutil.parse(self.filename).entries[0])
+        self.assertEquals(self.item.feedparser_hash, fp_values.calc_hash())
+
+    def test_change_rate_saved(self):
+        # our estimate of how often the feed changes should survive a restart
+        feedupdate.record_update_result(self.feed, False)
+        change_rate = self.feed.change_rate
+        self.assert_(change_rate < 1.0)
+        self.save_then_restore_db()
+        self.assertEquals(self.feed.change_rate, change_rate)
+
+class FeedSplitterTest(MiroTestCase):
+    def split(self, content, batch_size):
+        splitter = feeddiff.FeedSplitter(StringIO(content), batch_size)
+        # use a small chunk size so entries get split across chunks
+        splitter.CHUNK_SIZE = 7
+        return list(splitter)
+
+    def test_split(self):
+        items = ''.join('<item><title>%d</title></item>' % i
+                        for i in range(5))
+        content = ('<?xml version="1.0"?><rss><channel><title>t</title>%s'
+                   '<item/></channel></rss>' % items)
+        header = '<?xml version="1.0"?><rss><channel><title>t</title>'
+        footer = '</channel></rss>'
+        self.assertEquals(self.split(content, 2), [
+            header + '<item><title>0</title></item>'
+            '<item><title>1</title></item>' + footer,
+            header + '<item><title>2</title></item>'
+            '<item><title>3</title></item>' + footer,
+            header + '<item><title>4</title></item><item/>' + footer,
+        ])
+        for document in self.split(content, 2):
+            self.assertEquals(feedparserutil.parse(document).feed.title,
+                              u't')
+
+    def test_atom(self):
+        content = ('<feed xmlns="http://www.w3.org/2005/Atom"><title>a</title>'
+                   '<entry><id>1</id></entry>\n<entry><id>2</id></entry>'
+                   '</feed>')
+        self.assertEquals(self.split(content, 5), [
+            '<feed xmlns="http://www.w3.org/2005/Atom"><title>a</title>'
+            '<entry><id>1</id></entry><entry><id>2</id></entry></feed>'])
+
+    def test_no_entries(self):
+        content = '<rss><channel><title>t</title></channel></rss>'
+        self.assertEquals(self.split(content, 5), [content])
+
+    def test_bad_xml(self):
+        content = '<rss><channel><item>&nbsp;</item></channel></rss>'
+        self.assertRaises(feeddiff.FeedSplitError, self.split, content, 5)
+
+class FakeUpdateFeed(object):
+    def __init__(self, id_, url):
+        self.id = id_
+        self.url = url
+        self.change_rate = 1.0
+
+    def set_change_rate(self, change_rate):
+        self.change_rate = change_rate
+
+    def get_url(self):
+        return self.url
+
+    def get_title(self):
+        return self.url
+
+    def id_exists(self):
+        return True
+
+    def connect(self, name, callback):
+        return (name, callback)
+
+    def disconnect(self, handle):
+        pass
+
+class FeedUpdateQueueTest(EventLoopTest):
+    def setUp(self):
+        EventLoopTest.setUp(self)
+        app.config.set(prefs.MAX_FEED_UPDATES, 3)
+        self.queue = feedupdate.FeedUpdateQueue()
+        self.started = []
+
+    def queue_update(self, feed):
+        self.queue.update_queue.append(
+            (feed, lambda: self.started.append(feed), 0))
+
+    def test_backoff(self):
+        feed = FakeUpdateFeed(1, u'http://example.com/feed')
+        self.assertEquals(self.queue.calc_periodic_delay(60, feed), 60)
+        for i in xrange(20):
+            self.queue.record_update_result(feed, False)
+        max_delay = 60 * feedupdate.MAX_BACKOFF
+        self.assertEquals(self.queue.calc_periodic_delay(60, feed), max_delay)
+        # once the feed changes, we should start updating it more often
+        self.queue.record_update_result(feed, True)
+        self.assert_(self.queue.calc_periodic_delay(60, feed) < max_delay)
+
+    def test_host_limit(self):
+        feeds = [FakeUpdateFeed(i, u'http://example.com/feed%d' % i)
+                 for i in range(3)]
+        other = FakeUpdateFeed(3, u'http://example.org/feed')
+        for feed in feeds + [other]:
+            self.queue_update(feed)
+        self.queue.run_update_queue()
+        # only 2 feeds from example.com can update at once
+        self.assertEquals(self.started, [feeds[0], feeds[1], other])
+        self.assertEquals(self.queue.get_stats()['queue_depth'], 1)
+        self.queue.update_finished(feeds[0])
+        self.queue.run_update_queue()
+        self.assertEquals(self.started, [feeds[0], feeds[1], other, feeds[2]])
+        self.assertEquals(self.queue.get_stats()['update_lag']['count'], 4)
+
+    def test_global_limit(self):
+        app.config.set(prefs.MAX_FEED_UPDATES, 1)
+        feeds = [FakeUpdateFeed(i, u'http://example.com/feed%d' % i)
+                 for i in range(2)]
+        for feed in feeds:
+            self.queue_update(feed)
+        self.queue.run_update_queue()
+        self.assertEquals(self.started, [feeds[0]])
+
 if __name__ == "__main__":
     unittest.main()
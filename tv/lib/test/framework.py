@@ -285,6 +285,7 @@ class MiroTestCase(unittest.TestCase):
         app.in_unit_tests = True
         app.device_manager = devices.DeviceManager()
         models.Item._path_count_tracker.reset()
+        models.Item.entry_index_tracker.reset()
         testobjects.test_started(self)
         # Tweak Item to allow us to make up fake paths for FileItems
         models.Item._allow_nonexistent_paths = True
@@ -360,8 +361,7 @@ class MiroTestCase(unittest.TestCase):
         self.destroy_connection_pools()
         # shutdown workerprocess if we started it for some reason.
         workerprocess.shutdown()
-        workerprocess._subprocess_manager = \
-                workerprocess.WorkerSubprocessManager()
+        workerprocess._worker_pool = workerprocess.WorkerProcessPool()
         workerprocess._miro_task_queue.reset()
         self.reset_log_filter()
         signals.system.disconnect_all()
@@ -538,6 +538,7 @@ class MiroTestCase(unittest.TestCase):
 
     def reload_database(self, path=':memory:', upgrade=True, **kwargs):
         self.shutdown_database()
+        models.Item.entry_index_tracker.reset()
         self.setup_new_database(path, **kwargs)
         if upgrade:
             if self.allow_db_upgrade_error_dialog:
@@ -569,8 +570,7 @@ class MiroTestCase(unittest.TestCase):
         app.db_error_handler = mock.Mock()
 
     def clear_ddb_object_cache(self):
-        app.db._ids_loaded = set()
-        app.db._object_map = {}
+        app.db.forget_all_objects()
         app.db.cache = storedatabase.DatabaseObjectCache()
 
     def setup_new_database(self, path, **kwargs):
@@ -591,7 +591,6 @@ class MiroTestCase(unittest.TestCase):
         # force an object to be reloaded from the databas.
         key = (obj.id, app.db.table_name(obj.__class__))
         del app.db._object_map[key]
-        app.db._ids_loaded.remove(key)
         return obj.__class__.get_by_id(obj.id)
 
     def handle_error(self, obj, report):
@@ -705,12 +704,12 @@ class EventLoopTest(MiroTestCase):
         eventloop.add_idle(function, name, args=None, kwargs=None)
 
     def hasIdles(self):
-        return not (eventloop._eventloop.idle_queue.queue.empty() and
-                    eventloop._eventloop.urgent_queue.queue.empty())
+        return (eventloop._eventloop.idle_queue.has_pending_idle() or
+                eventloop._eventloop.urgent_queue.has_pending_idle())
 
     def processThreads(self):
         eventloop._eventloop.threadpool.init_threads()
-        while not eventloop._eventloop.threadpool.queue.empty():
+        while eventloop._eventloop.threadpool.has_pending_calls():
             sleep(0.05)
         eventloop._eventloop.threadpool.close_threads()
 
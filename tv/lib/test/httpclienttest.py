@@ -12,6 +12,7 @@ from miro import eventloop
 from miro import httpauth
 from miro import httpclient
 from miro import signals
+from miro import util
 from miro.plat import resources
 from miro.test import mock
 from miro.test.framework import EventLoopTest, uses_httpclient
@@ -23,9 +24,7 @@ TEST_PATH = 'test.txt'
 def uses_mock_httpclient(fun):
     def _uses_mock_httpclient(self):
         self.mocked_multi = httpclient.curl_manager.multi = mock.Mock()
-        self.mocked_multi.timeout.return_value = -1
-        self.mocked_multi.fdset.return_value = ([], [], [])
-        self.mocked_multi.perform.return_value = (None, None)
+        self.mocked_multi.socket_action.return_value = (None, None)
         return fun(self)
     wrapped = functools.update_wrapper(_uses_mock_httpclient, fun)
     return uses_httpclient(wrapped)
@@ -79,12 +78,98 @@ class HTTPClientTestBase(EventLoopTest):
         fp.write(self.test_response_data[:bytes])
         fp.close()
 
+class SocketPollerTest(EventLoopTest):
+    def check_poller(self, poller):
+        sender, receiver = util.make_dummy_socket_pair()
+        fd = receiver.fileno()
+        poller.set_events(fd, True, False)
+        self.assertEquals(poller.poll(0), [])
+        sender.send("a")
+        self.assertEquals(poller.poll(0), [(fd, True, False, False)])
+        poller.set_events(fd, True, True)
+        self.assertEquals(poller.poll(0), [(fd, True, True, False)])
+        poller.set_events(fd, False, False)
+        self.assertEquals(poller.poll(0), [])
+        poller.close()
+        sender.close()
+        receiver.close()
+
+    def test_select_poller(self):
+        self.check_poller(httpclient.SelectSocketPoller())
+
+    def test_epoll_poller(self):
+        if not hasattr(httpclient.select, 'epoll'):
+            return
+        self.check_poller(httpclient.EPollSocketPoller())
+
+class CurlHandlePoolTest(EventLoopTest):
+    def test_reuse(self):
+        # reused handles keep their share, getting one from the pool
+        # shouldn't try to set it again
+        pool = httpclient.CurlHandlePool()
+        handle = pool.get()
+        pool.release(handle)
+        self.assert_(pool.get() is handle)
+        self.assertEquals(pool.handles_created, 1)
+        self.assertEquals(pool.handles_reused, 1)
+        pool.release(handle)
+        pool.close()
+
+class CheckFinishedTest(EventLoopTest):
+    # Test that LibCURLManager.check_finished() gives handles back to the
+    # pool, even when the transfer callbacks fail
+    def setUp(self):
+        EventLoopTest.setUp(self)
+        self.manager = httpclient.LibCURLManager()
+        self.manager.multi = mock.Mock()
+        self.manager.handle_pool = mock.Mock()
+        self.handle = mock.Mock()
+        self.handle.getinfo.return_value = 0
+        self.transfer = mock.Mock()
+        self.manager.transfer_map[self.handle] = self.transfer
+
+    def tearDown(self):
+        self.manager.poller.close()
+        EventLoopTest.tearDown(self)
+
+    def check_handle_released(self):
+        self.assertEquals(self.manager.transfer_map, {})
+        self.manager.handle_pool.release.assert_called_once_with(self.handle)
+
+    def test_on_finished_error(self):
+        self.manager.multi.info_read.return_value = (0, [self.handle], [])
+        self.transfer.on_finished.side_effect = ValueError()
+        with self.allow_warnings():
+            self.manager.check_finished()
+        self.check_handle_released()
+
+    def test_on_error_error(self):
+        self.manager.multi.info_read.return_value = (
+            0, [], [(self.handle, pycurl.E_COULDNT_CONNECT, 'error')])
+        self.transfer.on_error.side_effect = ValueError()
+        with self.allow_warnings():
+            self.manager.check_finished()
+        self.check_handle_released()
+
 class HTTPClientTest(HTTPClientTestBase):
     @uses_httpclient
     def test_simple_get(self):
         self.grab_url(self.httpserver.build_url('test.txt'))
         self.assertEquals(self.grab_url_info['body'], self.test_response_data)
 
+    @uses_httpclient
+    def test_handle_reuse(self):
+        # the second transfer should reuse the handle from the first one
+        self.grab_url(self.httpserver.build_url('test.txt'))
+        self.grab_url(self.httpserver.build_url('test.txt'))
+        self.assertEquals(self.grab_url_info['body'], self.test_response_data)
+        self.wait_for_libcurl_manager()
+        stats = httpclient.get_connection_stats()
+        self.assertEquals(stats['handles_created'], 1)
+        self.assertEquals(stats['handles_reused'], 1)
+        self.assertEquals(stats['new_connections'] +
+                          stats['reused_connections'], 2)
+
     @uses_httpclient
     def test_file_get(self):
         path = resources.path("testdata/httpserver/test.txt")
@@ -36,6 +36,7 @@ import string
 import weakref
 
 from miro import app
+from miro import item
 from miro import messages
 from miro import models
 from miro import util
@@ -244,6 +245,26 @@ class ItemListTest(MiroTestCase):
             self.assertEquals(group_info[1], 1)
             self.assertEquals(group_info[2], list_items[i])
 
+    def test_prioritize_metadata(self):
+        # When rows get loaded for display, we should ask the backend to
+        # prioritize metadata for items with files that don't have it yet
+        # reload the metadata manager since init_data_package() created a new
+        # DB
+        item.setup_metadata_manager(self.tempdir)
+        file_items = [testobjects.make_file_item(self.feed, u'file-%s' % i)
+                      for i in xrange(2)]
+        file_items[1].duration = 1000
+        file_items[1].signal_change()
+        self.refresh_item_list()
+        self.get_backend_messages()
+        self.item_list.get_row(0)
+        msg_list = self.get_backend_messages()
+        self.assertEquals(len(msg_list), 1)
+        self.assertEquals(msg_list[0].item_ids, [file_items[0].id])
+        # once the rows are loaded, we shouldn't send the message again
+        self.item_list.get_row(0)
+        self.assertEquals(self.get_backend_messages(), [])
+
 class TestItemListPool(MiroTestCase):
     def setUp(self):
         MiroTestCase.setUp(self)
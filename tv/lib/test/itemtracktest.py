@@ -310,7 +310,8 @@ class ItemTrackTestWALMode(ItemTrackTestCase):
                     cmp_val *= -1
                 if cmp_val != 0:
                     return cmp_val
-            return 0
+            # ItemTracker uses id to break ties
+            return cmp(item1.id, item2.id)
         item_list.sort(cmp=cmp_func)
 
     def test_initial_list(self):
@@ -330,6 +331,23 @@ class ItemTrackTestWALMode(ItemTrackTestCase):
             self.assertNotEquals(row, None)
         self.check_tracker_items()
 
+    def test_playables(self):
+        # None of our items have files, so none should be playable
+        self.assertEquals(self.tracker.get_playable_ids(), [])
+        self.assertEquals(self.tracker.has_playables(), False)
+        playable_items = self.tracked_items[:3]
+        for i in playable_items:
+            i.filename = self.make_temp_path('.avi')
+            i.file_type = u'video'
+            i.signal_change()
+        self.process_items_changed_messages()
+        # we haven't fetched all the rows yet, so this will use the
+        # ItemFetcher to calculate the playable items
+        self.assert_(self.tracker.idle_work_scheduled)
+        self.assertSameSet(self.tracker.get_playable_ids(),
+                           [i.id for i in playable_items])
+        self.assertEquals(self.tracker.has_playables(), True)
+
     def check_items_changed_after_message(self, changed_items):
         self.process_items_changed_messages()
         signal_args = self.check_one_signal('items-changed')
@@ -350,10 +368,18 @@ class ItemTrackTestWALMode(ItemTrackTestCase):
         item2.signal_change()
         self.check_items_changed_after_message([item1, item2])
         self.check_tracker_items()
-        # test that changes to order by fields result in a list-changed
-        item1.release_date += datetime.timedelta(days=400)
+        # test that changes to order by fields result in a list-changed.
+        # Move the first item to the end and the last item to the start to
+        # ensure that the order changes
+        item1 = self.tracker.get_first_item()
+        item2 = self.tracker.get_last_item()
+        first_date = item1.release_date
+        last_date = item2.release_date
+        item1 = models.Item.get_by_id(item1.id)
+        item2 = models.Item.get_by_id(item2.id)
+        item1.release_date = last_date + datetime.timedelta(days=1)
         item1.signal_change()
-        item2.release_date += datetime.timedelta(days=400)
+        item2.release_date = first_date - datetime.timedelta(days=1)
         item2.signal_change()
         self.check_list_change_after_message()
         self.check_tracker_items()
@@ -365,6 +391,138 @@ class ItemTrackTestWALMode(ItemTrackTestCase):
         self.check_list_change_after_message()
         self.check_tracker_items()
 
+    def test_incremental_update(self):
+        # test that when only a few items change, we update the list without
+        # refetching it
+        self.tracker._refetch_for_changes = mock.Mock()
+        self.run_all_tracker_idles()
+        first_item = self.tracker.get_first_item()
+        last_item = self.tracker.get_last_item()
+        # move the first item to the end of the list
+        item1 = models.Item.get_by_id(first_item.id)
+        item1.release_date = (last_item.release_date +
+                              datetime.timedelta(days=1))
+        item1.signal_change()
+        self.check_list_change_after_message()
+        self.check_tracker_items()
+        self.assertEquals(self.tracker.id_list[-1], item1.id)
+        # change the order by column without changing the order.  This
+        # should result in items-changed
+        item1.release_date += datetime.timedelta(days=1)
+        item1.signal_change()
+        self.check_items_changed_after_message([item1])
+        self.check_tracker_items()
+        # add and remove items
+        new_item = testobjects.make_item(self.tracked_feed, u'new-item')
+        item2 = self.tracked_items[1]
+        item2.feed_id = self.other_feed1.id
+        item2.signal_change()
+        self.check_list_change_after_message()
+        self.check_tracker_items()
+        self.assert_(self.tracker.item_in_list(new_item.id))
+        self.assert_(not self.tracker.item_in_list(item2.id))
+        # none of those changes should have caused us to refetch the list
+        self.assertEquals(self.tracker._refetch_for_changes.call_count, 0)
+        # check that the playable id calculation uses the new list
+        self.assertEquals(self.tracker.item_fetcher.id_list,
+                          self.tracker.id_list)
+
+    def test_incremental_update_keeps_load_position(self):
+        # changes at the end of the list shouldn't make us check the rows
+        # before it again
+        self.run_all_tracker_idles()
+        # swap the last 2 items
+        last_item = self.tracker.get_last_item()
+        item1 = models.Item.get_by_id(
+            self.tracker.get_row(len(self.tracker) - 2).id)
+        item1.release_date = (last_item.release_date +
+                              datetime.timedelta(days=1))
+        item1.signal_change()
+        self.check_list_change_after_message()
+        self.check_tracker_items()
+        self.assertEquals(self.tracker.idle_load_pos,
+                          len(self.tracker) - 2)
+
+    def test_incremental_update_ties(self):
+        # items with the same sort key should be ordered by id
+        self.tracker._refetch_for_changes = mock.Mock()
+        release_date = self.tracker.get_first_item().release_date
+        for i in self.tracked_items[:3]:
+            i.release_date = release_date
+            i.signal_change()
+        self.process_items_changed_messages()
+        self.check_tracker_items()
+        self.assertEquals(self.tracker._refetch_for_changes.call_count, 0)
+
+    def test_incremental_update_limit(self):
+        # test that we refetch the list if too many items change
+        self.tracker._refetch_for_changes = mock.Mock(
+            wraps=self.tracker._refetch_for_changes)
+        self.tracker.INCREMENTAL_UPDATE_LIMIT = 2
+        for i in self.tracked_items[:3]:
+            i.release_date += datetime.timedelta(days=400)
+            i.signal_change()
+        self.check_list_change_after_message()
+        self.check_tracker_items()
+        self.assertEquals(self.tracker._refetch_for_changes.call_count, 1)
+
+    def make_shared_tracker(self):
+        # make a tracker with the same query as self.tracker, but add the
+        # conditions in a different order
+        query = itemtrack.ItemTrackerQuery()
+        query.set_order_by(['release_date'])
+        query.add_condition('feed_id', '=', self.tracked_feed.id)
+        return itemtrack.ItemTracker(self.idle_scheduler, query,
+                                     item.ItemSource())
+
+    def test_cache_key(self):
+        tracker2 = self.make_shared_tracker()
+        self.assertEquals(tracker2.query.cache_key(),
+                          self.tracker.query.cache_key())
+        query = tracker2.query.copy()
+        query.add_condition('watched_time', 'IS', None)
+        self.assertNotEquals(query.cache_key(),
+                             self.tracker.query.cache_key())
+        query = itemtrack.ItemTrackerQuery()
+        query.set_order_by(['release_date'])
+        query.add_condition('feed_id', '=', self.other_feed1.id)
+        self.assertNotEquals(query.cache_key(),
+                             self.tracker.query.cache_key())
+        tracker2.destroy()
+
+    def test_shared_results(self):
+        # test that ItemTrackers with the same query share a result
+        tracker2 = self.make_shared_tracker()
+        self.assert_(tracker2.result is self.tracker.result)
+        self.assert_(tracker2.item_fetcher is self.tracker.item_fetcher)
+        list_changed_handler = mock.Mock()
+        tracker2.connect('list-changed', list_changed_handler)
+        # When we get an ItemChanges message, only the first ItemTracker
+        # should re-run the query, the second should re-use the result
+        item1 = self.tracked_items[0]
+        item1.feed_id = self.other_feed1.id
+        item1.signal_change()
+        new_item = testobjects.make_item(self.tracked_feed, u'new-item')
+        msg = self.get_items_changed_message()
+        self.tracker.on_item_changes(msg)
+        self.check_one_signal('list-changed')
+        tracker2._handle_item_changes = mock.Mock()
+        tracker2.on_item_changes(msg)
+        self.assertEquals(tracker2._handle_item_changes.call_count, 0)
+        self.assertEquals(list_changed_handler.call_count, 1)
+        self.assert_(tracker2.result is self.tracker.result)
+        self.check_tracker_items()
+        self.assertEquals([i.id for i in tracker2.get_items()],
+                          [i.id for i in self.tracker.get_items()])
+        # When the last ItemTracker is destroyed, the result should be
+        # removed from the cache
+        result = self.tracker.result
+        tracker2.destroy()
+        self.assert_(result.item_fetcher is not None)
+        self.tracker.destroy()
+        self.assertEquals(result.item_fetcher, None)
+        self.assert_(result not in itemtrack.result_cache.results.values())
+
     def test_item_changes_after_finished(self):
         # test item changes after we've finished fetching all rows
         while not self.tracker.idle_work_scheduled:
@@ -95,6 +95,11 @@ class MockMetadataProcessor(object):
         else:
             raise TypeError(task)
 
+    def cancel_tasks_for_files(self, paths):
+        # cancels don't go through send() anymore, since the task queue
+        # handles them directly.  Track them the same way.
+        self.canceled_files.update(paths)
+
     def exec_codegen(self, codegen_info, path, callback, errback):
         task_data = (callback, errback)
         self.add_task_data(path, 'echonest-codegen', task_data)
@@ -160,6 +165,8 @@ class MetadataManagerTest(MiroTestCase):
         self.net_lookup_enabled = {}
         self.processor = MockMetadataProcessor()
         self.patch_function('miro.workerprocess.send', self.processor.send)
+        self.patch_function('miro.workerprocess.cancel_tasks_for_files',
+                            self.processor.cancel_tasks_for_files)
         self.patch_function('miro.echonest.exec_codegen',
                             self.processor.exec_codegen)
         self.patch_function('miro.echonest.query_echonest',
@@ -1026,6 +1033,21 @@ class MetadataManagerTest(MiroTestCase):
         self.check_path_in_system('qux.avi', True)
         self.check_path_in_system('other-file.avi', False)
 
+    def test_path_in_system_after_eviction(self):
+        # path_in_system() shouldn't depend on the status objects staying in
+        # the cache
+        app.db.cache.set_capacity('metadata', 2)
+        filenames = ['foo.avi', 'bar.avi', 'baz.mp3', 'qux.avi']
+        for filename in filenames:
+            self.check_add_file(filename)
+        self.assert_(app.db.cache.get_stats()['metadata']['evictions'] > 0)
+        for filename in filenames:
+            self.check_path_in_system(filename, True)
+            path = self.make_path(filename)
+            self.assertEquals(metadata.MetadataStatus.get_by_path(path).path,
+                              path)
+        self.check_path_in_system('other-file.avi', False)
+
     def test_path_in_system_failed_insert(self):
         # check that if the DB insert fails for some reason, then path in 
         # system returns False (#19508)
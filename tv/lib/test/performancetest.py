@@ -0,0 +1,285 @@
+# Miro - an RSS based video player application
+# Copyright (C) 2012
+# Participatory Culture Foundation
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# In addition, as a special exception, the copyright holders give
+# permission to link the code of portions of this program with the OpenSSL
+# library.
+#
+# You must obey the GNU General Public License in all respects for all of
+# the code used other than OpenSSL. If you modify file(s) with this
+# exception, you may extend this exception to your version of the file(s),
+# but you are not obligated to do so. If you do not wish to do so, delete
+# this exception statement from your version. If you delete this exception
+# statement from all source files in the program, then also delete it here.
+
+"""performancetest -- Benchmarks for performance sensitive code.
+
+These tests only get run if they are specifically named on the command line,
+for example::
+
+    ./run.sh --unittest performancetest
+
+Each test logs its timings using logging.timing().  They also check that the
+code under test actually worked, but they don't fail if things are slow.
+"""
+
+import logging
+import os
+import time
+from cStringIO import StringIO
+
+from miro import app
+from miro import data
+from miro import downloader
+from miro import feedparserutil
+from miro import filetags
+from miro import subprocessmanager
+from miro import workerprocess
+from miro.data import item
+from miro.data import itemtrack
+from miro.dl_daemon import command
+from miro.fileobject import FilenameType
+from miro.plat import resources
+from miro.test import mock
+from miro.test import testobjects
+from miro.test.framework import MiroTestCase
+
+class DownloadStatusUpdatePerformanceTest(MiroTestCase):
+    """Measure how many rows/sec we can save from download status updates.
+    """
+
+    DOWNLOAD_COUNT = 200
+    UPDATE_ROUNDS = 20
+
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.reload_database(self.make_temp_path('.sqlite'))
+        feed, items = testobjects.make_feed_with_items(self.DOWNLOAD_COUNT)
+        self.downloaders = []
+        for item in items:
+            dler = downloader.RemoteDownloader(item.url, item)
+            item.set_downloader(dler)
+            self.downloaders.append(dler)
+        app.db.finish_transaction()
+
+    def make_status(self, dler, current_size):
+        status = dler.get_status_for_downloader()
+        status['state'] = u'downloading'
+        status['total_size'] = 1000000
+        status['current_size'] = current_size
+        status['rate'] = 1000
+        status['eta'] = 10
+        return status
+
+    def run_updates(self, batch):
+        start = time.time()
+        for i in xrange(self.UPDATE_ROUNDS):
+            statuses = [self.make_status(dler, i * 1000)
+                        for dler in self.downloaders]
+            if batch:
+                command.BatchUpdateDownloadStatus(None, statuses,
+                                                  False).action()
+            else:
+                for status in statuses:
+                    downloader.RemoteDownloader.update_status(status)
+            app.db.finish_transaction()
+        return time.time() - start
+
+    def test_download_status_updates(self):
+        row_count = self.DOWNLOAD_COUNT * self.UPDATE_ROUNDS
+        for batch in (False, True):
+            total_time = self.run_updates(batch)
+            logging.timing("download status updates (batch=%s): "
+                           "%d rows in %0.3f seconds (%0.1f rows/sec)",
+                           batch, row_count, total_time,
+                           row_count / total_time)
+        last_size = (self.UPDATE_ROUNDS - 1) * 1000
+        for dler in self.downloaders:
+            self.assertEquals(self.reload_object(dler).current_size,
+                              last_size)
+
+class ItemTablePerformanceTest(MiroTestCase):
+    """Base class for tests that need a big item table and an ItemTracker to
+    read it with.
+    """
+
+    ITEM_COUNTS = (10000, 100000, 500000)
+
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.init_data_package()
+        self.feed, items = testobjects.make_feed_with_items(10)
+        app.db.finish_transaction()
+        self.connection_pool = app.connection_pools.get_main_pool()
+
+    def resize_item_table(self, item_count):
+        """Copy or delete rows in the item table until we have exactly
+        item_count of them.
+
+        This is much faster than creating Item objects one at a time.
+        """
+        cursor = app.db.cursor
+        cursor.execute("PRAGMA table_info(item)")
+        columns = [row[1] for row in cursor.fetchall()]
+        select_columns = ['id + ?' if c == 'id' else c for c in columns]
+        sql = "INSERT INTO item (%s) SELECT %s FROM item LIMIT ?" % (
+            ', '.join(columns), ', '.join(select_columns))
+        while True:
+            cursor.execute("SELECT COUNT(*), MAX(id) FROM item")
+            count, max_id = cursor.fetchone()
+            if count >= item_count:
+                break
+            cursor.execute(sql, (max_id, item_count - count))
+        if count > item_count:
+            cursor.execute("DELETE FROM item WHERE id NOT IN "
+                           "(SELECT id FROM item ORDER BY id LIMIT ?)",
+                           (item_count,))
+        app.db.connection.commit()
+
+    def run_tracker(self, item_count):
+        idle_scheduler = mock.Mock()
+        query = itemtrack.ItemTrackerQuery()
+        query.add_condition('feed_id', '=', self.feed.id)
+        query.set_order_by(['release_date'])
+        start = time.time()
+        tracker = itemtrack.ItemTracker(idle_scheduler, query,
+                                        item.ItemSource())
+        create_time = time.time() - start
+        start = time.time()
+        # fetch the first rows, like the frontend would when displaying
+        # the list
+        for i in xrange(min(50, len(tracker))):
+            tracker.get_row(i)
+        first_rows_time = time.time() - start
+        start = time.time()
+        while idle_scheduler.call_count > 0:
+            args, kwargs = idle_scheduler.call_args
+            idle_scheduler.reset_mock()
+            args[0]()
+        load_time = time.time() - start
+        logging.timing("ItemTracker with %d items: create: %0.3f "
+                       "first rows: %0.3f load all: %0.3f", item_count,
+                       create_time, first_rows_time, load_time)
+        self.assertEquals(len(tracker), item_count)
+        tracker.destroy()
+
+class ItemTrackerPerformanceTest(ItemTablePerformanceTest):
+    """Measure how long it takes to create an ItemTracker and load its rows
+    for large item lists.
+    """
+
+    def test_item_tracker(self):
+        for wal_mode in (True, False):
+            self.connection_pool.wal_mode = wal_mode
+            for item_count in self.ITEM_COUNTS:
+                self.resize_item_table(item_count)
+                logging.timing("wal_mode: %s", wal_mode)
+                self.run_tracker(item_count)
+
+class StartupPerformanceTest(ItemTablePerformanceTest):
+    """Measure how long it takes to open the database and display the first
+    rows of an item list for different database sizes.
+
+    This is what the storagetuning profiles are meant to speed up.
+    """
+
+    def reopen_database(self):
+        start = time.time()
+        self.reload_database(FilenameType(self.db_path))
+        app.db.finish_transaction()
+        open_time = time.time() - start
+        start = time.time()
+        for pool in app.connection_pools.get_all_pools():
+            pool.destroy()
+        data.init(self.db_path)
+        self.connection_pool = app.connection_pools.get_main_pool()
+        pool_time = time.time() - start
+        logging.timing("open database: %0.3f connection pool: %0.3f "
+                       "(%s profile)", open_time, pool_time,
+                       self.connection_pool.tuning_profile.name)
+
+    def test_startup(self):
+        for item_count in self.ITEM_COUNTS:
+            self.resize_item_table(item_count)
+            self.reopen_database()
+            self.run_tracker(item_count)
+
+class SubprocessPipePerformanceTest(MiroTestCase):
+    """Measure how fast we can send worker process results over a pipe.
+
+    Compares the old protocol 0 pickles with PICKLE_PROTOCOL.
+    """
+
+    ROUNDS = 20
+
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.old_protocol = subprocessmanager.PICKLE_PROTOCOL
+
+    def tearDown(self):
+        subprocessmanager.PICKLE_PROTOCOL = self.old_protocol
+        MiroTestCase.tearDown(self)
+
+    def feedparser_results(self):
+        feed_dir = resources.path("testdata/feedparsertests/feeds")
+        results = []
+        for filename in sorted(os.listdir(feed_dir)):
+            parsed = feedparserutil.parse(os.path.join(feed_dir, filename))
+            parsed['bozo_exception'] = None
+            results.append(workerprocess.TaskResult(len(results), parsed))
+        return results
+
+    def mutagen_results(self):
+        metadata_dir = resources.path("testdata/metadata")
+        cover_art_dir = self.make_temp_dir_path()
+        results = []
+        for filename in sorted(os.listdir(metadata_dir)):
+            path = os.path.join(metadata_dir, filename)
+            metadata = filetags.process_file(path, cover_art_dir)
+            results.append(workerprocess.TaskResult(len(results), metadata))
+        return results
+
+    def run_pipe(self, name, results):
+        for protocol in (0, self.old_protocol):
+            subprocessmanager.PICKLE_PROTOCOL = protocol
+            pipe = StringIO()
+            start = time.time()
+            for i in xrange(self.ROUNDS):
+                for result in results:
+                    subprocessmanager._dump_obj(result, pipe)
+            dump_time = time.time() - start
+            byte_count = pipe.tell()
+            pipe.seek(0)
+            start = time.time()
+            for i in xrange(self.ROUNDS):
+                for result in results:
+                    loaded = subprocessmanager._load_obj(pipe)
+            load_time = time.time() - start
+            self.assertEquals(loaded.result, results[-1].result)
+            message_count = self.ROUNDS * len(results)
+            logging.timing("%s (protocol %s): %d messages, %d bytes, "
+                           "dump: %0.3f load: %0.3f (%0.1f messages/sec)",
+                           name, protocol, message_count, byte_count,
+                           dump_time, load_time,
+                           message_count / (dump_time + load_time))
+
+    def test_feedparser_results(self):
+        self.run_pipe("feedparser results", self.feedparser_results())
+
+    def test_mutagen_results(self):
+        self.run_pipe("mutagen results", self.mutagen_results())
@@ -57,3 +57,268 @@ class SchedulerTest(EventLoopTest):
         self.runEventLoop()
         totalCalls = len(timeouts) * threadCount + 1
         self.assertEquals(len(self.got_args), totalCalls)
+
+class CallQueueTest(EventLoopTest):
+    def setUp(self):
+        EventLoopTest.setUp(self)
+        self.wakeup_count = 0
+        self.calls = []
+        self.queue = eventloop.CallQueue('idle', self.wakeup)
+
+    def wakeup(self):
+        self.wakeup_count += 1
+
+    def callback(self, *args):
+        self.calls.append(args)
+
+    def test_wakeup_from_other_thread(self):
+        # every call from outside the event loop thread needs a wakeup,
+        # even if the queue isn't empty
+        self.queue.add_idle(self.callback, 'foo')
+        self.queue.add_idle(self.callback, 'foo')
+        self.assertEquals(self.wakeup_count, 2)
+
+    def test_no_wakeup_in_loop_thread(self):
+        self.queue.in_loop_thread = lambda: True
+        self.queue.add_idle(self.callback, 'foo')
+        self.queue.add_idle(self.callback, 'foo')
+        self.assertEquals(self.wakeup_count, 0)
+
+    def test_coalesce(self):
+        dc = self.queue.add_idle(self.callback, 'foo', args=(1,),
+                                 coalesce_key='foo')
+        dc2 = self.queue.add_idle(self.callback, 'foo', args=(2,),
+                                  coalesce_key='foo')
+        self.queue.add_idle(self.callback, 'bar', args=(3,),
+                            coalesce_key='bar')
+        self.assert_(dc is dc2)
+        self.assertEquals(self.queue.coalesced_count, 1)
+        self.queue.process_idles()
+        self.assertEquals(self.calls, [(2,), (3,)])
+        # once the call runs, we should be able to schedule it again
+        self.queue.add_idle(self.callback, 'foo', args=(4,),
+                            coalesce_key='foo')
+        self.queue.process_idles()
+        self.assertEquals(self.calls, [(2,), (3,), (4,)])
+
+    def test_coalesce_canceled(self):
+        dc = self.queue.add_idle(self.callback, 'foo', args=(1,),
+                                 coalesce_key='foo')
+        dc.cancel()
+        dc2 = self.queue.add_idle(self.callback, 'foo', args=(2,),
+                                  coalesce_key='foo')
+        self.assert_(dc is not dc2)
+        self.queue.process_idles()
+        self.assertEquals(self.calls, [(2,)])
+
+    def test_canceled_calls_skipped(self):
+        dc = self.queue.add_idle(self.callback, 'foo', args=(1,))
+        self.queue.add_idle(self.callback, 'foo', args=(2,))
+        dc.cancel()
+        self.queue.process_next_idle()
+        self.assertEquals(self.calls, [(2,)])
+        self.assert_(not self.queue.has_pending_idle())
+
+    def test_idle_time_budget(self):
+        def slow_callback():
+            self.calls.append(())
+            sleep(0.03)
+        for i in range(10):
+            eventloop.add_idle(slow_callback, 'slow')
+        loop = eventloop._eventloop
+        old_budget = loop.IDLE_TIME_BUDGET
+        loop.IDLE_TIME_BUDGET = 0.05
+        try:
+            for event in loop.generate_events([], []):
+                event()
+        finally:
+            loop.IDLE_TIME_BUDGET = old_budget
+        self.assert_(len(self.calls) < 10)
+        self.assert_(loop.idle_queue.has_pending_idle())
+        self.assertEquals(loop.calc_timeout(), 0)
+        self.runPendingIdles()
+        self.assertEquals(len(self.calls), 10)
+
+class ThreadPoolTest(EventLoopTest):
+    def setUp(self):
+        EventLoopTest.setUp(self)
+        self.results = []
+        self.pool = eventloop.ThreadPool(eventloop._eventloop)
+        self.pool.init_threads()
+
+    def tearDown(self):
+        self.pool.close_threads()
+        EventLoopTest.tearDown(self)
+
+    def callback(self, result):
+        self.results.append(result)
+
+    def errback(self, error):
+        self.results.append(('error', error.__class__))
+
+    def wait_for_results(self, count):
+        for i in xrange(100):
+            self.runPendingIdles()
+            if len(self.results) >= count:
+                return
+            sleep(0.05)
+        raise AssertionError("timed out waiting for thread pool results")
+
+    def wait_for_running(self, priority, count):
+        for i in xrange(100):
+            if self.pool.get_stats()['running'][priority] >= count:
+                return
+            sleep(0.05)
+        raise AssertionError("timed out waiting for thread pool calls")
+
+    def test_callbacks(self):
+        self.pool.queue_call(self.callback, self.errback, lambda: 'foo',
+                             'foo')
+        self.pool.queue_call(self.callback, self.errback, lambda: 1 / 0,
+                             'bar')
+        self.wait_for_results(2)
+        self.assertEquals(sorted(self.results),
+                          sorted(['foo', ('error', ZeroDivisionError)]))
+
+    def test_priority_limits(self):
+        # fill up the slots for low priority calls, high priority calls
+        # should still run.
+        event = threading.Event()
+        low_limit = self.pool.PRIORITY_LIMITS[eventloop.THREAD_PRIORITY_LOW]
+        for i in xrange(low_limit + 2):
+            self.pool.queue_call_with_priority(eventloop.THREAD_PRIORITY_LOW,
+                                               self.callback, self.errback,
+                                               event.wait, 'low', 5)
+        self.pool.queue_call_with_priority(eventloop.THREAD_PRIORITY_HIGH,
+                                           self.callback, self.errback,
+                                           lambda: 'high', 'high')
+        self.wait_for_results(1)
+        self.assertEquals(self.results, ['high'])
+        self.wait_for_running(eventloop.THREAD_PRIORITY_LOW, low_limit)
+        stats = self.pool.get_stats()
+        self.assertEquals(stats['running'][eventloop.THREAD_PRIORITY_LOW],
+                          low_limit)
+        self.assertEquals(stats['queued'][eventloop.THREAD_PRIORITY_LOW], 2)
+        event.set()
+        self.wait_for_results(low_limit + 3)
+
+    def test_cancel(self):
+        event = threading.Event()
+        low_limit = self.pool.PRIORITY_LIMITS[eventloop.THREAD_PRIORITY_LOW]
+        for i in xrange(low_limit):
+            self.pool.queue_call_with_priority(eventloop.THREAD_PRIORITY_LOW,
+                                               self.callback, self.errback,
+                                               event.wait, 'low', 5)
+        call = self.pool.queue_call_with_priority(
+            eventloop.THREAD_PRIORITY_LOW, self.callback, self.errback,
+            lambda: 'canceled', 'canceled')
+        self.wait_for_running(eventloop.THREAD_PRIORITY_LOW, low_limit)
+        self.assert_(self.pool.has_pending_calls())
+        call.cancel()
+        self.assertEquals(self.pool.get_stats()['queued'][
+            eventloop.THREAD_PRIORITY_LOW], 0)
+        event.set()
+        self.wait_for_results(low_limit)
+        sleep(0.1)
+        self.runPendingIdles()
+        self.assert_('canceled' not in self.results)
+
+    def test_max_threads(self):
+        event = threading.Event()
+        for i in xrange(self.pool.MAX_THREADS * 2):
+            self.pool.queue_call(self.callback, self.errback, event.wait,
+                                 'wait', 5)
+        sleep(0.1)
+        stats = self.pool.get_stats()
+        self.assert_(stats['threads'] <= self.pool.MAX_THREADS)
+        event.set()
+        self.wait_for_results(self.pool.MAX_THREADS * 2)
+
+class EventLoopStatsTest(EventLoopTest):
+    def setUp(self):
+        EventLoopTest.setUp(self)
+        # run any idles that setUp scheduled, so they don't end up in our
+        # stats.
+        self.runPendingIdles()
+        eventloop.reset_stats()
+
+    def tearDown(self):
+        eventloop.reset_stats()
+        EventLoopTest.tearDown(self)
+
+    def slow_callback(self):
+        sleep(0.02)
+
+    def test_callback_stats(self):
+        eventloop.add_idle(self.slow_callback, "slow")
+        eventloop.add_idle(self.slow_callback, "slow")
+        eventloop.add_idle(lambda: None, "fast")
+        self.runPendingIdles()
+        stats = eventloop.get_callback_stats()
+        self.assertEquals([s.name for s in stats],
+                          ['idle (slow)', 'idle (fast)'])
+        self.assertEquals(stats[0].count, 2)
+        self.assert_(stats[0].total_time >= 0.04)
+        self.assert_(stats[0].max_time >= 0.02)
+        self.assert_(stats[0].max_time <= stats[0].total_time)
+        self.assertEquals(len(eventloop.get_callback_stats(limit=1)), 1)
+        eventloop.reset_stats()
+        self.assertEquals(eventloop.get_callback_stats(), [])
+
+    def test_canceled_calls_not_counted(self):
+        dc = eventloop.add_idle(self.slow_callback, "slow")
+        dc.cancel()
+        self.runPendingIdles()
+        self.assertEquals(eventloop.get_callback_stats(), [])
+
+    def test_queue_stats(self):
+        eventloop.add_idle(self.slow_callback, "slow")
+        eventloop.add_idle(self.slow_callback, "slow")
+        eventloop.add_urgent_call(lambda: None, "urgent")
+        eventloop.add_timeout(0, lambda: None, "timeout")
+        self.runPendingIdles()
+        self.run_pending_timeouts()
+        queue_stats = eventloop.get_queue_stats()
+        self.assertEquals(queue_stats['idle']['count'], 2)
+        self.assertEquals(queue_stats['urgent']['count'], 1)
+        self.assertEquals(queue_stats['timeout']['count'], 1)
+        # the second idle waited for the first one to run
+        self.assert_(queue_stats['idle']['max'] >= 0.02)
+        buckets = queue_stats['idle']['buckets']
+        self.assertEquals(sum(count for bound, count in buckets), 2)
+        self.assertEquals(buckets[-1][0], None)
+
+    def test_name_limit(self):
+        old_max_names = eventloop.EventLoopStats.MAX_NAMES
+        eventloop.EventLoopStats.MAX_NAMES = 2
+        try:
+            for i in range(4):
+                eventloop.add_idle(lambda: None, "callback-%d" % i)
+            self.runPendingIdles()
+        finally:
+            eventloop.EventLoopStats.MAX_NAMES = old_max_names
+        stats = dict((s.name, s) for s in eventloop.get_callback_stats())
+        self.assertEquals(len(stats), 3)
+        self.assertEquals(
+            stats[eventloop.EventLoopStats.OVERFLOW_NAME].count, 2)
+
+    def test_histogram(self):
+        histogram = eventloop.LatencyHistogram()
+        for value in (0.0005, 0.002, 0.3, 10):
+            histogram.add(value)
+        stats = histogram.get_stats()
+        self.assertEquals(stats['count'], 4)
+        self.assertEquals(stats['max'], 10)
+        counts = dict(stats['buckets'])
+        self.assertEquals(counts[0.001], 1)
+        self.assertEquals(counts[0.005], 1)
+        self.assertEquals(counts[0.5], 1)
+        self.assertEquals(counts[None], 1)
+
+    def test_format_stats(self):
+        eventloop.add_idle(lambda: None, "foo")
+        self.runPendingIdles()
+        lines = eventloop.format_stats(eventloop.get_callback_stats(),
+                                       eventloop.get_queue_stats())
+        # header, 1 callback, 3 queues
+        self.assertEquals(len(lines), 5)
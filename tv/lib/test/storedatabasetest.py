@@ -1,4 +1,5 @@
 from datetime import datetime
+import gc
 import os
 import unittest
 import string
@@ -8,6 +9,7 @@ import time
 import sqlite3
 
 from miro import app
+from miro import containerjson
 from miro import database
 from miro import databaseupgrade
 from miro import devices
@@ -25,6 +27,7 @@ from miro import theme
 from miro.fileobject import FilenameType
 import shutil
 from miro import storedatabase
+from miro.data import storagetuning
 from miro.plat import resources
 from miro.plat.utils import PlatformFilenameType
 
@@ -548,6 +551,53 @@ class DiskTest(FakeSchemaTest):
         lee_view = Human.make_view("id=?", values=(lee.id,))
         self.assertEquals(lee_view.count(), 0)
 
+    def test_bulk_update(self):
+        new_humans = []
+        for x in range(10):
+            name = u"lee-clone-%s" % x
+            new_humans.append(Human(name, 25, 1.4, [], {}))
+        app.bulk_sql_manager.start(batch_updates=True)
+        for i, new_dude in enumerate(new_humans):
+            new_dude.age = 30 + i
+            new_dude.signal_change()
+        # nothing should be written yet
+        self.assertEquals(Human.make_view('age > 25').count(), 0)
+        app.bulk_sql_manager.finish()
+        self.db.extend(new_humans)
+        self.check_database()
+
+    def test_bulk_update_then_remove(self):
+        app.bulk_sql_manager.start(batch_updates=True)
+        self.lee.name = u'lee2'
+        self.lee.signal_change()
+        self.lee.remove()
+        # lee should be removed without raising a KeyError from trying to
+        # update a non-existent row.
+        app.bulk_sql_manager.finish()
+        self.db = [self.joe, self.ben]
+        self.check_database()
+
+    def test_bulk_update_groups_columns(self):
+        new_humans = [Human(u"clone-%s" % x, 25, 1.4, [], {})
+                      for x in range(10)]
+        app.bulk_sql_manager.start(batch_updates=True)
+        for new_dude in new_humans:
+            new_dude.age = 26
+            new_dude.signal_change()
+            # a second change to the same object should get merged with the
+            # first one
+            new_dude.name = new_dude.name + u'-changed'
+            new_dude.signal_change()
+        stats = app.db.get_statement_cache_stats()
+        app.bulk_sql_manager.finish()
+        # all the objects changed the same columns, so there should only be
+        # 1 statement fetched from the cache.
+        new_stats = app.db.get_statement_cache_stats()
+        self.assertEquals(new_stats['hits'] + new_stats['misses'],
+                          stats['hits'] + stats['misses'] + 1)
+        self.db.extend(new_humans)
+        self.check_database()
+
 class ObjectMemoryTest(FakeSchemaTest):
     def test_remove_remove_object_map(self):
         self.reload_test_database()
@@ -564,6 +614,244 @@ class ObjectMemoryTest(FakeSchemaTest):
         lee.remove()
         self.assertEquals(0, len(app.db._object_map))
 
+class LazyObjectTest(FakeSchemaTest):
+    def setUp(self):
+        FakeSchemaTest.setUp(self)
+        self.reload_database(self.save_path, schema_version=0,
+                             object_schemas=self.OBJECT_SCHEMAS,
+                             lazy_objects=True, object_map_size=2)
+
+    def test_lazy_columns(self):
+        lee = Human.get_by_id(self.lee.id)
+        self.assert_('name' in lee.__dict__)
+        self.assert_('high_scores' not in lee.__dict__)
+        self.assertEquals(lee.high_scores, {u'virtual bowling': 212})
+        self.assert_('high_scores' in lee.__dict__)
+        self.assertEquals(lee.favorite_colors, set([u'red', u'blue']))
+
+    def test_drop_restored_row(self):
+        lee = Human.get_by_id(self.lee.id)
+        restored_row = lee.__dict__['_restored_row']
+        self.assertEquals(lee.high_scores, {u'virtual bowling': 212})
+        # we shouldn't keep the database value once it's decoded
+        self.assert_('high_scores' not in restored_row.raw_values)
+        # once all columns are decoded, we shouldn't keep the row at all
+        for name in restored_row.raw_values.keys():
+            getattr(lee, name)
+        self.assert_('_restored_row' not in lee.__dict__)
+
+    def test_update(self):
+        lee = Human.get_by_id(self.lee.id)
+        lee.name = u'lee2'
+        lee.signal_change()
+        self.assert_('high_scores' not in lee.__dict__)
+        lee = self.reload_object(lee)
+        self.assertEquals(lee.name, u'lee2')
+        self.assertEquals(lee.high_scores, {u'virtual bowling': 212})
+
+    def test_evict(self):
+        for klass in (Human, RestorableHuman, PCFProgramer):
+            list(klass.make_view())
+        gc.collect()
+        stats = app.db.get_object_map_stats()
+        self.assert_(stats['evictions'] > 0)
+        self.assert_(stats['size'] <= 2)
+        # evicted objects should get reloaded when needed
+        self.assertEquals(Human.get_by_id(self.lee.id).name, u'lee')
+
+    def test_dont_evict_changed_objects(self):
+        lee = Human.get_by_id(self.lee.id)
+        lee.name = u'lee2'
+        del lee
+        for klass in (RestorableHuman, PCFProgramer):
+            list(klass.make_view())
+        gc.collect()
+        # lee has unsaved changes, so it should have stayed in memory
+        self.assertEquals(Human.get_by_id(self.lee.id).name, u'lee2')
+
+class GroupCommitTest(FakeSchemaTest):
+    def setUp(self):
+        FakeSchemaTest.setUp(self)
+        app.db.finish_transaction()
+        app.db.reset_commit_stats()
+
+    def change_name(self, obj, name):
+        obj.name = name
+        obj.signal_change()
+
+    def get_name_on_disk(self, obj):
+        table_name = app.db.table_name(obj.__class__)
+        app.db.cursor.execute("SELECT name FROM %s WHERE id=?" % table_name,
+                              (obj.id,))
+        return app.db.cursor.fetchone()[0]
+
+    def test_commit_every_event(self):
+        self.change_name(self.lee, u'lee2')
+        app.db.on_event_finished(None, True)
+        self.change_name(self.joe, u'joe2')
+        app.db.on_event_finished(None, True)
+        self.assertEquals(app.db.get_commit_stats()['commits'], 2)
+
+    def test_group_commit(self):
+        app.db.set_group_commit(60)
+        self.change_name(self.lee, u'lee2')
+        app.db.on_event_finished(None, True)
+        self.change_name(self.joe, u'joe2')
+        app.db.on_event_finished(None, True)
+        self.assertEquals(app.db.get_commit_stats()['commits'], 0)
+        app.db.finish_transaction()
+        stats = app.db.get_commit_stats()
+        self.assertEquals(stats['commits'], 1)
+        self.assertEquals(stats['statements'], 2)
+        self.assertEquals(stats['statements_per_commit'], 2.0)
+
+    def test_statement_budget(self):
+        app.db.set_group_commit(60, max_statements=2)
+        self.change_name(self.lee, u'lee2')
+        app.db.on_event_finished(None, True)
+        self.assertEquals(app.db.get_commit_stats()['commits'], 0)
+        self.change_name(self.joe, u'joe2')
+        app.db.on_event_finished(None, True)
+        self.assertEquals(app.db.get_commit_stats()['commits'], 1)
+
+    def test_time_budget(self):
+        app.db.set_group_commit(60)
+        self.change_name(self.lee, u'lee2')
+        # pretend that the transaction has been open for a while
+        app.db._transaction_start -= 120
+        app.db.on_event_finished(None, True)
+        self.assertEquals(app.db.get_commit_stats()['commits'], 1)
+
+    def test_rollback_single_event(self):
+        app.db.set_group_commit(60)
+        self.change_name(self.lee, u'lee2')
+        app.db.on_event_finished(None, True)
+        self.change_name(self.joe, u'joe2')
+        # the second event fails, only its changes should be rolled back
+        app.db.on_event_finished(None, False)
+        app.db.finish_transaction()
+        self.assertEquals(self.get_name_on_disk(self.lee), u'lee2')
+        self.assertEquals(self.get_name_on_disk(self.joe), u'joe')
+        stats = app.db.get_commit_stats()
+        self.assertEquals(stats['commits'], 1)
+        self.assertEquals(stats['rollbacks'], 1)
+
+    def test_rollback_first_event(self):
+        app.db.set_group_commit(60)
+        self.change_name(self.lee, u'lee2')
+        app.db.on_event_finished(None, False)
+        self.change_name(self.joe, u'joe2')
+        app.db.on_event_finished(None, True)
+        app.db.finish_transaction()
+        self.assertEquals(self.get_name_on_disk(self.lee), u'lee')
+        self.assertEquals(self.get_name_on_disk(self.joe), u'joe2')
+
+class StatementCacheTest(FakeSchemaTest):
+    def test_update_reuses_statement(self):
+        self.lee.name = u'lee2'
+        self.lee.signal_change()
+        stats = app.db.get_statement_cache_stats()
+        self.lee.name = u'lee3'
+        self.lee.signal_change()
+        new_stats = app.db.get_statement_cache_stats()
+        self.assertEquals(new_stats['hits'], stats['hits'] + 1)
+        self.assertEquals(new_stats['misses'], stats['misses'])
+        # check that the update actually went through
+        self.assertEquals(self.reload_object(self.lee).name, u'lee3')
+
+    def test_different_columns(self):
+        self.lee.name = u'lee2'
+        self.lee.signal_change()
+        stats = app.db.get_statement_cache_stats()
+        self.lee.age = 26
+        self.lee.signal_change()
+        new_stats = app.db.get_statement_cache_stats()
+        self.assertEquals(new_stats['misses'], stats['misses'] + 1)
+
+    def test_statement_sql(self):
+        cache = storedatabase.StatementCache()
+        self.assertEquals(cache.get((HumanSchema, 'update', ('name', 'age'))),
+                          'UPDATE human SET name=?, age=? WHERE id=?')
+        self.assertEquals(cache.get((HumanSchema, 'delete', 1)),
+                          'DELETE FROM human WHERE id=?')
+        self.assertEquals(cache.get((HumanSchema, 'delete', 3)),
+                          'DELETE FROM human WHERE id IN (?, ?, ?)')
+
+    def test_eviction(self):
+        cache = storedatabase.StatementCache(size=2)
+        cache.get((HumanSchema, 'delete', 1))
+        cache.get((HumanSchema, 'delete', 2))
+        cache.get((HumanSchema, 'delete', 3))
+        self.assertEquals(cache.get_stats()['misses'], 3)
+        self.assert_(cache.get_stats()['size'] <= 2)
+
+class DatabaseObjectCacheTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.cache = storedatabase.DatabaseObjectCache()
+
+    def test_unlimited(self):
+        for i in xrange(100):
+            self.cache.set('test', i, str(i))
+        for i in xrange(100):
+            self.assertEquals(self.cache.get('test', i), str(i))
+        self.assertEquals(self.cache.get_stats()['test']['evictions'], 0)
+
+    def test_lru_eviction(self):
+        self.cache.set_capacity('test', 4)
+        for i in xrange(4):
+            self.cache.set('test', i, str(i))
+        # access 0, so that 1 is the least recently used object
+        self.cache.get('test', 0)
+        self.cache.set('test', 4, '4')
+        self.assert_(self.cache.key_exists('test', 0))
+        self.assert_(not self.cache.key_exists('test', 1))
+        self.assert_(self.cache.key_exists('test', 4))
+        stats = self.cache.get_stats()['test']
+        self.assert_(stats['size'] <= 4)
+        self.assert_(stats['evictions'] > 0)
+        self.assertEquals(stats['size'] + stats['evictions'], 5)
+
+    def test_categories_separate(self):
+        self.cache.set_capacity('small', 1)
+        self.cache.set('small', 1, 'a')
+        self.cache.set('big', 1, 'b')
+        self.cache.set('small', 2, 'c')
+        self.assert_(self.cache.key_exists('big', 1))
+        self.assertEquals(self.cache.get_stats()['big']['evictions'], 0)
+
+    def test_weight_func(self):
+        self.cache.set_capacity('test', 10, weight_func=len)
+        self.cache.set('test', 1, 'x' * 4)
+        self.cache.set('test', 2, 'x' * 4)
+        self.assertEquals(self.cache.get_stats()['test']['weight'], 8)
+        self.cache.set('test', 3, 'x' * 4)
+        self.assert_(not self.cache.key_exists('test', 1))
+        self.assert_(self.cache.get_stats()['test']['weight'] <= 10)
+
+    def test_hit_miss_stats(self):
+        self.cache.set('test', 1, 'a')
+        self.cache.get('test', 1)
+        self.assertRaises(KeyError, self.cache.get, 'test', 2)
+        stats = self.cache.get_stats()['test']
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['misses'], 1)
+        self.cache.reset_stats()
+        self.assertEquals(self.cache.get_stats()['test']['hits'], 0)
+
+    def test_remove_and_clear(self):
+        self.cache.set_capacity('test', 10)
+        self.cache.set('test', 1, 'a')
+        self.cache.set('test', 2, 'b')
+        self.cache.set('other', 1, 'c')
+        self.cache.remove('test', 1)
+        self.assertEquals(self.cache.get_stats()['test']['weight'], 1)
+        self.cache.clear('test')
+        self.assertEquals(self.cache.get_stats()['test']['size'], 0)
+        self.assert_(self.cache.key_exists('other', 1))
+        self.cache.clear_all()
+        self.assert_(not self.cache.key_exists('other', 1))
+
 class ValidationTest(FakeSchemaTest):
     def assert_object_valid(self, obj):
         obj.signal_change()
@@ -623,32 +911,88 @@ class CorruptReprTest(FakeSchemaTest):
         self.assertEqual(restored_lee.stuff, 'testing123')
         app.db.cursor.execute("SELECT stuff from human WHERE name='lee'")
         row = app.db.cursor.fetchone()
-        self.assertEqual(row[0], "'testing123'")
+        self.assertEqual(row[0], containerjson.dumps('testing123'))
 
     def test_repr_failure_no_handler(self):
         app.db.cursor.execute("UPDATE pcf_programmer SET stuff='{baddata' "
                               "WHERE name='ben'")
         with self.allow_warnings():
-            self.assertRaises(SyntaxError, self.reload_object, self.ben)
+            self.assertRaises(ValueError, self.reload_object, self.ben)
 
 class ConverterTest(StoreDatabaseTest):
-    def test_convert_repr(self):
+    def test_convert_container(self):
         converter = storedatabase.SQLiteConverter()
-        # _repr_to_sql ignores the schema_item parameter, so we can just pass
-        # in None
+        # _container_to_sql ignores the schema_item parameter, so we can just
+        # pass in None
         schema_item = None
-
-        test1 = """{'updated_parsed': (2009, 6, 5, 1, 30, 0, 4, 156, 0)}"""
-        val = converter._repr_from_sql(test1, schema_item)
-        self.assertEquals(val, {"updated_parsed":
-                                (2009, 6, 5, 1, 30, 0, 4, 156, 0)})
-
-        test2 = """{'updated_parsed': time.struct_time(tm_year=2009, \
-tm_mon=6, tm_mday=5, tm_hour=1, tm_min=30, tm_sec=0, tm_wday=4, tm_yday=156, \
-tm_isdst=0)}"""
-        val = converter._repr_from_sql(test2, schema_item)
-        self.assertEquals(val, {"updated_parsed":
-                                (2009, 6, 5, 1, 30, 0, 4, 156, 0)})
+        values = [
+            {u'updated_parsed': (2009, 6, 5, 1, 30, 0, 4, 156, 0)},
+            {1: True, 'etag': None, u'text': [u'a', 'b', 1.5, 10L]},
+            {u'__tuple__': u'not really a tuple'},
+            datetime(2009, 6, 5, 1, 30, 0, 100),
+        ]
+        for value in values:
+            sql_value = converter._container_to_sql(value, schema_item)
+            self.assertEquals(converter._container_from_sql(sql_value,
+                                                            schema_item),
+                              value)
+        # unicode and str values should stay distinct
+        sql_value = converter._container_to_sql([u'a', 'b'], schema_item)
+        restored = converter._container_from_sql(sql_value, schema_item)
+        self.assertEquals(type(restored[0]), unicode)
+        self.assertEquals(type(restored[1]), str)
+
+    def test_row_decoder(self):
+        converter = storedatabase.SQLiteConverter()
+        fields = [
+            ('id', SchemaInt()),
+            ('name', SchemaString()),
+            ('friend_names', SchemaList(SchemaString())),
+            ('developer', SchemaBool()),
+        ]
+        decoder = converter.make_row_decoder(fields)
+        # only friend_names and developer need converting
+        self.assertEquals([c[0] for c in decoder.conversions], [2, 3])
+        rows = [
+            (1, u'ben', containerjson.dumps([u'joe']), 1),
+            (2, u'joe', None, 0),
+        ]
+        self.assertEquals(list(decoder.decode_rows(rows)), [
+            (1, u'ben', [u'joe'], True),
+            (2, u'joe', None, False),
+        ])
+        decoder = converter.make_row_decoder(fields,
+                                             skip_columns=['friend_names'])
+        self.assertEquals([c[0] for c in decoder.conversions], [3])
+
+    def test_upgrade_repr_columns(self):
+        connection = sqlite3.connect(':memory:')
+        cursor = connection.cursor()
+        cursor.execute("CREATE TABLE test (id integer PRIMARY KEY, "
+                       "name text, data pythonrepr)")
+        struct_time_repr = ("{'updated_parsed': time.struct_time("
+                            "tm_year=2009, tm_mon=6, tm_mday=5, tm_hour=1, "
+                            "tm_min=30, tm_sec=0, tm_wday=4, tm_yday=156, "
+                            "tm_isdst=0)}")
+        rows = [
+            (1, u'a', "{u'a': [1, 2], 'b': datetime.datetime(2009, 6, 5)}"),
+            (2, u'b', struct_time_repr),
+            (3, u'c', None),
+            (4, u'd', "{baddata"),
+        ]
+        cursor.executemany("INSERT INTO test VALUES (?, ?, ?)", rows)
+        with self.allow_warnings():
+            databaseupgrade.upgrade202(cursor)
+        cursor.execute("SELECT data FROM test ORDER BY id")
+        data = [r[0] for r in cursor.fetchall()]
+        self.assertEquals(containerjson.loads(data[0]),
+                          {u'a': [1, 2], 'b': datetime(2009, 6, 5)})
+        self.assertEquals(containerjson.loads(data[1]),
+                          {u'updated_parsed':
+                           (2009, 6, 5, 1, 30, 0, 4, 156, 0)})
+        self.assertEquals(data[2], None)
+        # malformed data should be left for the malformed data handlers
+        self.assertEquals(data[3], "{baddata")
 
 class CorruptDDBObjectReprTest(StoreDatabaseTest):
     # test corrupt SchemaReprContainer columns in real DDBObjects
@@ -784,6 +1128,85 @@ class PreallocateTest(MiroTestCase):
         storage.close()
         self.check_preallocate_size(path, preallocate)
 
+class TuningProfileTest(MiroTestCase):
+    def get_pragma(self, storage, name):
+        storage.cursor.execute("PRAGMA %s" % name)
+        return storage.cursor.fetchone()[0]
+
+    def test_profile_for_size(self):
+        MB = storagetuning.MB
+        self.assertEquals(storagetuning.profile_for_size(0).name, 'small')
+        self.assertEquals(storagetuning.profile_for_size(100 * MB).name,
+                          'medium')
+        self.assertEquals(storagetuning.profile_for_size(10000 * MB).name,
+                          'large')
+
+    def test_tuning(self):
+        path = os.path.join(self.tempdir, 'testdb')
+        storage = storedatabase.LiveStorage(path)
+        profile = storage.tuning_profile
+        self.assertEquals(profile.name, 'small')
+        self.assertEquals(self.get_pragma(storage, 'cache_size'),
+                          -profile.cache_size)
+        self.assertEquals(self.get_pragma(storage, 'wal_autocheckpoint'),
+                          profile.wal_autocheckpoint)
+        storage.close()
+
+    def open_with_profile(self, path, profile):
+        """Open a LiveStorage that uses a specific tuning profile.
+
+        :returns: (storage, page_size_changes) tuple.  page_size_changes is
+        the list of page size changes that were scheduled.
+        """
+        # Only patch while opening the database.  This gets called more than
+        # once per test, so we can't leave the patches for tearDown.
+        with mock.patch('miro.data.storagetuning.profile_for_size',
+                        lambda db_size: profile):
+            with mock.patch('miro.eventloop.add_timeout',
+                            autospec=True) as mock_add_timeout:
+                storage = storedatabase.LiveStorage(path)
+        page_size_changes = []
+        for args, kwargs in mock_add_timeout.call_args_list:
+            if args[2] == 'change database page size':
+                page_size_changes.append((args[1], kwargs['args']))
+        return storage, page_size_changes
+
+    def test_change_page_size(self):
+        path = os.path.join(self.tempdir, 'testdb')
+        storedatabase.LiveStorage(path).close()
+        # pretend that the database grew big enough to need bigger pages
+        large_profile = storagetuning.PROFILES[-1]
+        storage, page_size_changes = self.open_with_profile(path,
+                                                            large_profile)
+        # the VACUUM shouldn't happen while we're opening the database
+        old_page_size = self.get_pragma(storage, 'page_size')
+        self.assertNotEquals(old_page_size, large_profile.page_size)
+        self.assertEquals(len(page_size_changes), 1)
+        func, args = page_size_changes[0]
+        func(*args)
+        self.assertEquals(self.get_pragma(storage, 'page_size'),
+                          large_profile.page_size)
+        self.assertEquals(self.get_pragma(storage, 'journal_mode'), 'wal')
+        storage.close()
+        # if the database shrinks, we should keep the bigger pages
+        storage, page_size_changes = self.open_with_profile(
+            path, storagetuning.PROFILES[0])
+        self.assertEquals(page_size_changes, [])
+        self.assertEquals(self.get_pragma(storage, 'page_size'),
+                          large_profile.page_size)
+        storage.close()
+
+    def test_mmap_size(self):
+        large_profile = storagetuning.PROFILES[-1]
+        with mock.patch('miro.data.storagetuning.MMAP_SUPPORTED', False):
+            self.assertEquals(storagetuning.calc_mmap_size(large_profile), 0)
+        with mock.patch('miro.data.storagetuning.MMAP_SUPPORTED', True):
+            self.assertEquals(storagetuning.calc_mmap_size(large_profile),
+                              large_profile.mmap_size)
+            # connections should split the mmap budget between them
+            self.assertEquals(storagetuning.calc_mmap_size(large_profile, 4),
+                              large_profile.mmap_size // 4)
+
 class TemporaryModeTest(MiroTestCase):
     # test getting an error when opening a new database and using an
     # in-memory database to work around it
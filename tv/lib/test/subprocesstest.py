@@ -3,12 +3,15 @@ import time
 import Queue
 
 from miro import app
+from miro import feeddiff
 from miro import moviedata
+from miro import prefs
 from miro import subprocessmanager
 from miro import workerprocess
 from miro.plat import resources
 from miro.test import mock
-from miro.test.framework import EventLoopTest, only_on_platforms
+from miro.test.framework import (MiroTestCase, EventLoopTest,
+                                 only_on_platforms)
 
 # setup some test messages/handlers
 class TestSubprocessHandler(subprocessmanager.SubprocessHandler):
@@ -243,9 +246,10 @@ class WorkerProcessTest(EventLoopTest):
     def setUp(self):
         EventLoopTest.setUp(self)
         # override the normal handler class with our own
-        workerprocess._subprocess_manager.handler_class = (
+        workerprocess._worker_pool.handler_class = (
                 UnittestWorkerProcessHandler)
-        workerprocess._subprocess_manager.restart_delay = 0
+        workerprocess._worker_pool.restart_delay = 0
+        app.config.set(prefs.WORKER_PROCESS_COUNT, 2)
         self.reset_results()
 
     def tearDown(self):
@@ -297,19 +301,135 @@ class FeedParserTest(WorkerProcessTest):
         self.assertEquals(self.result, None)
         self.assert_(isinstance(self.error, ValueError))
 
+    def test_feed_diff(self):
+        # test parsing a feed and diffing it in the worker process
+        workerprocess.startup()
+        path = os.path.join(resources.path("testdata/feedparsertests/feeds"),
+            "http___feeds_miroguide_com_miroguide_featured.xml")
+        msg = workerprocess.FeedDiffTask(open(path).read(),
+                                         feeddiff.FeedEntryIndex([]))
+        workerprocess.send(msg, self.callback, self.errback)
+        self.runEventLoop(4.0)
+        if self.error is not None:
+            raise self.error
+        self.assertEquals(self.result.parsed.entries, [])
+        self.assert_(self.result.entry_count > 0)
+        self.assertEquals(self.result.changed_entries, [])
+        self.assertEquals(self.result.vanished_ids, set())
+
     def test_crash(self):
         # force a crash of our subprocess right after we send the task
         workerprocess.startup()
-        original_pid = workerprocess._subprocess_manager.process.pid
         self.send_feedparser_task()
-        workerprocess._subprocess_manager.process.terminate()
+        worker = workerprocess._miro_task_queue.task_workers.values()[0]
+        original_pid = worker.process.pid
+        worker.process.terminate()
         with self.allow_warnings():
             self.runEventLoop(4.0)
         # check that we really restarted the subprocess
-        self.assertNotEqual(original_pid,
-                workerprocess._subprocess_manager.process.pid)
+        self.assertNotEqual(original_pid, worker.process.pid)
+        self.check_successful_result()
+
+    def test_crash_isolation(self):
+        # a crash in one worker shouldn't affect the other ones
+        workerprocess.startup()
+        workers = workerprocess._worker_pool.workers
+        self.assertEquals(len(workers), 2)
+        other_pid = workers[1].process.pid
+        workers[0].process.terminate()
+        with self.allow_warnings():
+            self.runEventLoop(1.0, timeoutNormal=True)
+        self.assertEquals(workers[1].process.pid, other_pid)
+        self.send_feedparser_task()
+        self.runEventLoop(4.0)
+        self.check_successful_result()
+
+    def test_crash_requeue(self):
+        # tasks sent to a worker that crashes should go to the other worker,
+        # without waiting for the crashed one to restart
+        workerprocess._worker_pool.restart_delay = 60
+        workerprocess.startup()
+        self.send_feedparser_task()
+        worker = workerprocess._miro_task_queue.task_workers.values()[0]
+        original_pid = worker.process.pid
+        worker.process.terminate()
+        with self.allow_warnings():
+            self.runEventLoop(4.0)
+            self.check_successful_result()
+            # the crashed worker should still be waiting to restart
+            self.assertEquals(worker.process.pid, original_pid)
+            workerprocess.shutdown()
+
+    def test_crash_count(self):
+        # tasks that keep crashing workers should fail
+        self.send_feedparser_task()
+        task_queue = workerprocess._miro_task_queue
+        worker = mock.Mock()
+        worker.task_ids = set()
+        for i in xrange(workerprocess.MAX_TASK_CRASHES):
+            self.assertEquals(self.error, None)
+            msg = task_queue.pending.pop()[0]
+            task_queue._send_to_worker(msg, worker)
+            task_queue.requeue_crashed_tasks(worker)
+        self.assert_(isinstance(self.error, workerprocess.WorkerCrashError))
+        self.assertEquals(task_queue.tasks_in_progress, {})
+        self.assertEquals(task_queue.pending.pop(), None)
+
+    def test_spread_tasks(self):
+        # tasks should be spread out between the workers
+        workerprocess.startup()
+        for i in range(4):
+            self.send_feedparser_task()
+        task_workers = workerprocess._miro_task_queue.task_workers
+        self.assertEquals(len(set(task_workers.values())), 2)
+
+    def test_cancel_pending(self):
+        # tasks waiting in the main process should be canceled right away
+        self.send_feedparser_task()
+        msg = workerprocess.MutagenTask('/foo/bar.mp3', self.tempdir)
+        workerprocess.send(msg, self.callback, self.errback)
+        workerprocess.cancel_tasks_for_files(['/foo/bar.mp3'])
+        task_queue = workerprocess._miro_task_queue
+        self.assert_(msg.task_id not in task_queue.tasks_in_progress)
+        self.assertEquals(len(task_queue.tasks_in_progress), 1)
+        workerprocess.startup()
+        self.runEventLoop(4.0)
         self.check_successful_result()
 
+    def test_dedupe_pending(self):
+        # identical tasks waiting in the main process should only get sent
+        # once, but the callback should get called for each of them
+        msg1 = workerprocess.MutagenTask('/foo/bar.mp3', self.tempdir)
+        msg2 = workerprocess.MutagenTask('/foo/bar.mp3', self.tempdir)
+        results = []
+        def callback(msg, result):
+            results.append(msg)
+        def errback(msg, error):
+            results.append(msg)
+        workerprocess.send(msg1, callback, errback)
+        workerprocess.send(msg2, callback, errback)
+        task_queue = workerprocess._miro_task_queue
+        self.assertEquals(task_queue.tasks_in_progress.keys(), [msg1.task_id])
+        self.assertEquals(
+                task_queue.get_stats()['MutagenTask']['deduplicated'], 1)
+        # canceling the task should cancel the duplicate too
+        workerprocess.cancel_tasks_for_files(['/foo/bar.mp3'])
+        self.assertEquals(task_queue.tasks_in_progress, {})
+        self.assertEquals(task_queue.duplicates, {})
+        self.assertEquals(results, [])
+
+    def test_bump(self):
+        # bumped tasks should get sent before other pending tasks
+        msgs = [workerprocess.MutagenTask('/foo/%d.mp3' % i, self.tempdir)
+                for i in range(3)]
+        for msg in msgs:
+            workerprocess.send(msg, self.callback, self.errback)
+        self.assertEquals(workerprocess.bump_tasks_for_files(['/foo/2.mp3']),
+                          1)
+        pending = workerprocess._miro_task_queue.pending
+        self.assertEquals([pending.pop()[0] for i in range(3)],
+                          [msgs[2], msgs[0], msgs[1]])
+
     def test_queue_before_start(self):
         # test sending tasks before we start the worker process
 
@@ -320,6 +440,100 @@ class FeedParserTest(WorkerProcessTest):
         self.runEventLoop(4.0)
         self.check_successful_result()
 
+class IndexedTaskQueueTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.queue = workerprocess.IndexedTaskQueue()
+
+    def make_mutagen_task(self, path):
+        return workerprocess.MutagenTask(path, self.tempdir)
+
+    def pop_all(self):
+        msgs = []
+        while True:
+            next_task = self.queue.pop()
+            if next_task is None:
+                return msgs
+            msgs.append(next_task[0])
+
+    def test_order(self):
+        # higher priority tasks come first.  Tasks with the same priority
+        # alternate between classes and are FIFO within a class.
+        mutagen1 = self.make_mutagen_task('/foo/1.mp3')
+        mutagen2 = self.make_mutagen_task('/foo/2.mp3')
+        movie_data = workerprocess.MovieDataProgramTask('/foo/3.mp4',
+                                                        self.tempdir)
+        feedparser = workerprocess.FeedparserTask('<rss />')
+        for msg in (mutagen1, mutagen2, movie_data, feedparser):
+            self.queue.add(msg)
+        self.assertEquals(len(self.queue), 4)
+        self.assertEquals(self.pop_all(),
+                          [feedparser, mutagen1, movie_data, mutagen2])
+        self.assertEquals(len(self.queue), 0)
+
+    def test_data(self):
+        msg = self.make_mutagen_task('/foo/1.mp3')
+        self.queue.add(msg, 'data')
+        self.assertEquals(self.queue.pop(), (msg, 'data'))
+
+    def test_dedupe(self):
+        msg1 = self.make_mutagen_task('/foo/1.mp3')
+        msg2 = self.make_mutagen_task('/foo/1.mp3')
+        self.assertEquals(self.queue.add(msg1), msg1)
+        self.assertEquals(self.queue.add(msg2), msg1)
+        self.assertEquals(self.pop_all(), [msg1])
+        # once msg1 is out of the queue, we shouldn't dedupe against it
+        self.assertEquals(self.queue.add(msg2), msg2)
+        # dedupe=False should allow duplicates
+        msg3 = self.make_mutagen_task('/foo/1.mp3')
+        self.assertEquals(self.queue.add(msg3, dedupe=False), msg3)
+        self.assertEquals(self.pop_all(), [msg2, msg3])
+        # feedparser tasks don't have a key, so they never get deduped
+        msg4 = workerprocess.FeedparserTask('<rss />')
+        msg5 = workerprocess.FeedparserTask('<rss />')
+        self.queue.add(msg4)
+        self.queue.add(msg5)
+        self.assertEquals(self.pop_all(), [msg4, msg5])
+
+    def test_remove(self):
+        msgs = [self.make_mutagen_task('/foo/%d.mp3' % i) for i in range(3)]
+        for msg in msgs:
+            self.queue.add(msg)
+        self.assertEquals(self.queue.remove(msgs[1].task_id), msgs[1])
+        self.assertEquals(self.queue.remove(msgs[1].task_id), None)
+        self.assertEquals(self.queue.remove_key(msgs[2].get_key()),
+                          [msgs[2]])
+        self.assertEquals(self.queue.remove_key(msgs[2].get_key()), [])
+        self.assertEquals(len(self.queue), 1)
+        self.assertEquals(self.pop_all(), [msgs[0]])
+
+    def test_bump(self):
+        msgs = [self.make_mutagen_task('/foo/%d.mp3' % i) for i in range(4)]
+        for msg in msgs:
+            self.queue.add(msg)
+        self.assertEquals(self.queue.bump(msgs[2].get_key()), 1)
+        self.assertEquals(self.queue.bump(msgs[3].get_key()), 1)
+        self.assertEquals(self.queue.bump(('not', 'queued')), 0)
+        self.assertEquals(len(self.queue), 4)
+        # bumped tasks can still be removed
+        self.queue.remove(msgs[2].task_id)
+        self.assertEquals(self.pop_all(), [msgs[3], msgs[0], msgs[1]])
+
+    def test_stats(self):
+        msg1 = self.make_mutagen_task('/foo/1.mp3')
+        msg2 = self.make_mutagen_task('/foo/2.mp3')
+        self.queue.add(msg1)
+        self.queue.add(msg2)
+        self.queue.add(self.make_mutagen_task('/foo/1.mp3'))
+        self.queue.remove(msg2.task_id)
+        self.assertEquals(self.queue.get_stats(), {
+            'MutagenTask': {
+                'queued': 1,
+                'deduplicated': 1,
+                'canceled': 1,
+            }
+        })
+
 class MovieDataTest(WorkerProcessTest):
 
     def setUp(self):
@@ -425,4 +639,3 @@ class MutagenTest(WorkerProcessTest):
 
 # TODO:
 #   Test task priority system in worker process
-#   Test that the CancelFileOperations message is handled properly
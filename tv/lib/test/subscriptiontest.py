@@ -2,6 +2,8 @@ import os
 
 from miro import subscription
 from miro import autodiscover
+from miro import feed
+from miro import feedupdate
 
 from miro.test.framework import MiroTestCase
 
@@ -319,3 +321,31 @@ class Testis_subscribe_links(MiroTestCase):
     def test_positive(self):
         is_s_l = subscription.is_subscribe_link
         self.assertEquals(is_s_l('http://subscribe.getdemocracy.com/'), True)
+
+class TestBulkSubscriber(MiroTestCase):
+    def test_add_subscriptions(self):
+        progress = []
+        subscriber = subscription.BulkSubscriber(
+            lambda handled, total: progress.append((handled, total)))
+        added, ignored = subscriber.add_subscriptions([
+            {'type': 'feed', 'url': u'http://example.com/feed'},
+            {'type': 'folder', 'title': u'Folder', 'children': [
+                {'type': 'feed', 'url': u'http://example.com/feed2'},
+                # same URL as the first feed, once it's normalized
+                {'type': 'feed', 'url': u'feed://example.com/feed'},
+            ]},
+        ])
+        self.assertEquals(len(added['feed']), 2)
+        self.assertEquals(len(ignored['feed']), 1)
+        self.assertEquals(progress, [(1, 3), (2, 3), (3, 3)])
+        feeds = list(feed.Feed.make_view(
+            "orig_url LIKE 'http://example.com/%'"))
+        self.assertEquals(sorted(f.get_url() for f in feeds),
+                          [u'http://example.com/feed',
+                           u'http://example.com/feed2'])
+        for f in feeds:
+            # the first fetch should be left to the update queue
+            self.assert_(f.loading)
+            self.assert_(f.download is None)
+            self.assert_(f.id in feedupdate.global_update_queue.timeouts)
+            feedupdate.cancel_update(f)
@@ -30,8 +30,14 @@
 """```workerprocess.py``` -- Miro worker subprocess
 
 To avoid UI freezing due to the GIL, we farm out all CPU-intensive backend
-tasks to this process.  See #17328 for more details.  Right now this just
-includes feedparser, but we could pretty easily extend this to other tasks.
+tasks to this process.  See #17328 for more details.  This includes
+parsing feeds, comparing them to the items we already have (see feeddiff),
+and reading metadata from media files.
+
+We run a pool of worker processes, by default one per CPU core.  The main
+process keeps tasks in MiroTaskQueue and only gives each worker a few at a
+time, so idle workers pick up new work while busy ones are still crunching.
+If a worker crashes, only the tasks sent to it get re-run.
 """
 
 from collections import deque, namedtuple
@@ -39,12 +45,14 @@ import itertools
 import logging
 import threading
 
+from miro import app
 from miro import clock
 from miro import eventloop
 from miro import feedparserutil
 from miro import filetags
 from miro import messagetools
 from miro import moviedata
+from miro import prefs
 from miro import subprocessmanager
 from miro import util
 
@@ -53,6 +61,14 @@ from miro.plat import utils
 class SubprocessTimeoutError(StandardError):
     """A task failed because the subprocess didn't respond in enough time."""
 
+class WorkerCrashError(StandardError):
+    """A task failed because the worker processes running it kept crashing.
+    """
+
+# If MAX_TASK_CRASHES workers crash while running a task, we assume the task
+# is what's crashing them and give up on it.
+MAX_TASK_CRASHES = 2
+
 # define messages/handlers
 
 class WorkerMessage(subprocessmanager.SubprocessMessage):
@@ -70,12 +86,45 @@ class TaskMessage(WorkerMessage):
         subprocessmanager.SubprocessMessage.__init__(self)
         self.task_id = TaskMessage._id_counter.next()
 
+    def get_key(self):
+        """Get a key that identifies duplicate tasks.
+
+        Tasks with the same key do the same work.  None means that the task
+        can't be deduplicated.
+        """
+        return None
+
 class FeedparserTask(TaskMessage):
     priority = 20
     def __init__(self, html):
         TaskMessage.__init__(self)
         self.html = html
 
+class FeedDiffTask(TaskMessage):
+    """Parse a feed and compare it to the items we already have.
+
+    The result is a feeddiff.FeedDiff.
+    """
+    priority = 20
+    def __init__(self, html, index):
+        TaskMessage.__init__(self)
+        self.html = html
+        self.index = index
+
+class FeedFileDiffTask(TaskMessage):
+    """Like FeedDiffTask, but read the feed from a file.
+
+    The feed is parsed a few entries at a time, see
+    feeddiff.calc_feed_diff_for_file().
+    """
+    priority = 20
+    def __init__(self, path, charset, index, stop_after_known):
+        TaskMessage.__init__(self)
+        self.path = path
+        self.charset = charset
+        self.index = index
+        self.stop_after_known = stop_after_known
+
 class MovieDataProgramTask(TaskMessage):
     priority = 10
     def __init__(self, source_path, screenshot_directory):
@@ -86,6 +135,9 @@ class MovieDataProgramTask(TaskMessage):
     def __str__(self):
         return 'MovieDataProgramTask (path: %s)' % self.source_path
 
+    def get_key(self):
+        return (self.__class__, self.source_path)
+
 class MutagenTask(TaskMessage):
     priority = 10
     def __init__(self, source_path, cover_art_directory):
@@ -96,6 +148,9 @@ class MutagenTask(TaskMessage):
     def __str__(self):
         return 'MutagenTask (path: %s)' % self.source_path
 
+    def get_key(self):
+        return (self.__class__, self.source_path)
+
 class CancelFileOperations(TaskMessage):
     """Cancel mutagen/movie data tasks for a set of path."""
     priority = 0
@@ -111,6 +166,14 @@ class TaskResult(subprocessmanager.SubprocessResponse):
         self.task_id = task_id
         self.result = result
 
+class TasksCanceled(subprocessmanager.SubprocessResponse):
+    """Tell the main process which tasks a CancelFileOperations removed.
+
+    These tasks will never send back a TaskResult.
+    """
+    def __init__(self, task_ids):
+        self.task_ids = task_ids
+
 class MovieDataTaskStatus(subprocessmanager.SubprocessResponse):
     """Report when we are handling movie data tasks.
 
@@ -189,12 +252,17 @@ class WorkerProcessHandler(subprocessmanager.SubprocessHandler):
 
     def handle_cancel_file_operations(self, msg):
         path_set = set(msg.paths)
-        self.task_queue.cancel_file_operations(path_set)
+        canceled = self.task_queue.cancel_file_operations(path_set)
         # we need to handle main_thread_tasks, since those skip the task
         # queue
-        filtered_tasks = deque(t for t in self.main_thread_tasks
-                               if t.source_path not in path_set)
+        filtered_tasks = deque()
+        for method, task in self.main_thread_tasks:
+            if task.source_path in path_set:
+                canceled.append(task.task_id)
+            else:
+                filtered_tasks.append((method, task))
         self.main_thread_tasks = filtered_tasks
+        TasksCanceled(canceled).send_to_main_process()
         return None
 
     # handle_movie_data_program_task gets called in the main thread, unlike
@@ -215,6 +283,22 @@ class WorkerProcessHandler(subprocessmanager.SubprocessHandler):
         parsed_feed['bozo_exception'] = None
         return parsed_feed
 
+    def handle_feed_diff_task(self, msg):
+        # feeddiff imports item, which ends up importing this module, so we
+        # can't import it at the top
+        from miro import feeddiff
+        parsed_feed = feedparserutil.parse(msg.html)
+        diff = feeddiff.calc_feed_diff(parsed_feed, msg.index)
+        diff.parsed['bozo_exception'] = None
+        return diff
+
+    def handle_feed_file_diff_task(self, msg):
+        from miro import feeddiff
+        diff = feeddiff.calc_feed_diff_for_file(msg.path, msg.index,
+                msg.charset, msg.stop_after_known)
+        diff.parsed['bozo_exception'] = None
+        return diff
+
     def handle_mutagen_task(self, msg):
         return filetags.process_file(msg.source_path, msg.cover_art_directory)
 
@@ -222,48 +306,193 @@ class WorkerProcessHandler(subprocessmanager.SubprocessHandler):
         with util.alarm(2):
             return self.handle_mutagen_task(msg)
 
-class _SinglePriorityQueue(object):
-    """Manages tasks at a single priority for WorkerTaskQueue
+# TaskMessage classes that work on a file.  These are the tasks that
+# cancel_tasks_for_files() and bump_tasks_for_files() affect.
+FILE_TASK_CLASSES = (MutagenTask, MovieDataProgramTask)
 
-    For any given priority we want to do the following:
+class _QueueEntry(object):
+    __slots__ = ('msg', 'data', 'removed')
+
+    def __init__(self, msg, data):
+        self.msg = msg
+        self.data = data
+        self.removed = False
+
+class IndexedTaskQueue(object):
+    """Queue of TaskMessages indexed by task id and task key.
+
+    Tasks come out in priority order.  For any given priority we want to do
+    the following:
         - If there is more than one TaskMessage class with that priority, we
           want to alternate handling tasks between them.
         - For a given TaskMessage class, we want to handle tasks FIFO.
+
+    Bumped tasks come out before anything else.
+
+    Removing a task just marks its entry as removed, the entry gets skipped
+    when it reaches the front of its FIFO.  This means that adding,
+    removing, bumping and deduplicating tasks are all O(1).
+
+    This class isn't thread-safe.
     """
-    def __init__(self, priority):
-        self.priority = priority
-        # map message classes to FIFO deques for that class
+    def __init__(self):
+        # priorities that we have FIFOs for, highest first
+        self.priorities = []
+        # maps priorities to dicts that map message classes to FIFOs
         self.fifo_map = {}
-        # set up our structure for each task with our priority
-        for cls in util.all_subclasses(TaskMessage):
-            if cls.priority == priority:
-                self.fifo_map[cls] = deque()
-        # fifo_cycler is used to cycle through each fifo
-        self.fifo_cycler = itertools.cycle(self.fifo_map.values())
-        self.fifo_count = len(self.fifo_map)
+        # maps priorities to a deque of message classes.  We rotate it to
+        # cycle through the FIFOs.
+        self.class_order = {}
+        self.bumped = deque()
+        # maps task ids to entries
+        self.entries = {}
+        # maps task keys to dicts mapping task ids to entries
+        self.key_map = {}
+        # maps message classes to dicts of counts for get_stats()
+        self.stats = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _get_stats(self, message_class):
+        try:
+            return self.stats[message_class]
+        except KeyError:
+            stats = self.stats[message_class] = {
+                'queued': 0,
+                'deduplicated': 0,
+                'canceled': 0,
+            }
+            return stats
+
+    def _get_fifo(self, msg):
+        try:
+            fifos = self.fifo_map[msg.priority]
+        except KeyError:
+            fifos = self.fifo_map[msg.priority] = {}
+            self.class_order[msg.priority] = deque()
+            self.priorities.append(msg.priority)
+            self.priorities.sort(reverse=True)
+        try:
+            return fifos[msg.__class__]
+        except KeyError:
+            fifo = fifos[msg.__class__] = deque()
+            self.class_order[msg.priority].append(msg.__class__)
+            return fifo
+
+    def add(self, msg, data=None, dedupe=True, bump=False):
+        """Add a task to the queue.
+
+        :param msg: TaskMessage to add
+        :param data: extra data to return with msg from pop()
+        :param dedupe: if a task with the same key is already queued, don't
+        add msg.
+        :param bump: put msg at the front of the queue
+        :returns: the queued TaskMessage.  This will be a different message
+        than msg if it was deduplicated.
+        """
+        key = msg.get_key()
+        stats = self._get_stats(msg.__class__)
+        if dedupe and key is not None and self.key_map.get(key):
+            stats['deduplicated'] += 1
+            return self.key_map[key].itervalues().next().msg
+        entry = _QueueEntry(msg, data)
+        self.entries[msg.task_id] = entry
+        if key is not None:
+            self.key_map.setdefault(key, {})[msg.task_id] = entry
+        stats['queued'] += 1
+        if bump:
+            self.bumped.appendleft(entry)
+        else:
+            self._get_fifo(msg).append(entry)
+        return msg
+
+    def _forget_entry(self, entry):
+        entry.removed = True
+        msg = entry.msg
+        del self.entries[msg.task_id]
+        key = msg.get_key()
+        if key is not None:
+            entries_for_key = self.key_map[key]
+            del entries_for_key[msg.task_id]
+            if not entries_for_key:
+                del self.key_map[key]
+        self.stats[msg.__class__]['queued'] -= 1
+
+    def _pop_from_fifo(self, fifo):
+        while fifo:
+            entry = fifo.popleft()
+            if not entry.removed:
+                self._forget_entry(entry)
+                return entry
+        return None
 
-    def add_task(self, handler_method, msg):
-        self.fifo_map[msg.__class__].append((handler_method, msg))
+    def pop(self):
+        """Remove the next task from the queue.
 
-    def get_next_task(self):
-        for i, fifo in enumerate(self.fifo_cycler):
-            if i >= self.fifo_count:
-                # no tasks in any of our fifos
-                return None
-            if fifo:
-                return fifo.popleft()
+        :returns: (msg, data) tuple, or None if the queue is empty
+        """
+        entry = self._pop_from_fifo(self.bumped)
+        if entry is not None:
+            return entry.msg, entry.data
+        for priority in self.priorities:
+            class_order = self.class_order[priority]
+            fifos = self.fifo_map[priority]
+            for i in xrange(len(class_order)):
+                fifo = fifos[class_order[0]]
+                class_order.rotate(-1)
+                entry = self._pop_from_fifo(fifo)
+                if entry is not None:
+                    return entry.msg, entry.data
+        return None
 
-    def filter_messages(self, filterfunc, message_class):
-        """Remove messages from the queue
+    def remove(self, task_id):
+        """Remove a task from the queue.
 
-        :param filterfunc: function to determine if messages should stay
-        :param message_class: type of messages to filter
+        :returns: the removed TaskMessage or None if it wasn't queued
         """
-        fifo = self.fifo_map[message_class]
-        new_items = tuple((method, msg) for (method, msg) in fifo
-                         if filterfunc(msg))
-        fifo.clear()
-        fifo.extend(new_items)
+        try:
+            entry = self.entries[task_id]
+        except KeyError:
+            return None
+        self._forget_entry(entry)
+        self.stats[entry.msg.__class__]['canceled'] += 1
+        return entry.msg
+
+    def remove_key(self, key):
+        """Remove all tasks for a key from the queue.
+
+        :returns: list of removed TaskMessages
+        """
+        entries_for_key = self.key_map.get(key)
+        if not entries_for_key:
+            return []
+        return [self.remove(task_id) for task_id in entries_for_key.keys()]
+
+    def bump(self, key):
+        """Move tasks for a key to the front of the queue.
+
+        :returns: number of tasks that were bumped
+        """
+        entries_for_key = self.key_map.get(key)
+        if not entries_for_key:
+            return 0
+        for task_id, entry in entries_for_key.items():
+            # Replace the entry with a new one in our bumped deque.  The old
+            # entry gets skipped when it reaches the front of its FIFO.
+            entry.removed = True
+            new_entry = _QueueEntry(entry.msg, entry.data)
+            self.entries[task_id] = entries_for_key[task_id] = new_entry
+            self.bumped.appendleft(new_entry)
+        return len(entries_for_key)
+
+    def get_stats(self):
+        """Get counts of queued, deduplicated and canceled tasks.
+
+        :returns: dict mapping message class names to dicts of counts
+        """
+        return dict((cls.__name__, stats.copy())
+                    for cls, stats in self.stats.iteritems())
 
 class WorkerTaskQueue(object):
     """Store the pending tasks for the worker process.
@@ -277,25 +506,14 @@ class WorkerTaskQueue(object):
     def __init__(self):
         self.should_quit = False
         self.condition = threading.Condition()
-        # queues_by_priority contains a _SinglePriorityQueue for each priority
-        # level, ordered from highest to lowest priority
-        self.queues_by_priority = []
-        # queue_map maps priority levels to queues
-        self.queue_map = {}
-        self._init_queues()
-
-    def _init_queues(self):
-        all_prorities = set(cls.priority for
-                            cls in util.all_subclasses(TaskMessage))
-        for priority in sorted(all_prorities, reverse=True):
-            queue = _SinglePriorityQueue(priority)
-            self.queues_by_priority.append(queue)
-            self.queue_map[queue.priority] = queue
+        self.queue = IndexedTaskQueue()
 
     def add_task(self, handler_method, msg):
         """Add a new task to the queue.  """
         with self.condition:
-            self.queue_map[msg.priority].add_task(handler_method, msg)
+            # The main process already deduplicated tasks, if we get 2 tasks
+            # with the same key, it's expecting 2 responses.
+            self.queue.add(msg, handler_method, dedupe=False)
             self.condition.notify()
 
     def get_next_task(self):
@@ -323,23 +541,26 @@ class WorkerTaskQueue(object):
             return self._get_next_task()
 
     def _get_next_task(self):
-        for queue in self.queues_by_priority:
-            next_for_queue = queue.get_next_task()
-            if next_for_queue is not None:
-                return next_for_queue
-        # no tasks in any of our queues
-        return None
+        next_task = self.queue.pop()
+        if next_task is None:
+            return None
+        msg, handler_method = next_task
+        return handler_method, msg
 
     def cancel_file_operations(self, path_set):
-        """Cancels all mutagen/movie data tasks for a list of paths."""
+        """Cancels all mutagen/movie data tasks for a list of paths.
+
+        :returns: list of task ids that were canceled
+        """
         # Acquire our lock as soon as possible.  We want to prevent other
         # tasks from getting tasks, since they may be about to deleted.
         with self.condition:
-            def filter_func(msg):
-                return msg.source_path not in path_set
-            for cls in (MutagenTask, MovieDataProgramTask):
-                queue = self.queue_map[cls.priority]
-                queue.filter_messages(filter_func, cls)
+            canceled = []
+            for path in path_set:
+                for cls in FILE_TASK_CLASSES:
+                    canceled.extend(msg.task_id for msg in
+                                    self.queue.remove_key((cls, path)))
+            return canceled
 
     def shutdown(self):
         # should be save to set this without the lock, since it's a boolean
@@ -385,14 +606,16 @@ MovieDataTaskStatusInfo = namedtuple('MovieDataTaskStatusInfo',
                                      'task_id start_time')
 
 class WorkerProcessResponder(subprocessmanager.SubprocessResponder):
-    def __init__(self):
+    def __init__(self, worker):
         subprocessmanager.SubprocessResponder.__init__(self)
+        self.worker = worker
         self.worker_ready = False
         self.startup_message = None
         self.movie_data_task_status = None
 
     def on_startup(self):
-        self.startup_message.send_to_process()
+        self.worker.send_message(self.startup_message)
+        _miro_task_queue.resend_tasks(self.worker)
         _miro_task_queue.run_pending_tasks()
 
     def on_shutdown(self):
@@ -400,12 +623,22 @@ class WorkerProcessResponder(subprocessmanager.SubprocessResponder):
         self.process_handler_queue()
         self.worker_ready = False
 
+    def on_crash(self):
+        # handle the results that we already got, then give the rest of our
+        # tasks to the other workers instead of waiting for our restart
+        self.process_handler_queue()
+        self.worker_ready = False
+        _miro_task_queue.requeue_crashed_tasks(self.worker)
+
     def on_restart(self):
         self.worker_ready = False
 
     def handle_task_result(self, msg):
         _miro_task_queue.process_result(msg)
 
+    def handle_tasks_canceled(self, msg):
+        _miro_task_queue.forget_tasks(msg.task_ids)
+
     def handle_worker_process_ready(self, msg):
         self.worker_ready = True
 
@@ -421,42 +654,196 @@ class MiroTaskQueue(object):
 
     Responsible for:
         - Storing callbacks/errbacks for each pending task
+        - Deciding which worker process runs each task
         - Calling the callback/errback for a finished task
+
+    Tasks wait here, ordered by priority, until a worker has room for them.
+    While they wait, tasks can be deduplicated, canceled, or bumped to the
+    front of the queue.
     """
     def __init__(self):
-        # maps task_ids to (msg, callback, errback) tuples
-        self.tasks_in_progress = {}
+        self.reset()
 
     def reset(self):
+        # maps task_ids to (msg, callback, errback) tuples
         self.tasks_in_progress = {}
+        # messages waiting for a worker
+        self.pending = IndexedTaskQueue()
+        # maps task_ids to the worker that was sent the task
+        self.task_workers = {}
+        # maps task_ids to lists of (msg, callback, errback) tuples for
+        # tasks that were deduplicated into that task
+        self.duplicates = {}
+        # maps task_ids to the number of workers that crashed running them
+        self.crash_counts = {}
 
     def add_task(self, msg, callback, errback):
-        """Add a new task to the queue."""
+        """Add a new task to the queue.
+
+        If an identical task is already waiting for a worker, we don't send
+        msg.  Instead, we call callback/errback with the result of the other
+        task.
+        """
+        queued_msg = self.pending.add(msg)
+        if queued_msg is not msg:
+            self.duplicates.setdefault(queued_msg.task_id, []).append(
+                (msg, callback, errback))
+            return
         self.tasks_in_progress[msg.task_id] = (msg, callback, errback)
-        if _subprocess_manager.is_running:
-            msg.send_to_process()
+        self.run_pending_tasks()
+
+    def run_pending_tasks(self):
+        """Send pending tasks to workers that have room for them."""
+        while _worker_pool.has_room():
+            next_task = self.pending.pop()
+            if next_task is None:
+                return
+            msg = next_task[0]
+            self._send_to_worker(msg, _worker_pool.choose_worker(msg))
+
+    def _send_to_worker(self, msg, worker):
+        self.task_workers[msg.task_id] = worker
+        worker.task_ids.add(msg.task_id)
+        worker.send_message(msg)
+
+    def _forget_task(self, task_id):
+        del self.tasks_in_progress[task_id]
+        self.duplicates.pop(task_id, None)
+        self.crash_counts.pop(task_id, None)
+        worker = self.task_workers.pop(task_id, None)
+        if worker is not None:
+            worker.task_ids.discard(task_id)
 
     def process_result(self, reply):
-        """Process a TaskResult from our subprocess."""
-        msg, callback, errback = self.tasks_in_progress.pop(reply.task_id)
-        if isinstance(reply.result, Exception):
-            errback(msg, reply.result)
-        else:
-            callback(msg, reply.result)
+        """Process a TaskResult from one of our subprocesses."""
+        try:
+            msg, callback, errback = self.tasks_in_progress[reply.task_id]
+        except KeyError:
+            logging.warn("TaskResult for unknown task: %s", reply.task_id)
+            return
+        duplicates = self.duplicates.get(reply.task_id, [])
+        self._forget_task(reply.task_id)
+        # the worker has room for another task now
+        self.run_pending_tasks()
+        for msg, callback, errback in [(msg, callback, errback)] + duplicates:
+            if isinstance(reply.result, Exception):
+                errback(msg, reply.result)
+            else:
+                callback(msg, reply.result)
 
-    def run_pending_tasks(self):
-        """Rerun all tasks in the queue."""
-        for msg, callback, errback in self.tasks_in_progress.values():
-            msg.send_to_process()
+    def forget_tasks(self, task_ids):
+        """Forget about tasks that a worker canceled."""
+        for task_id in task_ids:
+            if task_id in self.tasks_in_progress:
+                self._forget_task(task_id)
+        self.run_pending_tasks()
+
+    def resend_tasks(self, worker):
+        """Resend tasks to a worker after it restarts."""
+        for task_id in worker.task_ids:
+            worker.send_message(self.tasks_in_progress[task_id][0])
+
+    def requeue_tasks(self, worker):
+        """Move the tasks sent to a worker back to the pending queue.
+
+        This is used when the worker process is shutdown.
+        """
+        # bumped tasks get pushed to the front of the queue, so add them
+        # newest first to keep them in order.
+        for task_id in sorted(worker.task_ids, reverse=True):
+            del self.task_workers[task_id]
+            self.pending.add(self.tasks_in_progress[task_id][0],
+                             dedupe=False, bump=True)
+        worker.task_ids.clear()
+
+    def requeue_crashed_tasks(self, worker):
+        """Move the tasks sent to a worker that crashed to other workers.
+
+        We do this right away, rather than waiting for the worker to restart.
+        Tasks that were running during MAX_TASK_CRASHES crashes fail with a
+        WorkerCrashError instead.
+        """
+        for task_id in list(worker.task_ids):
+            crash_count = self.crash_counts.get(task_id, 0) + 1
+            if crash_count >= MAX_TASK_CRASHES:
+                self.process_result(TaskResult(task_id, WorkerCrashError()))
+            else:
+                self.crash_counts[task_id] = crash_count
+        self.requeue_tasks(worker)
+        self.run_pending_tasks()
+
+    def cancel_file_operations(self, paths):
+        """Cancel mutagen and movie data tasks for a list of paths.
+
+        Canceled tasks never get their callback or errback called.
+        """
+        for path in paths:
+            for cls in FILE_TASK_CLASSES:
+                for msg in self.pending.remove_key((cls, path)):
+                    self._forget_task(msg.task_id)
+        path_set = set(paths)
+        for worker in _worker_pool.workers:
+            if worker.is_running:
+                # let the worker tell us what it canceled with a
+                # TasksCanceled message.
+                msg = CancelFileOperations(paths)
+                self.tasks_in_progress[msg.task_id] = (msg, _null_callback,
+                                                       _null_callback)
+                self._send_to_worker(msg, worker)
+            else:
+                # the tasks will get resent when the worker restarts.  Just
+                # forget about them now.
+                for task_id in list(worker.task_ids):
+                    msg = self.tasks_in_progress[task_id][0]
+                    if (isinstance(msg, FILE_TASK_CLASSES) and
+                            msg.source_path in path_set):
+                        self._forget_task(task_id)
+
+    def bump_tasks_for_files(self, paths):
+        """Move mutagen and movie data tasks for a list of paths to the
+        front of the queue.
+
+        :returns: number of tasks that were bumped
+        """
+        count = 0
+        for path in paths:
+            for cls in FILE_TASK_CLASSES:
+                count += self.pending.bump((cls, path))
+        return count
+
+    def get_stats(self):
+        """Get queue-depth stats for each task class.
+
+        :returns: dict mapping message class names to dicts with the keys
+        queued, deduplicated, canceled, and running.
+        """
+        stats = self.pending.get_stats()
+        for task_id in self.task_workers:
+            name = self.tasks_in_progress[task_id][0].__class__.__name__
+            class_stats = stats.setdefault(name, {
+                'queued': 0,
+                'deduplicated': 0,
+                'canceled': 0,
+            })
+            class_stats['running'] = class_stats.get('running', 0) + 1
+        for class_stats in stats.itervalues():
+            class_stats.setdefault('running', 0)
+        return stats
+
+def _null_callback(msg, result):
+    pass
 
 _miro_task_queue = MiroTaskQueue()
 
-# Manage subprocess
+# Manage subprocesses
 class WorkerSubprocessManager(subprocessmanager.SubprocessManager):
-    def __init__(self):
+    def __init__(self, handler_class=WorkerProcessHandler, restart_delay=60):
         subprocessmanager.SubprocessManager.__init__(self, WorkerMessage,
-                WorkerProcessResponder(), WorkerProcessHandler)
+                WorkerProcessResponder(self), handler_class,
+                restart_delay=restart_delay)
         self.check_hung_timeout = None
+        # ids of the tasks that we sent to this worker
+        self.task_ids = set()
 
     def _start(self):
         subprocessmanager.SubprocessManager._start(self)
@@ -493,22 +880,105 @@ class WorkerSubprocessManager(subprocessmanager.SubprocessManager):
         else:
             self.schedule_check_subprocess_hung()
 
-_subprocess_manager = WorkerSubprocessManager()
+    def count_tasks(self, message_class):
+        """Count how many tasks of a given class we've been sent."""
+        count = 0
+        for task_id in self.task_ids:
+            msg = _miro_task_queue.tasks_in_progress[task_id][0]
+            if isinstance(msg, message_class):
+                count += 1
+        return count
 
-def startup(thread_count=3):
-    """Startup the worker process."""
+class WorkerProcessPool(object):
+    """Manages the set of worker processes.
+
+    handler_class and restart_delay get passed to the
+    WorkerSubprocessManager for each worker.
+    """
+    def __init__(self):
+        self.workers = []
+        self.handler_class = WorkerProcessHandler
+        self.restart_delay = 60
+        self.tasks_per_worker = 1
+
+    def start(self, process_count, thread_count):
+        if self.workers:
+            return
+        # Give each worker enough tasks to keep its threads busy, plus 1
+        # for its main thread.
+        self.tasks_per_worker = thread_count + 1
+        for i in xrange(process_count):
+            worker = WorkerSubprocessManager(self.handler_class,
+                                             self.restart_delay)
+            worker.responder.startup_message = WorkerStartupInfo(thread_count)
+            self.workers.append(worker)
+        for worker in self.workers:
+            worker.start()
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown()
+            _miro_task_queue.requeue_tasks(worker)
+        self.workers = []
 
-    startup_msg = WorkerStartupInfo(thread_count)
-    _subprocess_manager.responder.startup_message = startup_msg
-    _subprocess_manager.start()
+    def choose_worker(self, msg):
+        """Pick a worker to send a task to.
+
+        We try to spread out tasks of the same kind, then to balance the
+        total number of tasks.  Only workers that are running and have room
+        for more tasks are considered.
+
+        :returns: WorkerSubprocessManager or None if no worker has room
+        """
+        best_worker = best_key = None
+        for worker in self.workers:
+            if not self._can_accept_task(worker):
+                continue
+            key = (worker.count_tasks(msg.__class__), len(worker.task_ids))
+            if best_key is None or key < best_key:
+                best_worker, best_key = worker, key
+        return best_worker
+
+    def has_room(self):
+        """Check if any worker has room for another task."""
+        for worker in self.workers:
+            if self._can_accept_task(worker):
+                return True
+        return False
+
+    def _can_accept_task(self, worker):
+        # skip workers that aren't running, that crashed and are waiting to
+        # restart, or that are full.
+        return (worker.is_running and worker.thread.isAlive() and
+                len(worker.task_ids) < self.tasks_per_worker)
+
+_worker_pool = WorkerProcessPool()
+
+def calc_process_count():
+    """Get the number of worker processes to run."""
+    count = app.config.get(prefs.WORKER_PROCESS_COUNT)
+    if count <= 0:
+        count = utils.get_logical_cpu_count()
+    return count
+
+def startup(thread_count=3, process_count=None):
+    """Startup the worker processes.
+
+    :param thread_count: number of threads for each process
+    :param process_count: number of processes to run.  If None, we use the
+    WORKER_PROCESS_COUNT pref, or the number of CPU cores if that's 0.
+    """
+    if process_count is None:
+        process_count = calc_process_count()
+    _worker_pool.start(process_count, thread_count)
 
 def shutdown():
-    """Shutdown the worker process."""
-    _subprocess_manager.shutdown()
+    """Shutdown the worker processes."""
+    _worker_pool.shutdown()
 
 # API for sending tasks
 def send(msg, callback, errback):
-    """Send a message to the worker process.
+    """Send a message to a worker process.
 
     :param msg: Message to send
     :param callback: function to call on success
@@ -517,10 +987,23 @@ def send(msg, callback, errback):
     _miro_task_queue.add_task(msg, callback, errback)
 
 def cancel_tasks_for_files(paths):
-    """Cancel mutagen and movie data tasks for a list of paths."""
-    msg = CancelFileOperations(paths)
-    # we don't care about the return value, but we still want to use the task
-    # queue to queue up this message.
-    def null_callback(msg, result):
-        pass
-    send(msg, null_callback, null_callback)
+    """Cancel mutagen and movie data tasks for a list of paths.
+
+    This gets sent to every worker process.
+    """
+    _miro_task_queue.cancel_file_operations(paths)
+
+def bump_tasks_for_files(paths):
+    """Move mutagen and movie data tasks for a list of paths to the front of
+    the queue.
+
+    Use this when the user is waiting for the metadata for those files.
+    """
+    return _miro_task_queue.bump_tasks_for_files(paths)
+
+def get_task_stats():
+    """Get queue-depth stats for each task class.
+
+    See MiroTaskQueue.get_stats() for the format.
+    """
+    return _miro_task_queue.get_stats()